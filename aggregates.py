@@ -0,0 +1,509 @@
+import numpy as np
+import pandas as pd
+from dash_table.Format import Format, Scheme
+
+# Decimals of the percentages in the frequency tables, as displayed.
+PERCENTAGE_DECIMALS = 1
+
+RATING_COLUMNS = ['r_stamina', 'r_tenacity', 'r_precision', 'r_reaction', 'r_accuracy', 'r_agility']
+
+# Frequency tables of categorical columns: name -> (column, label of the values in the table). Adding a summary here is
+# enough to have it counted and tabulated, see summarise.
+SUMMARIES = {
+    'issues': ('error_reason', 'Error'),
+    'country': ('country', 'Country'),
+    'speciality': (5, 'Speciality'),  # The speciality question is only known by its position in the form.
+    'first_collab': ('first_collab', 'First Collab'),
+}
+
+
+def get_summary_column(columns, name):
+    """
+    :param columns: columns of the form data
+    :param name: name of a summary in SUMMARIES
+    :return: column summarised by the summary
+    """
+    column = SUMMARIES[name][0]
+    if isinstance(column, int):
+        return columns[column]
+    return column
+
+
+def get_count_columns(columns):
+    """
+    Returns the columns of the form data that are summarised as frequency tables.
+    :param columns: columns of the form data
+    :return: list of column names
+    """
+    return [get_summary_column(columns, name) for name in SUMMARIES] + RATING_COLUMNS
+
+
+def count_values(data, columns):
+    """
+    Count the values of several columns at once: the categorical codes of all columns are offset into one range and
+    counted with a single bincount, instead of a value_counts per column. Categorical columns are counted by their codes,
+    other columns are factorized first.
+    :param data: form data
+    :param columns: columns to count
+    :return: dict of value counts per column, missing values are not counted
+    """
+    codes = []
+    values = []
+    offset = 0
+    for c in columns:
+        if pd.api.types.is_categorical_dtype(data[c]):
+            # Already coded, see schema.py.
+            column_codes, column_values = data[c].cat.codes.to_numpy(), data[c].cat.categories
+        else:
+            column_codes, column_values = pd.factorize(data[c])
+        codes.append(column_codes[column_codes >= 0].astype('int64') + offset)
+        values.append(column_values)
+        offset += len(column_values)
+
+    counts = np.bincount(np.concatenate(codes), minlength=offset) if codes else np.array([], dtype='int64')
+
+    value_counts = {}
+    start = 0
+    for c, column_values in zip(columns, values):
+        column_counts = counts[start:start + len(column_values)]
+        # Categories without rows are not counted, like values that do not occur.
+        value_counts[c] = pd.Series(column_counts, index=column_values, name=c, dtype='int64')[column_counts > 0]
+        start += len(column_values)
+
+    return value_counts
+
+
+# Grains of the response counts over time: name -> pandas frequency of a series indexed by the start of each period.
+TIME_GRAINS = {'hour': 'H', 'day': 'D', 'week': 'W-MON'}
+
+
+def count_hours(timestamps):
+    """
+    Count the number of responses per hour.
+    :param timestamps: series of timestamps, or of timestamp strings
+    :return: series of counts indexed by hour
+    """
+    hours = pd.to_datetime(timestamps).dt.floor('H')
+    return hours.value_counts()
+
+
+def roll_up(hours, grain):
+    """
+    Sum counts per hour into a coarser grain.
+    :param hours: series of counts indexed by hour
+    :param grain: name of a grain in TIME_GRAINS
+    :return: series of counts indexed by the start of each period
+    """
+    if grain == 'hour':
+        return hours
+    periods = hours.index.floor('D')
+    if grain == 'week':
+        # Weeks start on Monday.
+        periods = periods - pd.to_timedelta(periods.dayofweek, unit='D')
+    return hours.groupby(periods).sum()
+
+
+class CrossFilterCube:
+    """
+    Response counts by country and speciality, the answers the user summary is cross-filtered by, crossed with each
+    other summarised column, the error flag and the day of the response. Every column has its own array of counts by
+    country, speciality and value of the column, so the counts of a column among the responses of a country and/or a
+    speciality are a slice and a sum of an array. Its size depends on the number of distinct answers, not on the number
+    of responses. Days are too many for an array of every country, speciality and day, so only the counts of the
+    days that have responses are kept, see add_sparse_counts.
+    """
+
+    # Measures counted sparsely.
+    SPARSE_MEASURES = ['day']
+
+    def __init__(self, columns):
+        """
+        :param columns: columns of the form data
+        """
+        self.dimensions = [get_summary_column(columns, 'country'), get_summary_column(columns, 'speciality')]
+        self.measures = [c for c in get_count_columns(columns) if c not in self.dimensions] + ['error', 'day']
+        # Values along each axis. Position 0 of the country and speciality axes counts the responses without an answer,
+        # position i the value at i - 1.
+        self.labels = {c: pd.Index([], dtype=object) for c in self.dimensions + self.measures}
+        self.labels['day'] = pd.DatetimeIndex([])
+        # Responses by country and speciality, and by country, speciality and value of each measure. Sparse measures
+        # have arrays of the positions of the country, the speciality and the value of each count, and the counts,
+        # sorted by country, speciality and value.
+        self.rows = np.zeros((1, 1), dtype='int64')
+        self.counts = {c: np.zeros((1, 1, 0), dtype='int64') for c in self.measures if c not in self.SPARSE_MEASURES}
+        for c in self.SPARSE_MEASURES:
+            self.counts[c] = tuple(np.zeros(0, dtype='int32') for _ in range(4))
+
+    def copy(self):
+        """
+        :return: a copy that can be updated without changing this one
+        """
+        cube = CrossFilterCube.__new__(CrossFilterCube)
+        cube.dimensions = self.dimensions
+        cube.measures = self.measures
+        cube.labels = dict(self.labels)
+        cube.rows = self.rows.copy()
+        # The arrays of sparse measures are replaced by add_sparse_counts, never updated, so they can be shared.
+        cube.counts = {c: counts if c in self.SPARSE_MEASURES else counts.copy() for c, counts in self.counts.items()}
+        return cube
+
+    def get_codes(self, column, values):
+        """
+        Positions of values along the axis of a column. Values not seen before are added to the axis.
+        :param column: dimension or measure
+        :param values: series of values
+        :return: array of positions, -1 for missing values
+        """
+        if pd.api.types.is_categorical_dtype(values):
+            codes, categories = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, categories = pd.factorize(values)
+        if len(categories) == 0:
+            return np.full(len(codes), -1)
+
+        labels = self.labels[column]
+        used = np.bincount(codes[codes >= 0], minlength=len(categories)) > 0
+        new = categories[(labels.get_indexer(categories) < 0) & used]
+        if len(new):
+            self.labels[column] = labels = labels.append(new)
+            self.grow(column, len(new))
+
+        positions = labels.get_indexer(categories)
+        return np.where(codes >= 0, positions[codes], -1)
+
+    def grow(self, column, size):
+        """
+        Add positions for new values to the end of the axis of a column.
+        :param column: dimension or measure
+        :param size: number of new values
+        :return:
+        """
+        if column in self.dimensions:
+            axis = self.dimensions.index(column)
+            pad = [(0, 0), (0, 0)]
+            pad[axis] = (0, size)
+            self.rows = np.pad(self.rows, pad)
+            self.counts = {c: counts if c in self.SPARSE_MEASURES else np.pad(counts, pad + [(0, 0)])
+                           for c, counts in self.counts.items()}
+        elif column not in self.SPARSE_MEASURES:
+            self.counts[column] = np.pad(self.counts[column], [(0, 0), (0, 0), (0, size)])
+
+    def add(self, data):
+        """
+        Fold new rows into the counts.
+        :param data: new rows of the form data
+        :return:
+        """
+        countries = self.get_codes(self.dimensions[0], data[self.dimensions[0]]) + 1
+        specialities = self.get_codes(self.dimensions[1], data[self.dimensions[1]]) + 1
+        self.add_counts(countries, specialities)
+
+        for c in self.measures:
+            if c == 'day':
+                values = pd.Series(pd.to_datetime(data['Timestamp']).dt.floor('D').to_numpy())
+            else:
+                values = data[c]
+            self.add_counts(countries, specialities, c, self.get_codes(c, values))
+
+    def add_counts(self, countries, specialities, column=None, values=None, weights=None):
+        """
+        Add responses given by the positions of their answers.
+        :param countries: positions along the country axis, 0 for no answer
+        :param specialities: positions along the speciality axis, 0 for no answer
+        :param column: measure the values are of, None to only count the responses by country and speciality
+        :param values: positions along the axis of the measure, -1 for missing values which are not counted
+        :param weights: number of responses of each position, 1 by default
+        :return:
+        """
+        rows, specialities_size = self.rows.shape
+        cells = countries * specialities_size + specialities
+        if column is None:
+            self.rows += np.bincount(cells, weights, minlength=self.rows.size).astype('int64').reshape(self.rows.shape)
+            return
+
+        keep = values >= 0
+        weights = weights[keep] if weights is not None else None
+        if column in self.SPARSE_MEASURES:
+            self.add_sparse_counts(column, cells[keep], values[keep], weights)
+            return
+
+        counts = self.counts[column]
+        cells = cells[keep] * counts.shape[2] + values[keep]
+        counts += np.bincount(cells, weights, minlength=counts.size).astype('int64').reshape(counts.shape)
+
+    def add_sparse_counts(self, column, cells, values, weights=None):
+        """
+        Add responses to the counts of a sparse measure, summing the counts of the same country, speciality and value.
+        :param column: sparse measure
+        :param cells: positions of the country and speciality in the rows array, flattened
+        :param values: positions along the axis of the measure
+        :param weights: number of responses of each position, 1 by default
+        :return:
+        """
+        specialities_size = self.rows.shape[1]
+        values_size = max(len(self.labels[column]), 1)
+        keys, positions = np.unique(cells.astype('int64') * values_size + values, return_inverse=True)
+        new_counts = np.bincount(positions, weights, minlength=len(keys)).astype('int32')
+
+        # The keys of the counts so far are sorted as well, so the new counts are added or inserted in one pass.
+        countries, specialities, old_values, counts = self.counts[column]
+        old_keys = (countries.astype('int64') * specialities_size + specialities) * values_size + old_values
+        positions = np.searchsorted(old_keys, keys)
+        found = old_keys[np.minimum(positions, len(old_keys) - 1)] == keys if len(old_keys) else positions < 0
+        counts = counts.copy()
+        counts[positions[found]] += new_counts[found]
+
+        cells, values = np.divmod(keys[~found], values_size)
+        new_columns = [*np.divmod(cells, specialities_size), values, new_counts[~found]]
+        self.counts[column] = tuple(np.insert(a, positions[~found], new.astype('int32'))
+                                    for a, new in zip([countries, specialities, old_values, counts], new_columns))
+
+    def get_sparse_totals(self, column, countries, specialities):
+        """
+        :param column: sparse measure
+        :param countries: slice of the country axis
+        :param specialities: slice of the speciality axis
+        :return: array of the counts of each value of the measure among the selected countries and specialities
+        """
+        country_positions, speciality_positions, values, counts = self.counts[column]
+        if countries.start is not None:
+            # The counts are sorted by country, so those of the selected countries are a slice.
+            start, stop = np.searchsorted(country_positions, [countries.start, countries.stop])
+            speciality_positions, values, counts = (a[start:stop] for a in (speciality_positions, values, counts))
+        if specialities.start is not None:
+            keep = (speciality_positions >= specialities.start) & (speciality_positions < specialities.stop)
+            values, counts = values[keep], counts[keep]
+        return np.bincount(values, counts, minlength=len(self.labels[column])).astype('int64')
+
+    def get_selection(self, column, value):
+        """
+        :param column: dimension
+        :param value: value to select, or None for all values
+        :return: slice of the axis of the dimension
+        """
+        if value is None:
+            return slice(None)
+        position = self.labels[column].get_indexer([value])[0] + 1
+        # Unknown values select nothing.
+        return slice(position, position + 1) if position > 0 else slice(0, 0)
+
+    def select(self, country=None, speciality=None):
+        """
+        Count the responses of a country and/or a speciality.
+        :param country: country to select, None for all
+        :param speciality: speciality to select, None for all
+        :return: number of responses and dict of value counts of every dimension and measure, values without responses
+            are left out
+        """
+        countries = self.get_selection(self.dimensions[0], country)
+        specialities = self.get_selection(self.dimensions[1], speciality)
+        rows = self.rows[countries, specialities]
+
+        totals = {}
+        for axis, (column, selection) in enumerate(zip(self.dimensions, [countries, specialities])):
+            counts = np.zeros(self.rows.shape[axis], dtype='int64')
+            counts[selection] = rows.sum(axis=1 - axis)
+            totals[column] = counts[1:]
+        for c in self.measures:
+            if c in self.SPARSE_MEASURES:
+                totals[c] = self.get_sparse_totals(c, countries, specialities)
+            else:
+                totals[c] = self.counts[c][countries, specialities].sum(axis=(0, 1))
+
+        value_counts = {}
+        for c, counts in totals.items():
+            value_counts[c] = pd.Series(counts, index=self.labels[c], name=c, dtype='int64')[counts > 0]
+        return int(rows.sum()), value_counts
+
+
+class FormAggregates:
+    """
+    Running totals of the form data: row and error counts, frequencies of the categorical and rating columns,
+    responses per hour, day and week and the CrossFilterCube the totals of a country or speciality are taken from (see
+    select). New rows are folded in with add(), so keeping the totals up to date costs time proportional to the number
+    of new rows rather than the whole sheet.
+    """
+
+    def __init__(self, columns):
+        """
+        :param columns: columns of the form data
+        """
+        self.columns = columns
+        self.rows = 0
+        self.errors = 0
+        self.counts = {c: pd.Series(dtype='int64') for c in get_count_columns(columns)}
+        self.timeline = {grain: pd.Series(dtype='int64', index=pd.DatetimeIndex([])) for grain in TIME_GRAINS}
+        self.cube = CrossFilterCube(columns)
+
+    @classmethod
+    def from_frame(cls, data):
+        """
+        :param data: form data
+        :return: FormAggregates of all rows of data
+        """
+        aggregates = cls(data.columns)
+        aggregates.add(data)
+        return aggregates
+
+    @classmethod
+    def from_counts(cls, columns, rows, errors, counts, hours, cube=None):
+        """
+        :param columns: columns of the form data
+        :param rows: number of rows
+        :param errors: sum of the error column
+        :param counts: dict of value counts per column, see get_count_columns
+        :param hours: series of counts indexed by hour
+        :param cube: CrossFilterCube of the rows, an empty one selects nothing
+        :return: FormAggregates with the given totals
+        """
+        aggregates = cls(columns)
+        aggregates.rows = rows
+        aggregates.errors = errors
+        aggregates.counts.update(counts)
+        aggregates.timeline = {grain: roll_up(hours, grain) for grain in TIME_GRAINS}
+        if cube is not None:
+            aggregates.cube = cube
+        return aggregates
+
+    def copy(self):
+        """
+        :return: a copy that can be updated without changing this one
+        """
+        aggregates = FormAggregates(self.columns)
+        aggregates.rows = self.rows
+        aggregates.errors = self.errors
+        aggregates.counts = dict(self.counts)
+        aggregates.timeline = dict(self.timeline)
+        aggregates.cube = self.cube.copy()
+        return aggregates
+
+    def add(self, data):
+        """
+        Fold new rows into the totals.
+        :param data: new rows of the form data
+        :return:
+        """
+        self.rows += len(data.index)
+        self.errors += data['error'].sum()
+        for c, counts in count_values(data, list(self.counts)).items():
+            self.counts[c] = self.counts[c].add(counts, fill_value=0).astype('int64')
+        hours = count_hours(data['Timestamp'])
+        for grain, counts in self.timeline.items():
+            self.timeline[grain] = counts.add(roll_up(hours, grain), fill_value=0).astype('int64')
+        self.cube.add(data)
+
+    def select(self, country=None, speciality=None):
+        """
+        Totals of the responses of a country and/or a speciality, sliced from the cube without going through the rows.
+        :param country: country to select, None for all
+        :param speciality: speciality to select, None for all
+        :return: FormAggregates of the selected responses, with timelines by day and week only
+        """
+        if country is None and speciality is None:
+            return self
+
+        rows, counts = self.cube.select(country, speciality)
+        aggregates = FormAggregates(self.columns)
+        aggregates.rows = rows
+        aggregates.errors = int(counts['error'].get(1, 0))
+        aggregates.counts = {c: counts[c] for c in self.counts}
+        days = counts['day'].sort_index()
+        aggregates.timeline = {'day': days, 'week': roll_up(days, 'week')}
+        return aggregates
+
+    def value_counts(self, column):
+        """
+        :param column:
+        :return: frequency of each value of the column, most frequent first
+        """
+        return self.counts[column].sort_values(ascending=False)
+
+    def period_counts(self, grain='day'):
+        """
+        :param grain: name of a grain in TIME_GRAINS
+        :return: responses per period, including periods without responses
+        """
+        return self.timeline[grain].sort_index().asfreq(TIME_GRAINS[grain], fill_value=0)
+
+
+# The generate_* functions accept either the form data or its FormAggregates.
+def get_row_count(data):
+    if isinstance(data, FormAggregates):
+        return data.rows
+    return len(data.index)
+
+
+def get_error_count(data):
+    if isinstance(data, FormAggregates):
+        return data.errors
+    return data['error'].sum()
+
+
+def get_value_counts(data, column):
+    if isinstance(data, FormAggregates):
+        return data.value_counts(column)
+    counts = data[column].value_counts()
+    # Categoricals also count their categories without rows.
+    return counts[counts > 0]
+
+
+def get_period_counts(data, grain='day'):
+    if isinstance(data, FormAggregates):
+        return data.period_counts(grain)
+    return roll_up(count_hours(data['Timestamp']), grain).sort_index().asfreq(TIME_GRAINS[grain], fill_value=0)
+
+
+def get_frequency_table(counts, label):
+    """
+    Tabulate value counts with their percentage of the total and a Total row.
+    :param counts: value counts
+    :param label: name of the column with the values
+    :return: table records, table columns and the table without Total row for charts
+    """
+    counts = counts.sort_values(ascending=False, kind='mergesort')
+    frequency = counts.to_numpy()
+    total = frequency.sum()
+    percentage = frequency / total * 100 if total else np.zeros(len(frequency))
+
+    # Rounded as displayed, so no more digits than needed are sent to the browser.
+    df_table = pd.DataFrame({label: counts.index, 'Frequency': frequency,
+                             'Percentage': percentage.round(PERCENTAGE_DECIMALS)})
+
+    table_data = df_table.to_dict('records')
+    table_data.append({label: 'Total', 'Frequency': int(total),
+                       'Percentage': round(float(percentage.sum()), PERCENTAGE_DECIMALS)})
+
+    table_columns = [{"name": i, "id": i} for i in df_table.columns]
+    table_columns[2]['format'] = Format(precision=PERCENTAGE_DECIMALS, scheme=Scheme.fixed)
+    table_columns[2]['type'] = 'numeric'
+
+    return table_data, table_columns, df_table
+
+
+def summarise(data, names=None):
+    """
+    Compute the frequency tables of several summaries at once. For form data all columns are counted in a single pass,
+    FormAggregates already have the counts.
+    :param data: form data or its FormAggregates
+    :param names: names of summaries in SUMMARIES, all by default
+    :return: dict of table records, table columns and chart data per summary, see get_frequency_table
+    """
+    if names is None:
+        names = list(SUMMARIES)
+    columns = [get_summary_column(data.columns, name) for name in names]
+
+    if isinstance(data, FormAggregates):
+        counts = {c: data.counts[c] for c in columns}
+    else:
+        counts = count_values(data, columns)
+
+    return {name: get_frequency_table(counts[c], SUMMARIES[name][1]) for name, c in zip(names, columns)}
+
+
+def get_summary(data, name):
+    """
+    :param data: form data or its FormAggregates
+    :param name: name of a summary in SUMMARIES
+    :return: table records, table columns and chart data of the summary, see get_frequency_table
+    """
+    return summarise(data, [name])[name]
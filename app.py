@@ -1,45 +1,564 @@
+import concurrent.futures
 import dash
 import dash_bootstrap_components as dbc
 import dash_html_components as html
+from dash.exceptions import PreventUpdate
 import datetime
-import requests
-import pandas as pd
+import flask
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import build_pool
+import metrics
+import startup
+from data_cache import DataCache
+from scheduler import RefreshScheduler
+from figure_cache import (FigureCache, prepare_plotly, store_figures, load_figures, splice_figures,
+                          has_pending_figures)
+from snapshot import (load_snapshot, save_snapshot, read_snapshot_version, get_snapshot_age, touch_snapshot,
+                      snapshot_lock)
+from sources import SheetSource, SQLSource
+
+startup.mark('import dash and data sources')
+
+logger = logging.getLogger(__name__)
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 version = '1.0'
 
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
+# Responses are gzipped with Flask-Compress.
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True,
+                compress=True)
 server = app.server
 
-def get_form_data():
+# Number of seconds the downloaded form data is reused before it is fetched again.
+FORM_DATA_TTL = int(os.environ.get('FORM_DATA_TTL', 300))
+
+# The form only appends rows to the sheet, so in incremental mode a refresh only downloads the rows added since the last
+# one. A full download is still done every FORM_DATA_RECONCILE seconds to pick up edits of older rows. Database sources
+# are aggregated again as often, even when the checksum of their table did not change.
+FORM_DATA_INCREMENTAL = os.environ.get('FORM_DATA_INCREMENTAL', '0') == '1'
+FORM_DATA_RECONCILE = int(os.environ.get('FORM_DATA_RECONCILE', 3600))
+
+# Parse the sheet while it is downloaded, this many bytes of csv at a time, and only keep the aggregates: for sheets too
+# large to hold in memory. 0 keeps the rows.
+FORM_DATA_STREAM_BYTES = int(os.environ.get('FORM_DATA_STREAM_BYTES', 0))
+
+# Read the form responses from this database (a SQLAlchemy url) instead of the google sheet.
+DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_TABLE = os.environ.get('DATABASE_TABLE', 'form_responses')
+
+# The aggregates of the last good download are kept in this file, so a worker can serve the dashboard as soon as it
+# boots (even while the source is down) and refresh in the background. Set to an empty string to disable.
+FORM_DATA_SNAPSHOT = os.environ.get('FORM_DATA_SNAPSHOT', os.path.join('snapshots', 'form_data.pickle'))
+
+# Number of seconds between the checks of the pages for new data. A check only compares data versions, the charts and
+# tables are only sent again when the version changed.
+DATA_VERSION_POLL = float(os.environ.get('DATA_VERSION_POLL', 10))
+
+# Maximum total size of the serialized figures kept in memory.
+FIGURE_CACHE_BYTES = int(os.environ.get('FIGURE_CACHE_BYTES', 64 * 1024 * 1024))
+
+SHEET_ID = "1e654j6GAyeM7lkZuFNpqHTYUz9P1EnIqE95BdpyJ2g0"
+
+# Export url of the google sheets, without the sheet id. Can point to a stand-in server, e.g. for load tests.
+SHEET_BASE_URL = os.environ.get('SHEET_BASE_URL', 'https://docs.google.com/spreadsheets/d')
+
+# JSON file of more dashboards served by this process, see load_dashboards.
+DASHBOARDS = os.environ.get('DASHBOARDS')
+
+# Maximum number of dashboards refreshed at once, all dashboards share these threads.
+REFRESH_WORKERS = int(os.environ.get('REFRESH_WORKERS', 4))
+
+# Name of the dashboard configured by the variables above, served at /. Other dashboards are served at /d/<name>/.
+DEFAULT_DASHBOARD = 'default'
+
+scheduler = RefreshScheduler(REFRESH_WORKERS)
+
+# Functions called with a dashboard after a refresh changed its data, e.g. prerender.schedule_render.
+data_listeners = []
+
+
+class Dashboard:
+    """
+    A form data source with its own cache, snapshot and refresh cadence. All dashboards share the pages, the callbacks
+    find the dashboard of a page from its path, see get_dashboard.
+    """
+
+    def __init__(self, name, source, ttl=FORM_DATA_TTL, snapshot_path='', title='Example Dashboard'):
+        """
+        :param name: name of the dashboard, part of the path of its pages
+        :param source: DataSource
+        :param ttl: number of seconds the form data is reused before it is loaded again
+        :param snapshot_path: file the aggregates of the last good load are saved to and shared with other workers, ''
+            for none
+        :param title: shown in the navigation bar
+        """
+        self.name = name
+        self.source = source
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.title = title
+        self.prefix = '/' if name == DEFAULT_DASHBOARD else f'/d/{name}/'
+        self.cache = DataCache(self.load_form_data, ttl=ttl, scheduler=scheduler, on_refresh=self.on_refresh)
+
+        if self.snapshot_path:
+            snapshot = load_snapshot(self.snapshot_path)
+            if snapshot is not None:
+                self.cache.prime(snapshot)
+
+    def __repr__(self):
+        return f'Dashboard({self.name!r})'
+
+    def load_from_source(self, previous=None):
+        """
+        Loads the form data from the source, recording the duration and failures in the metrics. The time of the
+        requests to the source alone is recorded by fetch.
+        :param previous: FormData of the previous load
+        :return: FormData
+        """
+        try:
+            with metrics.LOAD_SECONDS.time(dashboard=self.name):
+                return self.source.load(previous)
+        except Exception:
+            metrics.LOAD_ERRORS.inc(dashboard=self.name)
+            raise
+
+    def load_form_data(self, previous=None):
+        """
+        Loads the form data. Workers on the same machine share the snapshot: the worker holding the snapshot lock loads
+        the data from the source and saves the snapshot, the other workers load the aggregates of the snapshot without
+        parsing or aggregating the rows. So however many workers there are, the source is read and aggregated about once
+        every ttl seconds.
+        :param previous: FormData of the previous load
+        :return: FormData
+        """
+        if not self.snapshot_path:
+            return self.load_from_source(previous)
+
+        # Without data to serve, wait for the worker that is loading it.
+        with snapshot_lock(self.snapshot_path, blocking=previous is None) as locked:
+            if not locked:
+                # Another worker is refreshing the snapshot, keep serving what we have until the next refresh.
+                return previous
+
+            snapshot_age = get_snapshot_age(self.snapshot_path)
+            if snapshot_age is not None and snapshot_age < self.ttl:
+                # Another worker refreshed the snapshot recently.
+                if previous is not None and read_snapshot_version(self.snapshot_path) == previous.version:
+                    return previous
+                snapshot = load_snapshot(self.snapshot_path)
+                if snapshot is not None:
+                    return snapshot
+
+            form_data = self.load_from_source(previous)
+
+            try:
+                if previous is None or form_data.version != previous.version:
+                    save_snapshot(form_data, self.snapshot_path)
+                else:
+                    touch_snapshot(self.snapshot_path)
+            except Exception:
+                logger.exception('Could not save snapshot %s', self.snapshot_path)
+
+        return form_data
+
+    def on_refresh(self, form_data, previous):
+        """
+        Tell the data listeners when a refresh changed the data.
+        :param form_data: FormData of the refresh
+        :param previous: FormData served before, None on the first load
+        :return:
+        """
+        if previous is None or form_data.version != previous.version:
+            for listener in data_listeners:
+                listener(self)
+
+    def get_form_aggregates(self):
+        """
+        Returns the running totals of the form data, shared by all callbacks of this process. The data is loaded at
+        most once every ttl seconds and the last good load is served while a refresh is running or after it failed.
+        :return: FormAggregates
+        """
+        return self.cache.get().aggregates
+
+    def get_data_version(self):
+        """
+        Returns the version of the form data. The version only changes when the data does.
+        :return: version string
+        """
+        return self.cache.get().version
+
+    def get_new_data_version(self, shown_version):
+        """
+        Check whether the data changed since a page was updated, for callbacks of the version check interval.
+        :param shown_version: version of the data shown on the page
+        :return: version of the current data
+        :raises PreventUpdate: if the page already shows the current data
+        """
+        data_version = self.get_data_version()
+        if data_version == shown_version:
+            raise PreventUpdate
+        return data_version
+
+    def get_live_update(self):
+
+        def get_now():
+            current_time = datetime.datetime.now()
+            current_time = datetime.datetime.strftime(current_time, '%Y-%m-%d %H:%M:%S')
+            return current_time
+
+        try:
+            status = self.source.get_status()
+        except Exception:
+            logger.exception('Could not get the status of the form data source of %s', self.name)
+            status = 'unavailable'
+
+        return [html.P('Last updated: ' + str(get_now()) +' with status: ' + str(status))]
+
+
+def create_form_source(config):
+    """
+    Returns the source of the form data of a dashboard.
+    :param config: dict with either database_url and optionally database_table, or sheet_id and optionally sheet_name
+        and status_sheet_name
+    :return: DataSource
+    """
+    if config.get('database_url'):
+        return SQLSource(config['database_url'], config.get('database_table', 'form_responses'),
+                         reconcile=FORM_DATA_RECONCILE)
+
+    return SheetSource(config['sheet_id'], config.get('sheet_name', 'Sheet1'),
+                       config.get('status_sheet_name', 'Form Responses 1'), base_url=SHEET_BASE_URL,
+                       incremental=FORM_DATA_INCREMENTAL, reconcile=FORM_DATA_RECONCILE,
+                       stream_bytes=FORM_DATA_STREAM_BYTES or None)
+
+
+def load_dashboards():
+    """
+    Create the default dashboard from the environment, and the dashboards of the DASHBOARDS file, e.g.
+    {"sales": {"sheet_id": "...", "ttl": 600, "title": "Sales"}, "ops": {"database_url": "sqlite:///ops.db"}}.
+    Their snapshots are saved next to FORM_DATA_SNAPSHOT, named after the dashboard.
+    :return: dict of dashboards by name
+    """
+    configs = {DEFAULT_DASHBOARD: {'sheet_id': SHEET_ID, 'database_url': DATABASE_URL,
+                                   'database_table': DATABASE_TABLE}}
+    if DASHBOARDS:
+        with open(DASHBOARDS) as f:
+            configs.update(json.load(f))
+
+    dashboards = {}
+    for name, config in configs.items():
+        if not re.fullmatch(r'[A-Za-z0-9_-]+', name):
+            raise ValueError(f'Dashboard names can only have letters, digits, - and _: {name!r}')
+
+        if not FORM_DATA_SNAPSHOT:
+            snapshot_path = ''
+        elif name == DEFAULT_DASHBOARD:
+            snapshot_path = FORM_DATA_SNAPSHOT
+        else:
+            snapshot_path = os.path.join(os.path.dirname(FORM_DATA_SNAPSHOT), f'{name}.pickle')
+
+        dashboards[name] = Dashboard(name, create_form_source(config), ttl=config.get('ttl', FORM_DATA_TTL),
+                                     snapshot_path=snapshot_path, title=config.get('title', 'Example Dashboard'))
+
+    return dashboards
+
+
+dashboards = load_dashboards()
+
+startup.mark('load snapshot')
+
+
+def get_dashboard(pathname):
+    """
+    Find the dashboard of a page.
+    :param pathname: path of the page, e.g. /user_summary or /d/sales/user_summary
+    :return: dashboard and the path of the page within the dashboard, e.g. /user_summary. None and the path if there is
+        no such dashboard.
+    """
+    pathname = pathname or '/'
+    if not pathname.startswith('/d/'):
+        return dashboards[DEFAULT_DASHBOARD], pathname
+
+    name, _, page = pathname[len('/d/'):].partition('/')
+    return dashboards.get(name), '/' + page
+
+
+def get_page_dashboard(pathname):
+    """
+    Find the dashboard of the page a callback was fired from.
+    :param pathname: pathname of the url of the page
+    :return: dashboard
+    :raises PreventUpdate: if the page does not belong to a dashboard
     """
-    Downloads a google sheet.
-    :return: pandas dataframe
+    dashboard, page = get_dashboard(pathname)
+    if dashboard is None:
+        raise PreventUpdate
+    return dashboard
+
+
+figure_cache = FigureCache(max_bytes=FIGURE_CACHE_BYTES)
+
+
+def cached_by_data_version(func):
     """
-    sheet_id = "1e654j6GAyeM7lkZuFNpqHTYUz9P1EnIqE95BdpyJ2g0"
-    sheet_name = "Sheet1"
-    url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet={sheet_name}"
-    url = url.replace(' ', '%20')
+    Decorator for functions taking the FormAggregates of the form data of a dashboard as first argument. The dashboard
+    is passed in instead, the decorator passes its aggregates and results are reused until its data version changes,
+    so unchanged data costs no parsing or plotting work. Figures in the results are kept serialized in the figure
+    cache and returned as RawFigure. Concurrent calls for a result that is not cached yet wait for one build of it.
+    :param func: function(aggregates, *args)
+    :return: function(dashboard, *args)
+    """
+    # Per dashboard name: version of the data and results by arguments.
+    caches = {}
+    # Futures of the results being built, by dashboard name, data version and arguments.
+    building = {}
+    building_lock = threading.Lock()
+
+    def get_results(dashboard, form_data):
+        cache = caches.get(dashboard.name)
+        if cache is None or cache['version'] != form_data.version:
+            cache = caches[dashboard.name] = {'version': form_data.version, 'results': {}}
+        return cache['results']
+
+    def load(dashboard, form_data, args):
+        results = get_results(dashboard, form_data)
+        return load_figures(figure_cache, results[args]) if args in results else None
 
-    data = pd.read_csv(url)
+    def lookup(dashboard, form_data, args):
+        """
+        :return: the cached result for the arguments, or None if it has to be built
+        """
+        result = load(dashboard, form_data, args)
+        if result is not None:
+            metrics.RESULT_CACHE.inc(function=func.__qualname__, result='hit')
+            return result
 
-    return data
+        # Not computed yet for this version, or a figure has been evicted from the figure cache.
+        metrics.RESULT_CACHE.inc(function=func.__qualname__, result='miss')
+        return None
+
+    def claim(dashboard, form_data, args):
+        """
+        Claim the build of a result that lookup did not find, unless another thread is building it already.
+        :return: future of the result, and whether the caller builds it and passes it to finish or fail
+        """
+        key = (dashboard.name, form_data.version) + args
+        with building_lock:
+            future = building.get(key)
+            if future is not None:
+                return future, False
+            future = building[key] = concurrent.futures.Future()
+
+        # The build of another thread may have finished between lookup and claim.
+        result = load(dashboard, form_data, args)
+        if result is not None:
+            release(dashboard, form_data, args)
+            future.set_result(result)
+            return future, False
+        return future, True
+
+    def release(dashboard, form_data, args):
+        with building_lock:
+            building.pop((dashboard.name, form_data.version) + args, None)
+
+    def store(dashboard, form_data, args, result):
+        """
+        :return: the result with figures as dicts
+        """
+        key = (func.__module__, func.__qualname__, dashboard.name, form_data.version) + args
+        results = get_results(dashboard, form_data)
+        results[args], result = store_figures(figure_cache, key, result)
+        return result
+
+    def finish(dashboard, form_data, args, future, result):
+        """
+        Store the result of a claimed build and hand it to the threads waiting for it.
+        :return: the result with figures as RawFigure
+        """
+        try:
+            result = store(dashboard, form_data, args, result)
+        except BaseException as e:
+            fail(dashboard, form_data, args, future, e)
+            raise
+        release(dashboard, form_data, args)
+        future.set_result(result)
+        return result
+
+    def fail(dashboard, form_data, args, future, error):
+        """
+        Hand the error of a claimed build to the threads waiting for it.
+        """
+        release(dashboard, form_data, args)
+        future.set_exception(error)
+
+    @functools.wraps(func)
+    def wrapper(dashboard, *args):
+        form_data = dashboard.cache.get()
+        result = lookup(dashboard, form_data, args)
+        if result is not None:
+            return result
+
+        future, claimed = claim(dashboard, form_data, args)
+        if not claimed:
+            return future.result()
+        try:
+            prepare_plotly()
+            with metrics.BUILD_SECONDS.time(function=func.__qualname__):
+                result = func(form_data.aggregates, *args)
+        except BaseException as e:
+            fail(dashboard, form_data, args, future, e)
+            raise
+        return finish(dashboard, form_data, args, future, result)
+
+    # Used by build_all to build several results at once.
+    wrapper.lookup = lookup
+    wrapper.claim = claim
+    wrapper.finish = finish
+    wrapper.fail = fail
+
+    return wrapper
+
+
+def build_all(dashboard, calls):
+    """
+    Call several functions cached by data version, building the results that are not cached at once on the build
+    processes (see build_pool) instead of one after the other.
+    :param dashboard: Dashboard
+    :param calls: list of functions decorated with cached_by_data_version and tuples of their other arguments
+    :return: list of the results
+    """
+    form_data = dashboard.cache.get()
+    results = [func.lookup(dashboard, form_data, args) for func, args in calls]
+    missing = [i for i, result in enumerate(results) if result is None]
+    # Results other threads are building already are waited for once ours are built.
+    futures = {i: calls[i][0].claim(dashboard, form_data, calls[i][1]) for i in missing}
+    claimed = [i for i in missing if futures[i][1]]
+    if claimed:
+        prepare_plotly()
 
+    started = time.perf_counter()
+    try:
+        built = build_pool.build(dashboard.name, form_data.version, form_data.aggregates,
+                                 [(calls[i][0].__wrapped__, calls[i][1]) for i in claimed])
+        for i, result in zip(claimed, built):
+            func, args = calls[i]
+            # The builds overlap, so each is counted with the time of the whole batch.
+            metrics.BUILD_SECONDS.observe(time.perf_counter() - started, function=func.__qualname__)
+            results[i] = func.finish(dashboard, form_data, args, futures[i][0], result)
+    except BaseException as e:
+        for i in claimed:
+            if not futures[i][0].done():
+                calls[i][0].fail(dashboard, form_data, calls[i][1], futures[i][0], e)
+        raise
 
-def get_live_update():
+    for i in missing:
+        if results[i] is None:
+            results[i] = futures[i][0].result()
+    return results
 
-    def get_now():
-        current_time = datetime.datetime.now()
-        current_time = datetime.datetime.strftime(current_time, '%Y-%m-%d %H:%M:%S')
-        return current_time
 
-    sheet_id = "1e654j6GAyeM7lkZuFNpqHTYUz9P1EnIqE95BdpyJ2g0"
-    sheet_name = "Form Responses 1"
-    url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet={sheet_name}"
-    url = url.replace(' ', '%20')
+@server.before_request
+def start_request_timer():
+    flask.g.request_started = time.perf_counter()
 
-    r = requests.head(url)
-    r.status_code
 
-    return [html.P('Last updated: ' + str(get_now()) +' with status: ' + str(r.status_code))]
\ No newline at end of file
+@server.after_request
+def record_callback_metrics(response):
+    """
+    Record the duration and response size of Dash callback requests, per callback output.
+    :param response:
+    :return: response
+    """
+    if flask.request.path.endswith('/_dash-update-component') and 'request_started' in flask.g:
+        callback = (flask.request.get_json(silent=True) or {}).get('output', '')
+        metrics.CALLBACK_SECONDS.observe(time.perf_counter() - flask.g.request_started, callback=callback)
+        metrics.CALLBACK_BYTES.observe(response.calculate_content_length() or 0, callback=callback)
+
+    return response
+
+
+@server.after_request
+def splice_cached_figures(response):
+    """
+    Put the JSON of the cached figures into the response, in place of the placeholders Dash encoded them as, see
+    RawFigure. Registered after the compression of Dash, so it runs before it.
+    :param response:
+    :return: response
+    """
+    if has_pending_figures():
+        response.set_data(splice_figures(response.get_data(as_text=True)))
+    return response
+
+
+@metrics.collect('dashboard_figure_cache_total', 'counter', 'Figure cache reads and evictions.', ['event'])
+def collect_figure_cache():
+    stats = figure_cache.get_stats()
+    return {(event,): stats[event] for event in ['hits', 'misses', 'evictions']}
+
+
+@metrics.collect('dashboard_figure_cache_bytes', 'gauge', 'Size of the figures in the figure cache.')
+def collect_figure_cache_bytes():
+    return figure_cache.get_stats()['bytes']
+
+
+@metrics.collect('dashboard_form_data_cache_total', 'counter', 'Form data cache reads and refreshes.',
+                 ['dashboard', 'event'])
+def collect_form_data_cache():
+    return {(name, event): count for name, dashboard in dashboards.items()
+            for event, count in dashboard.cache.get_stats().items()}
+
+
+@metrics.collect('dashboard_form_data_rows', 'gauge', 'Rows of the cached form data.', ['dashboard'])
+def collect_form_data_rows():
+    rows = {}
+    for name, dashboard in dashboards.items():
+        form_data = dashboard.cache.peek()
+        rows[(name,)] = form_data.aggregates.rows if form_data is not None else 0
+    return rows
+
+
+@metrics.collect('dashboard_fetch_circuit_open', 'gauge',
+                 'Whether requests to the form data source are stopped after repeated failures.', ['dashboard'])
+def collect_fetch_circuit():
+    return {(name,): int(dashboard.source.breaker.get_state() == 'open') for name, dashboard in dashboards.items()
+            if getattr(dashboard.source, 'breaker', None) is not None}
+
+
+@metrics.collect('dashboard_refreshes', 'gauge', 'Refreshes of the form data queued and running.', ['state'])
+def collect_refreshes():
+    return {(state,): count for state, count in scheduler.get_stats().items()}
+
+
+@server.route('/data-version')
+def serve_data_version():
+    """
+    Version of the data of a dashboard (the dashboard query parameter, by default the default dashboard), for clients
+    that poll for new data without a Dash callback. The version is also the ETag, so a request with If-None-Match is
+    answered with an empty 304 until the data changes.
+    :return: json response
+    """
+    dashboard = dashboards.get(flask.request.args.get('dashboard', DEFAULT_DASHBOARD))
+    if dashboard is None:
+        flask.abort(404)
+    form_data = dashboard.cache.get()
+    response = flask.jsonify(version=form_data.version, rows=int(form_data.aggregates.rows))
+    response.set_etag(form_data.version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(flask.request)
+
+
+@server.route('/metrics')
+def serve_metrics():
+    """
+    Metrics of this process in the Prometheus text format, see metrics.py.
+    :return: text response
+    """
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -1,305 +1,337 @@
+import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 from dash_table import DataTable
-from dash_table.Format import Format, Scheme
-from dash.dependencies import Output, Input
-import plotly.express as px
+from dash.dependencies import Output, Input, State
 import pandas as pd
-import numpy as np
-import pycountry
-
-from app import app, get_form_data, get_live_update
-
-
-def generate_country_table(user_data):
-
-    # If the user data cannot be retrieved, display a generic choropleth chart.
-    if (user_data == None).all().all():
-        df = px.data.gapminder().query("year==2007")
-        fig = px.choropleth(df, locations="iso_alpha",
-                            color="lifeExp",  # lifeExp is a column of gapminder
-                            hover_name="country",  # column to add to hover information
-                            color_continuous_scale=px.colors.sequential.Plasma,
-                            title="Placeholder chart: Life Expectancy Around the World in 2007")
-        return None, None, fig
-
-    else:
-        df_country_freq = user_data['country'].value_counts()
-        df_country_percent = user_data['country'].value_counts(normalize=True) * 100
-        df_country_table = pd.concat([df_country_freq, df_country_percent], axis=1)
-        df_country_table.loc["Total"] = df_country_table.sum()
-        df_country_table.reset_index(inplace=True)
-        df_country_table.columns = ['Country', 'Frequency', 'Percentage']
-
-        df_country_table_columns = [{"name": i, "id": i} for i in df_country_table.columns]
-        df_country_table_columns[2]['format'] = Format(precision=1, scheme=Scheme.fixed)
-        df_country_table_columns[2]['type'] = 'numeric'
-
-        df_country_fig = df_country_table.drop(df_country_table.index[-1], axis=0)  # Drop total row for pie chart
-
-        # TODO: FInd a better alternative to pycountry since it is missing quite a few e.g.:
-        #  https://laendercode.net/en/3-letter-list.html
-        country_list = df_country_fig['Country'].values.tolist()
-        iso_country = []
-        for c in country_list:
-            if c == '0':    # for people we couldn't find
-                iso_country.append(np.nan)
-            elif c == 'South Korea':
-                iso_country.append('KOR')
-            elif c == 'Netherlands Antilles':
-                iso_country.append('ANT')
-            elif c == 'Macau':
-                iso_country.append('MAC')
-            elif c == 'Saint Helena':
-                iso_country.append('SHN')
-            elif c == 'Reunion':
-                iso_country.append('REU')
-            else:
-                try:
-                    # If we can't find the country via lookup, default to None for the chart.
-                    iso_country.append(pycountry.countries.lookup(c).alpha_3)
-                except:
-                    iso_country.append(None)
-
-        df_country_fig['iso_country'] = iso_country
-
-        fig_country = px.choropleth(df_country_fig, locations="iso_country",
-                            color="Frequency",
-                            hover_name="Country",  # column to add to hover information
-                            )
-
-        return df_country_table.to_dict('records'), df_country_table_columns, fig_country
-
-
-def generate_speciality_table(data):
-
-    df_speciality_freq = data[data.columns[5]].value_counts()
-    df_speciality_percent = data[data.columns[5]].value_counts(normalize=True) * 100
-    df_speciality_table = pd.concat([df_speciality_freq, df_speciality_percent], axis=1)
-    df_speciality_table.loc["Total"] = df_speciality_table.sum()
-    df_speciality_table.reset_index(inplace=True)
-    df_speciality_table.columns = ['Speciality', 'Frequency', 'Percentage']
-
-    df_speciality_table_columns = [{"name": i, "id": i} for i in df_speciality_table.columns]
-    df_speciality_table_columns[2]['format'] = Format(precision=1, scheme=Scheme.fixed)
-    df_speciality_table_columns[2]['type'] = 'numeric'
-
-    df_speciality_fig = df_speciality_table.drop(df_speciality_table.index[-1], axis=0)  # Drop total row for pie chart
-    fig_speciality = px.bar(df_speciality_fig, y='Frequency', x='Speciality')
-
-    return df_speciality_table.to_dict('records'), df_speciality_table_columns, fig_speciality
-
-
-def generate_ratings(data):
-
-    ratings_data = []
-
-    rating_columns = ['r_stamina', 'r_tenacity', 'r_precision', 'r_reaction', 'r_accuracy', 'r_agility']
-    rating_columns_clean = []
-
-    for c in rating_columns:
-        r_series = data[c].value_counts()
-        r_series.name = c.split('_')[-1]
-        ratings_data.append(r_series)
-        rating_columns_clean.append(c.split('_')[-1])
-
-    df_ratings = pd.concat(ratings_data, axis=1, keys=[s.name for s in ratings_data])
-
-    df_ratings_table = df_ratings.reindex(index=['S', 'A', 'B', 'C', 'D'])
-    df_ratings_table.reset_index(inplace=True)
-    df_ratings_table.rename(columns={'index': 'Rating'}, inplace=True)
-    df_ratings_table_columns = [{"name": i, "id": i} for i in df_ratings_table.columns]
-
-    fig_rating = {'data': df_ratings_table,
-                  'options': [{"label": x, "value": x} for x in rating_columns_clean],
-                  'value': rating_columns_clean[0]
-                 }
-
-    return df_ratings_table.to_dict('records'), df_ratings_table_columns, fig_rating
-
-
-def generate_ratings_fig(data_ratings, value):
-
-    fig = px.bar(data_ratings, x="Rating", y=value)
-    return fig
-
-
-def generate_first_collab_table(data):
-    df_first_collab_freq = data['first_collab'].value_counts()
-    df_first_collab_percent = data['first_collab'].value_counts(normalize=True) * 100
-    df_first_collab_table = pd.concat([df_first_collab_freq, df_first_collab_percent], axis=1)
-    df_first_collab_table.loc["Total"] = df_first_collab_table.sum()
-    df_first_collab_table.reset_index(inplace=True)
-    df_first_collab_table.columns = ['First Collab', 'Frequency', 'Percentage']
-
-    df_first_collab_table_columns = [{"name": i, "id": i} for i in df_first_collab_table.columns]
-    df_first_collab_table_columns[2]['format'] = Format(precision=1, scheme=Scheme.fixed)
-    df_first_collab_table_columns[2]['type'] = 'numeric'
-
-    df_issues_fig = df_first_collab_table.drop(df_first_collab_table.index[-1], axis=0) # Drop total row for pie chart
-    fig_first_collab = px.pie(df_issues_fig, values='Frequency', names='First Collab')
-
-    return df_first_collab_table.to_dict('records'), df_first_collab_table_columns, fig_first_collab
-
-
-data = get_form_data()
-
-current_time = get_live_update()
-
-country_table_data, country_table_columns, fig_country = generate_country_table(data)
-
-speciality_table_data, speciality_table_columns, fig_speciality = generate_speciality_table(data)
-
-rating_table_data, rating_table_columns, fig_rating_dict = generate_ratings(data)
-
-fig_rating = generate_ratings_fig(fig_rating_dict['data'], fig_rating_dict['value'])
-
-first_collab_table_data, first_collab_table_columns, fig_first_collab = generate_first_collab_table(data)
-
-
-layout = html.Div([
-    dcc.Interval(
-                id='interval-component-user',
-                interval=3600 * 1000,  # in milliseconds
-                n_intervals=0
-            ),
-    dbc.Row([
-        dbc.Col([
-            html.H1(children='User Summary'),
-            html.Div(id='live-update-text-user', children=current_time),
-        ])
-    ]),
-    dbc.Row([
-        dbc.Col([
-
-            html.Label("Countries"),
-            DataTable(
-                id='country-table',
-                columns=country_table_columns,
-                data=country_table_data,
-                page_size=10,
-    )]),
-        dbc.Col([
-            dcc.Graph(
-                id='fig-country',
-                figure=fig_country
-            )
+import flask
+
+import charts
+import startup
+from aggregates import get_value_counts, get_summary_column
+from app import (app, dashboards, get_page_dashboard, cached_by_data_version, build_all, DATA_VERSION_POLL,
+                 DEFAULT_DASHBOARD)
+from charts import DEFAULT_RATING
+from country_codes import get_unresolved_countries
+from tables import get_summary_table, get_summary_page
+
+generate_speciality_outputs = cached_by_data_version(charts.generate_speciality_outputs)
+generate_rating_outputs = cached_by_data_version(charts.generate_rating_outputs)
+generate_first_collab_outputs = cached_by_data_version(charts.generate_first_collab_outputs)
+generate_country_outputs = cached_by_data_version(charts.generate_country_outputs)
+generate_rating_chart = cached_by_data_version(charts.generate_rating_chart)
+
+
+def get_selection(cross_filter, name=None):
+    """
+    Clicking a country on the choropleth or a speciality on its bar chart filters the other charts and tables of the
+    page to the responses of that country or speciality, see select_cross_filter.
+    :param cross_filter: data of the cross-filter store, dict of the selected country and speciality
+    :param name: summary shown by a view, the view is not filtered by its own summary so the other values stay visible
+    :return: country and speciality the view is filtered by, None for all
+    """
+    cross_filter = cross_filter or {}
+    country = cross_filter.get('country') if name != 'country' else None
+    speciality = cross_filter.get('speciality') if name != 'speciality' else None
+    return country, speciality
+
+
+def generate_rating_store(dashboard, fig_rating_dict, country=None, speciality=None):
+    """
+    Generate the contents of the rating store: the distribution of every rating and the chart of the selected rating,
+    which the browser reuses to show any other rating without a round trip to the server.
+    :param dashboard: Dashboard
+    :param fig_rating_dict: rating chart data returned by generate_ratings
+    :param country: country the ratings are filtered by, None for all
+    :param speciality: speciality the ratings are filtered by, None for all
+    :return: dict of ratings per column and the chart
+    """
+    df_ratings = fig_rating_dict['data']
+
+    return {
+        'ratings': df_ratings.astype(object).where(df_ratings.notna(), None).to_dict('list'),
+        'figure': generate_rating_chart(dashboard, fig_rating_dict['value'], country, speciality),
+    }
+
+
+def generate_user_summary_outputs(dashboard, cross_filter=None):
+    """
+    Generate the tables and charts refreshed by update_user_summary. They are built at once, see build_all.
+    :param dashboard: Dashboard
+    :param cross_filter: data of the cross-filter store, see get_selection
+    :return: speciality, rating, first collab and country tables and charts
+    """
+    country, speciality = get_selection(cross_filter)
+    # The speciality chart is only filtered by country and the choropleth by speciality, see get_selection.
+    calls = [(generate_speciality_outputs, (country,)),
+             (generate_rating_outputs, (country, speciality)),
+             (generate_first_collab_outputs, (country, speciality)),
+             (generate_country_outputs, (speciality,)),
+             # Shown by the rating store, built here so it is ready when generate_rating_store asks for it.
+             (generate_rating_chart, (DEFAULT_RATING, country, speciality))]
+    results = build_all(dashboard, calls)
+
+    return results[0] + results[1] + results[2] + results[3]
+
+
+def layout(dashboard):
+    """
+    Build the user summary page with the current data, update_user_summary refreshes it when the data changes.
+    :param dashboard: Dashboard
+    :return: layout
+    """
+    data_version = dashboard.get_data_version()
+
+    speciality_table_data, speciality_table_columns, fig_speciality, \
+        rating_table_data, rating_table_columns, fig_rating_dict, \
+        first_collab_table_data, first_collab_table_columns, fig_first_collab, \
+        country_table_data, country_table_columns, fig_country = generate_user_summary_outputs(dashboard)
+
+    rating_store = generate_rating_store(dashboard, fig_rating_dict)
+
+    return html.Div([
+        dcc.Interval(
+                    id='interval-component-user',
+                    interval=int(DATA_VERSION_POLL * 1000),  # in milliseconds
+                    n_intervals=0
+                ),
+        # Version of the data shown, so refreshes skip what the browser already has.
+        dcc.Store(id='user-data-version', data=data_version),
+        # Country and speciality clicked on the charts (see get_selection), and the ones the charts are filtered by.
+        dcc.Store(id='cross-filter', data={}),
+        dcc.Store(id='user-cross-filter', data={}),
+        dbc.Row([
+            dbc.Col([
+                html.H1(children='User Summary'),
+                html.Div(id='live-update-text-user', children=dashboard.get_live_update()),
+                html.Div([
+                    html.Span(id='cross-filter-text', children=get_cross_filter_text({})),
+                    html.Button('Clear filter', id='clear-cross-filter', n_clicks=0),
+                ]),
+            ])
+        ]),
+        dbc.Row([
+            dbc.Col([
+
+                html.Label("Countries"),
+                get_summary_table(dashboard, 'country-table', 'country', country_table_columns),
+            ]),
+            dbc.Col([
+                dcc.Graph(
+                    id='fig-country',
+                    figure=fig_country
+                )
+            ]),
         ]),
-    ]),
-    dbc.Row([
-        dbc.Col([
-            html.Br()
-        ])
-    ]),
-    dbc.Row([
-        dbc.Col([
-            html.Label("Speciality Summary"),
-            DataTable(
-                id='speciality-table',
-                columns=speciality_table_columns,
-                data=speciality_table_data,
-            )
+        dbc.Row([
+            dbc.Col([
+                html.Br()
+            ])
         ]),
-        dbc.Col([
-            dcc.Graph(
-                id='fig-speciality',
-                figure=fig_speciality
-            )
+        dbc.Row([
+            dbc.Col([
+                html.Label("Speciality Summary"),
+                get_summary_table(dashboard, 'speciality-table', 'speciality', speciality_table_columns)
+            ]),
+            dbc.Col([
+                dcc.Graph(
+                    id='fig-speciality',
+                    figure=fig_speciality
+                )
+            ]),
         ]),
-    ]),
-    dbc.Row([
-        dbc.Col([
-            html.Br(),
-            html.Br()
-        ])
-    ]),
-    dbc.Row([
-        dbc.Col([
-            html.Label(
-                "Rating Summary"
-            ),
-            DataTable(
-                id='rating-table',
-                columns=rating_table_columns,
-                data=rating_table_data,
-            )
+        dbc.Row([
+            dbc.Col([
+                html.Br(),
+                html.Br()
+            ])
         ]),
-        dbc.Col([
-            dcc.Dropdown(
-                id="fig-rating-dropdown",
-                options=fig_rating_dict['options'],
-                value=fig_rating_dict['value'],
-                clearable=False,
-            ),
-            dcc.Graph(
-                id='fig-rating',
-                figure=fig_rating
-            )
-        ])
-    ]),
-    dbc.Row([
-        dbc.Col([
-            html.Label(
-                "First Collab"
-            ),
-            DataTable(
-                id='first-collab-table',
-                columns=first_collab_table_columns,
-                data=first_collab_table_data,
-            )
+        dbc.Row([
+            dbc.Col([
+                html.Label(
+                    "Rating Summary"
+                ),
+                DataTable(
+                    id='rating-table',
+                    columns=rating_table_columns,
+                    data=rating_table_data,
+                )
+            ]),
+            dbc.Col([
+                dcc.Store(id='rating-store', data=rating_store),
+                dcc.Dropdown(
+                    id="fig-rating-dropdown",
+                    options=fig_rating_dict['options'],
+                    value=fig_rating_dict['value'],
+                    clearable=False,
+                ),
+                dcc.Graph(
+                    id='fig-rating',
+                    figure=rating_store['figure']
+                )
+            ])
         ]),
-        dbc.Col([
-            dcc.Graph(
-                id='fig-first-collab',
-                figure=fig_first_collab
-            )
-        ])
-    ]),
-])
+        dbc.Row([
+            dbc.Col([
+                html.Label(
+                    "First Collab"
+                ),
+                get_summary_table(dashboard, 'first-collab-table', 'first_collab', first_collab_table_columns)
+            ]),
+            dbc.Col([
+                dcc.Graph(
+                    id='fig-first-collab',
+                    figure=fig_first_collab
+                )
+            ])
+        ]),
+    ])
+
+def get_cross_filter_text(cross_filter):
+    """
+    :param cross_filter: data of the cross-filter store
+    :return: description of the selection shown above the charts
+    """
+    selected = [f'{label} {cross_filter[key]}' for key, label in [('country', 'Country'), ('speciality', 'Speciality')]
+                if cross_filter.get(key) is not None]
+    if not selected:
+        return 'Click a country or a speciality to filter the other charts. '
+    return 'Filtered by ' + ' and '.join(selected) + '. '
+
+
+@app.callback([
+    Output('cross-filter', 'data'),
+    Output('cross-filter-text', 'children'),
+],  Input('fig-country', 'clickData'),
+    Input('fig-speciality', 'clickData'),
+    Input('clear-cross-filter', 'n_clicks'),
+    State('cross-filter', 'data'),
+    prevent_initial_call=True)
+def select_cross_filter(country_click, speciality_click, n_clicks, cross_filter):
+    """
+    Select the country or speciality clicked on its chart, or unselect it when it is clicked again.
+    """
+    triggered = dash.callback_context.triggered[0]['prop_id']
+    cross_filter = dict(cross_filter or {})
+    if triggered.startswith('clear-cross-filter'):
+        cross_filter = {}
+    elif triggered.startswith('fig-country') and country_click:
+        country = country_click['points'][0]['customdata'][0]
+        cross_filter['country'] = None if cross_filter.get('country') == country else country
+    elif triggered.startswith('fig-speciality') and speciality_click:
+        speciality = speciality_click['points'][0]['x']
+        cross_filter['speciality'] = None if cross_filter.get('speciality') == speciality else speciality
+
+    return cross_filter, get_cross_filter_text(cross_filter)
+
 
 # Update all charts except rating figure (due to user interaction)
 @app.callback([
     Output('live-update-text-user', 'children'),
-    Output('speciality-table', 'data'),
     Output('speciality-table', 'columns'),
     Output('fig-speciality', 'figure'),
     Output('rating-table', 'data'),
     Output('rating-table', 'columns'),
-    Output('first-collab-table', 'data'),
+    Output('rating-store', 'data'),
     Output('first-collab-table', 'columns'),
     Output('fig-first-collab', 'figure'),
-],  Input('interval-component-user', 'n_intervals'))
-def update_user_summary(n):
-    data = get_form_data()
-
-    current_time = get_live_update()
-
-    speciality_table_data, speciality_table_columns, fig_speciality = generate_speciality_table(data)
+    Output('fig-country', 'figure'),
+    Output('user-data-version', 'data'),
+    Output('user-cross-filter', 'data'),
+],  Input('interval-component-user', 'n_intervals'),
+    Input('cross-filter', 'data'),
+    State('user-data-version', 'data'),
+    State('user-cross-filter', 'data'),
+    State('url', 'pathname'),
+    prevent_initial_call=True)
+def update_user_summary(n, cross_filter, shown_version, shown_cross_filter, pathname):
+    dashboard = get_page_dashboard(pathname)
+    if get_selection(cross_filter) == get_selection(shown_cross_filter):
+        data_version = dashboard.get_new_data_version(shown_version)
+    else:
+        # The selection changed: the charts are sliced from the aggregates, whether the data changed or not.
+        data_version = dashboard.get_data_version()
+    current_time = dashboard.get_live_update()
 
-    rating_table_data, rating_table_columns, fig_rating_dict = generate_ratings(data)
+    speciality_table_data, speciality_table_columns, fig_speciality, \
+        rating_table_data, rating_table_columns, fig_rating_dict, \
+        first_collab_table_data, first_collab_table_columns, fig_first_collab, \
+        country_table_data, country_table_columns, fig_country = generate_user_summary_outputs(dashboard, cross_filter)
 
-    first_collab_table_data, first_collab_table_columns, fig_first_collab = generate_first_collab_table(data)
+    rating_store = generate_rating_store(dashboard, fig_rating_dict, *get_selection(cross_filter))
 
     return current_time, \
-           speciality_table_data, speciality_table_columns, fig_speciality, \
-           rating_table_data, rating_table_columns, \
-           first_collab_table_data, first_collab_table_columns, fig_first_collab
-
-
-@app.callback(
+           speciality_table_columns, fig_speciality, \
+           rating_table_data, rating_table_columns, rating_store, \
+           first_collab_table_columns, fig_first_collab, fig_country, data_version, cross_filter
+
+
+def update_summary_table(name):
+    """
+    Build the callback serving the pages of a summary table, see get_summary_page. The table is refreshed when the data
+    or the cross filter changes.
+    :param name: name of a summary in SUMMARIES
+    :return: callback
+    """
+    def update_table(page_current, page_size, sort_by, filter_query, data_version, cross_filter, pathname):
+        country, speciality = get_selection(cross_filter, name)
+        return get_summary_page(get_page_dashboard(pathname), name, page_current, page_size, sort_by, filter_query,
+                                country, speciality)
+
+    return update_table
+
+
+for table_id, name in [('country-table', 'country'), ('speciality-table', 'speciality'),
+                       ('first-collab-table', 'first_collab')]:
+    app.callback([
+        Output(table_id, 'data'),
+        Output(table_id, 'page_count'),
+    ],
+        Input(table_id, 'page_current'),
+        Input(table_id, 'page_size'),
+        Input(table_id, 'sort_by'),
+        Input(table_id, 'filter_query'),
+        Input('user-data-version', 'data'),
+        Input('cross-filter', 'data'),
+        State('url', 'pathname'),
+        prevent_initial_call=True)(update_summary_table(name))
+
+
+# Switching the rating chart runs in the browser: the chart in the rating store is copied with the y values of the
+# selected rating, so the dropdown costs no request to the server.
+app.clientside_callback(
+    """
+    function(value, store) {
+        if (!store || !store.ratings[value]) {
+            return window.dash_clientside.no_update;
+        }
+        var fig = JSON.parse(JSON.stringify(store.figure));
+        fig.data[0].y = store.ratings[value];
+        fig.data[0].hovertemplate = 'Rating=%{x}<br>' + value + '=%{y}<extra></extra>';
+        fig.layout.title = {text: 'Rating vs ' + value};
+        return fig;
+    }
+    """,
     Output("fig-rating", "figure"),
-    [Input("fig-rating-dropdown", "value")])
-def update_bar_chart(value):
-    data = get_form_data()
-
-    rating_table_data, rating_table_columns, fig_rating_dict = generate_ratings(data)
-
-    fig = generate_ratings_fig(fig_rating_dict['data'], value)
-
-    fig.update_layout(
-        title_text="Rating vs " + value
-    )
-    fig.update_yaxes(title_text="Frequency")
-
-    return fig
\ No newline at end of file
+    Input("fig-rating-dropdown", "value"),
+    Input("rating-store", "data"))
+
+
+@app.server.route('/countries/unresolved')
+def unresolved_countries():
+    """
+    List the country names in the current data of a dashboard (the dashboard query parameter, by default the default
+    dashboard) that the choropleth cannot resolve. They can be fixed in the country overrides file. All responses are
+    checked, whatever the cross filter of the pages.
+    :return: json list of names
+    """
+    dashboard = dashboards.get(flask.request.args.get('dashboard', DEFAULT_DASHBOARD))
+    if dashboard is None:
+        flask.abort(404)
+    aggregates = dashboard.get_form_aggregates()
+    countries = get_value_counts(aggregates, get_summary_column(aggregates.columns, 'country')).index
+    return flask.jsonify(get_unresolved_countries(pd.Series(countries)))
+
+
+startup.mark('import user summary page')
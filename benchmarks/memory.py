@@ -0,0 +1,59 @@
+"""
+Reports the memory of the form data and the time to parse and count it, read with the column types of schema.py and
+read as before, with pandas inferring every column. Run from the root of the repository, e.g.
+
+    python -m benchmarks.memory --rows 100000
+"""
+import argparse
+import io
+import sys
+import time
+import warnings
+
+warnings.filterwarnings('ignore', category=UserWarning)
+
+import pandas as pd
+
+from aggregates import FormAggregates
+from schema import get_memory_usage, read_form_csv
+from benchmarks.synthetic import generate_form_data
+
+
+def timed(func):
+    """
+    :param func: function without arguments
+    :return: result of func and the seconds it took
+    """
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='number of rows of the synthetic data')
+    args = parser.parse_args()
+
+    content = generate_form_data(args.rows, raw=True).to_csv(index=False).encode()
+    print(f'{args.rows} rows, {len(content) / 2 ** 20:.1f} MB of csv', file=sys.stderr)
+
+    inferred, inferred_parse = timed(lambda: pd.read_csv(io.BytesIO(content)))
+    typed, typed_parse = timed(lambda: read_form_csv(content))
+    _, inferred_count = timed(lambda: FormAggregates.from_frame(inferred))
+    _, typed_count = timed(lambda: FormAggregates.from_frame(typed))
+
+    before = get_memory_usage(inferred)
+    after = get_memory_usage(typed)
+    print(f"{'Column':30} {'Type':>10} {'Before':>10} {'After':>10}")
+    for c in typed.columns:
+        print(f'{c:30} {str(typed[c].dtype)[:10]:>10} {before[c] / 2 ** 20:8.2f}MB {after[c] / 2 ** 20:8.2f}MB')
+    print(f"{'Total':30} {'':>10} {before.sum() / 2 ** 20:8.2f}MB {after.sum() / 2 ** 20:8.2f}MB")
+    print()
+    print(f"{'':30} {'':>10} {'Before':>10} {'After':>10}")
+    print(f"{'Parse':30} {'':>10} {inferred_parse * 1000:8.0f}ms {typed_parse * 1000:8.0f}ms")
+    # Before, the timestamps are parsed when they are counted.
+    print(f"{'Aggregate':30} {'':>10} {inferred_count * 1000:8.0f}ms {typed_count * 1000:8.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
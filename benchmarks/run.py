@@ -0,0 +1,271 @@
+"""
+Times and memory profiles the generate_* functions and the refresh callbacks on synthetic form data.
+
+The sheet is never downloaded: the form data source is replaced by one serving the synthetic data. Run from the root
+of the repository, e.g.
+
+    python -m benchmarks.run --save benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json
+    python -m benchmarks.run --sizes 1000000 10000000 --only from_frame update_ --repeat 1
+
+Comparing prints the change of every benchmark against the baseline and exits with status 1 if any of them got slower
+or used more memory than the threshold allows.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+
+# Before importing the app: no snapshots or country index are written by benchmarks.
+os.environ['FORM_DATA_SNAPSHOT'] = ''
+os.environ['COUNTRY_INDEX_PATH'] = ''
+warnings.filterwarnings('ignore', category=UserWarning)
+
+import numpy as np
+import pandas as pd
+from dash.exceptions import PreventUpdate
+
+import app
+import charts
+import index
+from aggregates import FormAggregates, get_summary_column
+from apps import user_summary
+from sources import DataSource, FormData
+from benchmarks.synthetic import generate_form_data
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# Increases smaller than these are noise, not regressions.
+MIN_SECONDS_CHANGE = 0.002
+MIN_BYTES_CHANGE = 2 ** 16
+
+
+class SyntheticSource(DataSource):
+    """
+    Serves synthetic form data in place of the google sheet. Every load is a new version, as if the sheet changed.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.loads = 0
+
+    def load(self, previous=None):
+        self.loads += 1
+        return FormData(f'synthetic-{len(self.data.index)}-{self.loads}', self.data,
+                        FormAggregates.from_frame(self.data), None, None, time.time())
+
+    def get_status(self):
+        return 200
+
+
+def reset_form_data(source):
+    """
+    Serve a source as the default dashboard with nothing cached, so the next callback loads and aggregates the data
+    again.
+    :param source: DataSource
+    :return:
+    """
+    app.dashboards[app.DEFAULT_DASHBOARD] = app.Dashboard(app.DEFAULT_DASHBOARD, source)
+
+
+def measure(func, repeat):
+    """
+    :param func: function without arguments
+    :param repeat: number of timed runs
+    :return: dict of the median and minimum run time in seconds, and the peak memory allocated during one more run
+    """
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - started)
+
+    # Traced separately, tracing slows down allocations.
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': statistics.median(seconds), 'min_seconds': min(seconds), 'peak_bytes': peak}
+
+
+def get_benchmarks(data):
+    """
+    :param data: synthetic form data
+    :return: list of benchmark names and functions without arguments
+    """
+    aggregates = FormAggregates.from_frame(data)
+
+    generate_functions = [
+        ('generate_kpis', charts.generate_kpis),
+        ('generate_fig', charts.generate_fig),
+        ('generate_issues_table', charts.generate_issues_table),
+        ('generate_country_table', charts.generate_country_table),
+        ('generate_speciality_table', charts.generate_speciality_table),
+        ('generate_ratings', charts.generate_ratings),
+        ('generate_first_collab_table', charts.generate_first_collab_table),
+    ]
+
+    # As called when the browser has no data yet, on the pages of the default dashboard.
+    callbacks = [
+        ('update_index', lambda: index.update_index(0, None, '/')),
+        ('update_timeline', lambda: index.update_timeline('day', None, None, None, '/')),
+        ('update_issues_table', lambda: index.update_issues_table(0, 10, [], '', None, '/')),
+        ('update_user_summary', lambda: user_summary.update_user_summary(0, {}, None, {}, '/user_summary')),
+    ]
+
+    # Clicking a country and a speciality on the user summary: every chart is built from a slice of the cube.
+    country = aggregates.value_counts('country').index[0]
+    speciality = aggregates.value_counts(get_summary_column(data.columns, 'speciality')).index[0]
+    cross_filter_functions = [
+        (user_summary.generate_speciality_outputs, (country,)),
+        (user_summary.generate_rating_outputs, (country, speciality)),
+        (user_summary.generate_first_collab_outputs, (country, speciality)),
+        (user_summary.generate_country_outputs, (speciality,)),
+    ]
+
+    def cold(callback):
+        # The data changed: load, aggregate and build everything again.
+        def run():
+            reset_form_data(app.dashboards[app.DEFAULT_DASHBOARD].source)
+            callback()
+        return run
+
+    def warm(callback):
+        # The data did not change: served from the caches.
+        callback()
+        return callback
+
+    def unchanged(callback):
+        # A tick of the version check while the page shows the current data.
+        def run():
+            try:
+                callback(app.dashboards[app.DEFAULT_DASHBOARD].get_data_version())
+            except PreventUpdate:
+                pass
+        return run
+
+    benchmarks = [('FormAggregates.from_frame', lambda: FormAggregates.from_frame(data)),
+                  ('FormAggregates.select', lambda: aggregates.select(country, speciality)),
+                  # Built without the cache, as for a selection nobody clicked before.
+                  ('cross_filter[aggregates]',
+                   lambda: [func.__wrapped__(aggregates, *args) for func, args in cross_filter_functions])]
+    for name, func in generate_functions:
+        benchmarks.append((f'{name}[frame]', lambda func=func: func(data)))
+        benchmarks.append((f'{name}[aggregates]', lambda func=func: func(aggregates)))
+    for name, callback in callbacks:
+        benchmarks.append((f'{name}[cold]', cold(callback)))
+        benchmarks.append((f'{name}[warm]', warm(callback)))
+    benchmarks.append(('update_index[unchanged]', unchanged(lambda version: index.update_index(0, version, '/'))))
+    benchmarks.append(('update_user_summary[unchanged]',
+                       unchanged(lambda version: user_summary.update_user_summary(0, {}, version, {}, '/'))))
+
+    return benchmarks
+
+
+def run(sizes, repeat, names=None):
+    """
+    :param sizes: numbers of rows of the synthetic data
+    :param repeat: number of timed runs of each benchmark
+    :param names: only run benchmarks whose name contains one of these
+    :return: results, see save_results
+    """
+    results = {}
+    for rows in sizes:
+        started = time.perf_counter()
+        data = generate_form_data(rows)
+        print(f'Generated {rows} rows in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+        reset_form_data(SyntheticSource(data))
+
+        for name, func in get_benchmarks(data):
+            if names and not any(n in name for n in names):
+                continue
+            result = measure(func, repeat)
+            results[f'{name} @ {rows}'] = result
+            print(f"{name:40} {rows:>10} {result['seconds'] * 1000:10.1f} ms {result['peak_bytes'] / 2 ** 20:10.1f} MB",
+                  file=sys.stderr)
+
+    return results
+
+
+def save_results(results, path, repeat):
+    """
+    :param results: dict of '<benchmark> @ <rows>' to the measures returned by measure
+    :param path: json file
+    :param repeat: number of timed runs of each benchmark
+    :return:
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({
+            'environment': {
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+            },
+            'repeat': repeat,
+            'results': results,
+        }, f, indent=2)
+
+
+def compare_results(results, path, threshold):
+    """
+    Print the change of each benchmark against a baseline saved with save_results.
+    :param results: dict of '<benchmark> @ <rows>' to the measures returned by measure
+    :param path: json file of the baseline
+    :param threshold: relative increase of time or peak memory counted as a regression, e.g. 0.25
+    :return: list of regressed benchmarks
+    """
+    with open(path) as f:
+        baseline = json.load(f)['results']
+
+    regressions = []
+    print(f"{'Benchmark':55} {'Time':>10} {'Memory':>10}")
+    for key, result in results.items():
+        if key not in baseline:
+            print(f'{key:55} {"new":>10} {"new":>10}')
+            continue
+
+        time_change = result['seconds'] / baseline[key]['seconds'] - 1 if baseline[key]['seconds'] else 0
+        memory_change = result['peak_bytes'] / baseline[key]['peak_bytes'] - 1 if baseline[key]['peak_bytes'] else 0
+        regressed = (time_change > threshold and result['seconds'] - baseline[key]['seconds'] > MIN_SECONDS_CHANGE or
+                     memory_change > threshold and result['peak_bytes'] - baseline[key]['peak_bytes'] > MIN_BYTES_CHANGE)
+        if regressed:
+            regressions.append(key)
+        print(f"{key:55} {time_change:+10.0%} {memory_change:+10.0%}{'  REGRESSION' if regressed else ''}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='numbers of rows of the synthetic data, up to 10000000')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each benchmark')
+    parser.add_argument('--only', nargs='+', help='only run benchmarks whose name contains one of these')
+    parser.add_argument('--save', help='save the results to this json file')
+    parser.add_argument('--compare', help='compare the results to a baseline saved with --save')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative increase of time or memory reported as a regression')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeat, args.only)
+
+    if args.save:
+        save_results(results, args.save, args.repeat)
+    if args.compare:
+        if compare_results(results, args.compare, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
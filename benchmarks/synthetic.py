@@ -0,0 +1,56 @@
+"""
+Synthetic form data with the columns of the form responses sheet, for benchmarks.
+"""
+import numpy as np
+import pandas as pd
+
+from schema import apply_schema
+
+COUNTRIES = ['Germany', 'France', 'United Kingdom', 'United States', 'Brazil', 'Japan', 'South Korea', 'Russia',
+             'Netherlands', 'Spain', 'Italy', 'Poland', 'Canada', 'Australia', 'Mexico', 'Vietnam', 'Philippines',
+             'Indonesia', 'Turkey', 'Sweden', 'Macau', 'Reunion', 'Narnia', '0']
+SPECIALITIES = ['Tank', 'Healer', 'DPS', 'Support']
+ERROR_REASONS = ['Bad link', 'Wrong name', 'Timeout', 'Duplicate']
+RATINGS = ['S', 'A', 'B', 'C', 'D']
+RATING_COLUMNS = ['r_stamina', 'r_tenacity', 'r_precision', 'r_reaction', 'r_accuracy', 'r_agility']
+
+
+def generate_form_data(rows, start='2021-08-01', error_rate=0.1, seed=0, raw=False):
+    """
+    Generate form responses like the ones read from the sheet, with the column types of schema.py and the speciality
+    question at position 5.
+    :param rows: number of responses
+    :param start: date of the first response
+    :param error_rate: fraction of responses with an error
+    :param seed: seed of the random generator, the same seed gives the same data
+    :param raw: return the columns as they are in the csv export instead: timestamps as text in the format of the sheet
+        and answers as strings
+    :return: pandas dataframe
+    """
+    rng = np.random.default_rng(seed)
+
+    # About 300 responses a day, so the history grows with the number of rows.
+    seconds = np.cumsum(rng.integers(1, 576, size=rows))
+    timestamps = pd.Timestamp(start) + pd.to_timedelta(seconds, unit='s')
+
+    def choose(values):
+        return np.array(values, dtype=object)[rng.integers(0, len(values), rows)]
+
+    # Empty cells are read as NaN from the csv.
+    error = (rng.random(rows) < error_rate).astype('int64')
+    error_reason = np.where(error == 1, choose(ERROR_REASONS), np.nan)
+
+    data = {
+        'Timestamp': timestamps.strftime('%m/%d/%Y %H:%M:%S'),
+        'Username': np.char.add('user', np.arange(rows).astype(str)).astype(object),
+        'error': error,
+        'error_reason': error_reason,
+        'country': choose(COUNTRIES),
+        'What is your speciality?': choose(SPECIALITIES),
+    }
+    for c in RATING_COLUMNS:
+        data[c] = choose(RATINGS)
+    data['first_collab'] = choose(['Yes', 'No'])
+
+    data = pd.DataFrame(data)
+    return data if raw else apply_schema(data)
@@ -0,0 +1,192 @@
+"""
+Builds the charts and tables of a page on a pool of processes, so the builders of a page run at once on several cores
+instead of one after the other under the GIL of the request thread, which only waits for their results.
+
+Builders take the FormAggregates of the form data. They are written to a file once per data version and each pool
+process loads them once, instead of receiving a copy with every task. Builders are sent by name and live in modules
+without import side effects (see charts), which is all the pool processes import when the app is served by gunicorn. Run
+as python index.py, spawn also imports index.py in each pool process, which then sets up the app once when it starts.
+Their figures are serialized in the pool processes and come back as JSON strings.
+
+The processes are started with spawn rather than fork. Forked processes would keep the client connections the worker
+had open at the time, and connections the worker then closes would stay open and hang their clients.
+"""
+import atexit
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import importlib
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import urllib.parse
+
+from figure_cache import serialize_figures
+from metrics import BUILD_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+# Number of processes building the charts and tables of the pages. 0 builds them in the request thread.
+BUILD_PROCESSES = int(os.environ.get('BUILD_PROCESSES', 0))
+
+# Number of seconds the request thread waits for each build on the pool. A build that has not started by then, because
+# the processes are busy with other pages, is built in the request thread instead. A build that is running by then gets
+# as long again to finish, then it is built in the request thread as well.
+BUILD_TIMEOUT = float(os.environ.get('BUILD_TIMEOUT', 10))
+
+# Number of data versions whose aggregates are kept on disk per dashboard, and in memory by each pool process. Tasks of
+# the previous version may still be queued when the data changes.
+KEEP_VERSIONS = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Directory of the aggregates written for the pool processes, and their files by dashboard name, oldest first.
+_aggregates_dir = None
+_aggregates_paths = collections.defaultdict(list)
+_aggregates_lock = threading.Lock()
+
+# Aggregates loaded by a pool process, by path.
+_loaded_aggregates = collections.OrderedDict()
+
+
+def get_pool():
+    """
+    :return: the pool of build processes, created on first use, or None if builds run in the request thread
+    """
+    global _pool
+    if BUILD_PROCESSES <= 0:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ProcessPoolExecutor(BUILD_PROCESSES,
+                                                           mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def reset_pool(pool):
+    """
+    Drop a broken pool, e.g. after one of its processes was killed. The next build starts a new one.
+    :param pool: the broken pool
+    :return:
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def get_aggregates_path(name, version, aggregates):
+    """
+    Write the aggregates of a data version of a dashboard for the pool processes, once. The files of older versions are
+    removed.
+    :param name: name of the dashboard
+    :param version: data version of the aggregates
+    :param aggregates: FormAggregates
+    :return: path of the file
+    """
+    global _aggregates_dir
+    with _aggregates_lock:
+        if _aggregates_dir is None:
+            _aggregates_dir = tempfile.mkdtemp(prefix='dashboard-build-')
+            atexit.register(shutil.rmtree, _aggregates_dir, ignore_errors=True)
+
+        path = os.path.join(_aggregates_dir, urllib.parse.quote(f'{name}-{version}', safe='') + '.pickle')
+        paths = _aggregates_paths[name]
+        if path not in paths:
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'wb') as f:
+                pickle.dump(aggregates, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+            paths.append(path)
+            while len(paths) > KEEP_VERSIONS:
+                os.remove(paths.pop(0))
+        return path
+
+
+def load_aggregates(path):
+    """
+    Load aggregates written by get_aggregates_path in a pool process, once per process.
+    :param path: file of the aggregates
+    :return: FormAggregates
+    """
+    aggregates = _loaded_aggregates.get(path)
+    if aggregates is None:
+        with open(path, 'rb') as f:
+            aggregates = _loaded_aggregates[path] = pickle.load(f)
+        while len(_loaded_aggregates) > KEEP_VERSIONS:
+            _loaded_aggregates.popitem(last=False)
+    return aggregates
+
+
+def run_builder(module, name, path, args):
+    """
+    Run a builder in a pool process. The module of the builder is imported by the first task that needs it.
+    :param module: module of the builder
+    :param name: qualified name of the builder
+    :param path: file of the aggregates the builder takes, see get_aggregates_path
+    :param args: other arguments of the builder
+    :return: result of the builder with its figures serialized
+    """
+    func = getattr(importlib.import_module(module), name)
+    return serialize_figures(func(load_aggregates(path), *args))
+
+
+def build(name, version, aggregates, tasks):
+    """
+    Run builders on the pool at once, or one after the other without one. Each build gets BUILD_TIMEOUT seconds of
+    its own: a build still waiting for a process by then is cancelled and built in the calling thread instead. A build
+    that is running by then is given another BUILD_TIMEOUT seconds, as building it again would take about as long, and
+    is built in the calling thread if it still has not finished. Its process is left to finish it.
+    :param name: name of the dashboard of the aggregates
+    :param version: data version of the aggregates
+    :param aggregates: FormAggregates passed to every builder
+    :param tasks: list of builder functions and their other arguments
+    :return: list of the results, figures of the results built on the pool are SerializedFigure
+    """
+    pool = get_pool()
+    if pool is None or len(tasks) < 2:
+        return [func(aggregates, *args) for func, args in tasks]
+
+    path = get_aggregates_path(name, version, aggregates)
+    try:
+        futures = [pool.submit(run_builder, func.__module__, func.__qualname__, path, args) for func, args in tasks]
+    except concurrent.futures.process.BrokenProcessPool:
+        logger.exception('The build processes stopped, building in the request')
+        reset_pool(pool)
+        return [func(aggregates, *args) for func, args in tasks]
+
+    results = []
+    for (func, args), future in zip(tasks, futures):
+        try:
+            try:
+                # Waited for one after the other, each with a timeout of its own.
+                result = future.result(timeout=BUILD_TIMEOUT)
+            except concurrent.futures.TimeoutError:
+                finished = False
+                if not future.cancel():
+                    # Running by now.
+                    try:
+                        result, finished = future.result(timeout=BUILD_TIMEOUT), True
+                    except concurrent.futures.TimeoutError:
+                        pass
+                if not finished:
+                    state = 'queued' if future.cancelled() else 'running'
+                    BUILD_TIMEOUTS.inc(function=func.__qualname__, state=state)
+                    logger.warning('%s did not finish in time on the build processes, still %s, building it in the '
+                                   'request', func.__qualname__, state)
+                    result = func(aggregates, *args)
+            results.append(result)
+        except concurrent.futures.process.BrokenProcessPool:
+            logger.exception('The build processes stopped while building %s, building it in the request',
+                             func.__qualname__)
+            reset_pool(pool)
+            results.append(func(aggregates, *args))
+
+    return results
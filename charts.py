@@ -0,0 +1,282 @@
+"""
+Charts and tables of the pages, built from the form data or its FormAggregates. Nothing of the app is imported here, so
+the build processes (see build_pool) import the builders without loading the dashboards or setting up the pages, which
+reuse the results until the data changes, see cached_by_data_version. Plotly is imported by the builders when they first
+run, so it does not slow down booting workers.
+"""
+import pandas as pd
+
+from aggregates import (RATING_COLUMNS, FormAggregates, get_row_count, get_error_count, get_period_counts, get_summary,
+                        get_value_counts)
+from country_codes import resolve_countries
+from downsample import downsample_series
+
+# Maximum number of points per trace of the line chart.
+TIMELINE_POINTS = 500
+
+GRAIN_LABELS = {'hour': 'Hourly', 'day': 'Daily', 'week': 'Weekly'}
+
+# Functions
+def generate_kpis(data):
+    """
+    Generate a list of kpis shown at the top of the page
+    :param data: form data or its FormAggregates
+    :return:
+    """
+    # Total Claims
+    total_claims = get_row_count(data)
+
+    # % Complete
+    completion = round(total_claims/12800 * 100, 1)
+
+    # Total Issues
+    total_issues = get_error_count(data)
+
+    return total_claims, completion, total_issues
+
+
+def generate_fig(data, grain='day', start=None, end=None):
+    """
+    Create a line chart of the number of inscriptions over time
+    :param data: form data or its FormAggregates
+    :param grain: name of a grain in TIME_GRAINS
+    :param start: first date shown, None to start at the first response
+    :param end: last date shown, None to end at the last response
+    :return: line chart figure
+    """
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    daily_responses = get_period_counts(data, grain)
+
+    daily_responses_cumsum = daily_responses.cumsum()
+
+    # Only the zoomed range is sent, downsampled to a fixed number of points however long the history is.
+    daily_responses = downsample_series(daily_responses[start:end], TIMELINE_POINTS)
+    daily_responses_cumsum = downsample_series(daily_responses_cumsum[start:end], TIMELINE_POINTS)
+
+    ### Create plot
+    # Create figure with secondary y-axis
+    fig = make_subplots(specs=[[{"secondary_y": False}]])
+
+    # Add traces
+    fig.add_trace(
+        go.Bar(x=daily_responses.index.to_list(), y=daily_responses.tolist(), name="Form Response"),
+        secondary_y=False,
+    )
+
+    fig.add_trace(
+        go.Scatter(x=daily_responses_cumsum.index.to_list(), y=daily_responses_cumsum.tolist(),
+                   name="Cumulative Form Response"),
+        secondary_y=False,
+    )
+
+    # Add figure title
+    fig.update_layout(
+        title_text=f"{GRAIN_LABELS[grain]} Inscription Form Responses"
+    )
+
+    # Set x-axis title
+    fig.update_xaxes(title_text="Date")
+
+    # Set y-axes titles
+    fig.update_yaxes(title_text="Completed Form Responses", secondary_y=False)
+    fig.update_yaxes(title_text="<b>secondary</b> yaxis title", secondary_y=True)
+
+    fig.update_layout(hovermode="x unified", uirevision='timeline')
+
+    # Add annotations
+    # fig.add_annotation(x='2021-08-07', y=daily_responses.loc['2021-08-07', 'count'],
+    #                    text="Open to public",
+    #                    showarrow=False,
+    #                    yshift=10)
+
+
+    return fig
+
+    #return {'data': fig.data, 'layout': fig.layout}, fig
+
+
+# Most table/chart generating functions will generate a table and corresponding chart.
+def generate_issues_table(data):
+    """
+    Generate an issues table and corresponding bar chart.
+    :param data: form data or its FormAggregates
+    :return: issue table and bar chart
+    """
+    import plotly.express as px
+
+    issues_table_data, issues_table_columns, df_issues_fig = get_summary(data, 'issues')
+    fig_issues = px.bar(df_issues_fig, y='Frequency', x='Error')
+
+    return issues_table_data, issues_table_columns, fig_issues
+
+
+def generate_index_outputs(data):
+    """
+    Generate the kpis, tables and charts of the overview page.
+    :param data: FormAggregates of the form data
+    :return: kpis, issue table and bar chart
+    """
+    kpi_total_claims, kpi_claim_completion, kpi_total_issues = generate_kpis(data)
+
+    issues_table_data, issues_table_columns, fig_issues = generate_issues_table(data)
+
+    return kpi_total_claims, kpi_claim_completion, kpi_total_issues, \
+           issues_table_data, issues_table_columns, fig_issues
+
+
+def generate_timeline_chart(data, grain):
+    """
+    Generate the line chart of all responses at a grain.
+    :param data: FormAggregates of the form data
+    :param grain: name of a grain in TIME_GRAINS
+    :return: line chart
+    """
+    return generate_fig(data, grain)
+
+
+# Rating shown in the rating chart when the page is built.
+DEFAULT_RATING = RATING_COLUMNS[0].split('_')[-1]
+
+
+def generate_country_table(user_data):
+    import plotly.express as px
+
+    # If the user data cannot be retrieved, display a generic choropleth chart.
+    if not isinstance(user_data, FormAggregates) and (user_data == None).all().all():
+        df = px.data.gapminder().query("year==2007")
+        fig = px.choropleth(df, locations="iso_alpha",
+                            color="lifeExp",  # lifeExp is a column of gapminder
+                            hover_name="country",  # column to add to hover information
+                            color_continuous_scale=px.colors.sequential.Plasma,
+                            title="Placeholder chart: Life Expectancy Around the World in 2007")
+        return None, None, fig
+
+    else:
+        country_table_data, country_table_columns, df_country_fig = get_summary(user_data, 'country')
+
+        df_country_fig = df_country_fig.assign(iso_country=resolve_countries(df_country_fig['Country']).to_numpy())
+
+        fig_country = px.choropleth(df_country_fig, locations="iso_country",
+                            color="Frequency",
+                            hover_name="Country",  # column to add to hover information
+                            custom_data=["Country"],  # name of the clicked country, see select_cross_filter
+                            )
+
+        return country_table_data, country_table_columns, fig_country
+
+
+def generate_speciality_table(data):
+    import plotly.express as px
+
+    speciality_table_data, speciality_table_columns, df_speciality_fig = get_summary(data, 'speciality')
+    fig_speciality = px.bar(df_speciality_fig, y='Frequency', x='Speciality')
+
+    return speciality_table_data, speciality_table_columns, fig_speciality
+
+
+def generate_ratings(data):
+
+    ratings_data = []
+
+    rating_columns_clean = []
+
+    for c in RATING_COLUMNS:
+        r_series = get_value_counts(data, c)
+        r_series.name = c.split('_')[-1]
+        ratings_data.append(r_series)
+        rating_columns_clean.append(c.split('_')[-1])
+
+    df_ratings = pd.concat(ratings_data, axis=1, keys=[s.name for s in ratings_data])
+
+    df_ratings_table = df_ratings.reindex(index=['S', 'A', 'B', 'C', 'D'])
+    df_ratings_table.reset_index(inplace=True)
+    df_ratings_table.rename(columns={'index': 'Rating'}, inplace=True)
+    df_ratings_table_columns = [{"name": i, "id": i} for i in df_ratings_table.columns]
+
+    fig_rating = {'data': df_ratings_table,
+                  'options': [{"label": x, "value": x} for x in rating_columns_clean],
+                  'value': DEFAULT_RATING
+                 }
+
+    return df_ratings_table.to_dict('records'), df_ratings_table_columns, fig_rating
+
+
+def generate_ratings_fig(data_ratings, value):
+    import plotly.express as px
+
+    fig = px.bar(data_ratings, x="Rating", y=value)
+    return fig
+
+
+def generate_first_collab_table(data):
+    import plotly.express as px
+
+    first_collab_table_data, first_collab_table_columns, df_first_collab_fig = get_summary(data, 'first_collab')
+    fig_first_collab = px.pie(df_first_collab_fig, values='Frequency', names='First Collab')
+
+    return first_collab_table_data, first_collab_table_columns, fig_first_collab
+
+
+def generate_speciality_outputs(data, country=None):
+    """
+    Generate the speciality table and chart.
+    :param data: FormAggregates of the form data
+    :param country: country the responses are filtered by, None for all
+    :return: speciality table and bar chart
+    """
+    return generate_speciality_table(data.select(country=country))
+
+
+def generate_rating_outputs(data, country=None, speciality=None):
+    """
+    Generate the rating table and the data of the rating chart.
+    :param data: FormAggregates of the form data
+    :param country: country the responses are filtered by, None for all
+    :param speciality: speciality the responses are filtered by, None for all
+    :return: rating table and rating chart data
+    """
+    return generate_ratings(data.select(country, speciality))
+
+
+def generate_first_collab_outputs(data, country=None, speciality=None):
+    """
+    Generate the first collab table and chart.
+    :param data: FormAggregates of the form data
+    :param country: country the responses are filtered by, None for all
+    :param speciality: speciality the responses are filtered by, None for all
+    :return: first collab table and pie chart
+    """
+    return generate_first_collab_table(data.select(country, speciality))
+
+
+def generate_rating_chart(data, value, country=None, speciality=None):
+    """
+    Generate the rating bar chart for one rating column.
+    :param data: FormAggregates of the form data
+    :param value: rating shown in the chart, e.g. 'stamina'
+    :param country: country the responses are filtered by, None for all
+    :param speciality: speciality the responses are filtered by, None for all
+    :return: bar chart
+    """
+    rating_table_data, rating_table_columns, fig_rating_dict = generate_ratings(data.select(country, speciality))
+
+    fig = generate_ratings_fig(fig_rating_dict['data'], value)
+
+    fig.update_layout(
+        title_text="Rating vs " + value
+    )
+    fig.update_yaxes(title_text="Frequency")
+
+    return fig
+
+
+def generate_country_outputs(data, speciality=None):
+    """
+    Generate the country table and choropleth.
+    :param data: FormAggregates of the form data
+    :param speciality: speciality the responses are filtered by, None for all
+    :return: country table and choropleth
+    """
+    return generate_country_table(data.select(speciality=speciality))
@@ -0,0 +1,187 @@
+"""
+Resolves the country names entered in the form to ISO 3166 alpha-3 codes for the choropleth.
+
+The index of names is built once from pycountry and saved to disk, so workers do not scan pycountry for every country on
+every refresh. Names that cannot be resolved are listed by get_unresolved_countries; they can be fixed by adding them to
+the overrides file (COUNTRY_OVERRIDES) without changing the code.
+"""
+import functools
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Saved index of lower case names to codes.
+COUNTRY_INDEX_PATH = os.environ.get('COUNTRY_INDEX_PATH', os.path.join('snapshots', 'country_index.json'))
+
+# JSON object of extra names to codes, e.g. {"Kosovo": "XKX"}. A null code marks a name that should not be resolved.
+COUNTRY_OVERRIDES = os.environ.get('COUNTRY_OVERRIDES', 'country_overrides.json')
+
+# Names pycountry does not know.
+OVERRIDES = {
+    '0': None,  # for people we couldn't find
+    'South Korea': 'KOR',
+    'North Korea': 'PRK',
+    'Netherlands Antilles': 'ANT',
+    'Macau': 'MAC',
+    'Saint Helena': 'SHN',
+    'Reunion': 'REU',
+    'Russia': 'RUS',
+    'Iran': 'IRN',
+    'Syria': 'SYR',
+    'Laos': 'LAO',
+    'Vietnam': 'VNM',
+    'Taiwan': 'TWN',
+    'Bolivia': 'BOL',
+    'Venezuela': 'VEN',
+    'Tanzania': 'TZA',
+    'Moldova': 'MDA',
+    'Brunei': 'BRN',
+    'Ivory Coast': 'CIV',
+    'Cape Verde': 'CPV',
+    'Czech Republic': 'CZE',
+    'UK': 'GBR',
+    'USA': 'USA',
+    'Kosovo': 'XKX',
+}
+
+
+def normalise(name):
+    return str(name).strip().lower()
+
+
+def build_country_index():
+    """
+    Index all names and codes pycountry knows.
+    :return: dict of lower case name to alpha-3 code
+    """
+    import pycountry
+
+    index = {}
+    for country in pycountry.countries:
+        for attribute in ['alpha_2', 'alpha_3', 'name', 'official_name', 'common_name']:
+            name = getattr(country, attribute, None)
+            if name:
+                index[normalise(name)] = country.alpha_3
+
+    return index
+
+
+def get_pycountry_version():
+    try:
+        from importlib.metadata import version
+        return version('pycountry')
+    except Exception:
+        return None
+
+
+def load_overrides():
+    """
+    :return: OVERRIDES updated with the overrides file, lower cased
+    """
+    overrides = dict(OVERRIDES)
+    if COUNTRY_OVERRIDES and os.path.exists(COUNTRY_OVERRIDES):
+        try:
+            with open(COUNTRY_OVERRIDES) as f:
+                overrides.update(json.load(f))
+        except Exception:
+            logger.exception('Ignoring unreadable country overrides %s', COUNTRY_OVERRIDES)
+
+    return {normalise(name): code for name, code in overrides.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def get_pycountry_index():
+    """
+    Returns the index of pycountry names, loading it from COUNTRY_INDEX_PATH or building and saving it the first time.
+    :return: dict of lower case name to alpha-3 code
+    """
+    pycountry_version = get_pycountry_version()
+
+    index = None
+    if COUNTRY_INDEX_PATH and os.path.exists(COUNTRY_INDEX_PATH):
+        try:
+            with open(COUNTRY_INDEX_PATH) as f:
+                saved = json.load(f)
+            if saved['pycountry'] == pycountry_version:
+                index = saved['index']
+        except Exception:
+            logger.exception('Rebuilding unreadable country index %s', COUNTRY_INDEX_PATH)
+
+    if index is None:
+        index = build_country_index()
+        if COUNTRY_INDEX_PATH:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(COUNTRY_INDEX_PATH)), exist_ok=True)
+                temp_path = f'{COUNTRY_INDEX_PATH}.{os.getpid()}.tmp'
+                with open(temp_path, 'w') as f:
+                    json.dump({'pycountry': pycountry_version, 'index': index}, f)
+                os.replace(temp_path, COUNTRY_INDEX_PATH)
+            except Exception:
+                logger.exception('Could not save country index %s', COUNTRY_INDEX_PATH)
+
+    return index
+
+
+@functools.lru_cache(maxsize=4)
+def get_country_index(overrides_modified=None):
+    """
+    :param overrides_modified: modification time of the overrides file, so changes to it are picked up
+    :return: dict of lower case name to alpha-3 code (None for names that should not be resolved)
+    """
+    index = dict(get_pycountry_index())
+    index.update(load_overrides())
+
+    return index
+
+
+def get_overrides_modified():
+    try:
+        return os.path.getmtime(COUNTRY_OVERRIDES)
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def lookup_country(name):
+    """
+    Resolve a name that is not in the index with pycountry's (slow) lookup. Results are memoized.
+    :param name: lower case country name
+    :return: alpha-3 code or None
+    """
+    import pycountry
+
+    try:
+        return pycountry.countries.lookup(name).alpha_3
+    except LookupError:
+        return None
+
+
+def resolve_countries(countries):
+    """
+    Map country names to alpha-3 codes.
+    :param countries: series of country names
+    :return: series of alpha-3 codes, None where the name could not be resolved
+    """
+    index = get_country_index(get_overrides_modified())
+    names = countries.map(normalise)
+
+    codes = names.map(index)
+    missing = ~names.isin(index.keys())
+    if missing.any():
+        codes[missing] = names[missing].map(lookup_country)
+
+    return codes.where(codes.notna(), None)
+
+
+def get_unresolved_countries(countries):
+    """
+    :param countries: series of country names
+    :return: sorted list of the (lower case) names resolve_countries cannot resolve. Names the overrides mark as not
+        to be resolved, like '0', are left out: there is nothing to fix.
+    """
+    index = get_country_index(get_overrides_modified())
+    names = countries.map(normalise)
+    names = names[~names.isin(index.keys())]
+    return sorted(set(names[names.map(lookup_country).isna()]))
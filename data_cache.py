@@ -0,0 +1,200 @@
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which a read counts half as much for the priority of a refresh, see DataCache.get_priority.
+ACTIVITY_HALF_LIFE = 300
+
+
+class DataCache:
+    """
+    Keeps the last good result of a loader function and refreshes it at most once every ``ttl`` seconds.
+
+    Only one refresh runs at a time: callers that arrive while the first load is in flight wait for it instead of
+    starting their own. Once a value exists, expired reads return it straight away and refresh in the background, so a
+    slow or failing upstream never blocks a callback - the last good value is served until a refresh succeeds. After
+    failed refreshes the next one waits for a backoff that doubles with every failure in a row.
+    """
+
+    def __init__(self, loader, ttl, scheduler=None, backoff=5, max_backoff=300, on_refresh=None):
+        """
+        :param loader: function returning the value to cache. It is passed the previous value (None on the first load),
+            so it can return it unchanged when the source did not change
+        :param ttl: number of seconds a value is considered fresh
+        :param scheduler: RefreshScheduler running the background refreshes, None to start a thread for each
+        :param backoff: seconds before retrying after a failed refresh
+        :param max_backoff: maximum seconds before retrying after failed refreshes in a row
+        :param on_refresh: function called with the new and the previous value after each successful refresh, once the
+            new value is served
+        """
+        self.loader = loader
+        self.on_refresh = on_refresh
+        self.ttl = ttl
+        self.scheduler = scheduler
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._refreshed = threading.Condition(self._lock)
+        self._value = None
+        self._loaded_at = None
+        self._refreshing = False
+        self._error = None
+        self._failures_in_row = 0
+        self._retry_at = 0
+        self._activity = 0
+        self._activity_at = time.monotonic()
+        self.fresh_reads = 0
+        self.stale_reads = 0
+        self.waits = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def get(self):
+        """
+        Return the cached value, loading it first if nothing has been loaded yet.
+        :return: the last good value returned by the loader
+        """
+        refresh = False
+        with self._lock:
+            self._record_read()
+            loaded = self._loaded_at is not None
+            if loaded:
+                if not self._is_stale():
+                    self.fresh_reads += 1
+                else:
+                    self.stale_reads += 1
+                    if not self._refreshing and time.monotonic() >= self._retry_at:
+                        self._refreshing = refresh = True
+                value = self._value
+            else:
+                self.waits += 1
+                if self._refreshing:
+                    # Someone else is doing the first load, wait for their result.
+                    while self._refreshing:
+                        self._refreshed.wait()
+                    if self._loaded_at is None:
+                        raise self._error
+                    return self._value
+
+                self._refreshing = True
+
+        if loaded:
+            if refresh:
+                # Outside of the lock: the scheduler reads the priority of caches while holding its own lock.
+                self._start_refresh()
+            return value
+
+        self.refresh()
+
+        with self._lock:
+            if self._loaded_at is None:
+                raise self._error
+            return self._value
+
+    def peek(self):
+        """
+        :return: the cached value without loading or refreshing it, None if nothing has been loaded yet
+        """
+        with self._lock:
+            return self._value
+
+    def prime(self, value):
+        """
+        Serve a value from elsewhere, e.g. a snapshot on disk, until the first refresh. The value counts as stale, so
+        the first read returns it immediately and starts a refresh in the background.
+        :param value:
+        :return:
+        """
+        with self._lock:
+            if self._loaded_at is None:
+                self._value = value
+                self._loaded_at = time.monotonic() - self.ttl
+
+    def invalidate(self):
+        """
+        Mark the cached value as stale so the next read triggers a refresh.
+        :return:
+        """
+        with self._lock:
+            if self._loaded_at is not None:
+                self._loaded_at -= self.ttl
+
+    def get_stats(self):
+        """
+        :return: dict of reads of a fresh value, reads of a stale value, reads that waited for the first load, and
+            refreshes that succeeded or failed
+        """
+        with self._lock:
+            return {
+                'fresh_reads': self.fresh_reads,
+                'stale_reads': self.stale_reads,
+                'waits': self.waits,
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+            }
+
+    def get_priority(self):
+        """
+        Priority of a refresh of this cache: seconds it has been stale, weighted by how often it has been read recently.
+        Read without the lock, so it may be slightly out of date.
+        :return: number, higher first
+        """
+        now = time.monotonic()
+        staleness = now - self._loaded_at - self.ttl if self._loaded_at is not None else self.ttl
+        activity = self._activity * 0.5 ** ((now - self._activity_at) / ACTIVITY_HALF_LIFE)
+        return max(staleness, 0) * (1 + math.log1p(activity))
+
+    def refresh(self):
+        """
+        Load a new value, keeping the last good value if the loader fails. Run by get, or by the scheduler for
+        background refreshes.
+        :return:
+        """
+        started = time.monotonic()
+        previous = self._value
+        try:
+            value = self.loader(previous)
+        except Exception as e:
+            logger.exception('Refreshing %s failed, keeping the last good value', self.loader.__name__)
+            with self._lock:
+                self._error = e
+                self.failures += 1
+                self._failures_in_row += 1
+                self._retry_at = time.monotonic() + min(self.backoff * 2 ** (self._failures_in_row - 1),
+                                                        self.max_backoff)
+                self._refreshing = False
+                self._refreshed.notify_all()
+            return
+
+        with self._lock:
+            self._value = value
+            self._loaded_at = started
+            self._error = None
+            self.refreshes += 1
+            self._failures_in_row = 0
+            self._retry_at = 0
+            self._refreshing = False
+            self._refreshed.notify_all()
+
+        if self.on_refresh is not None:
+            try:
+                self.on_refresh(value, previous)
+            except Exception:
+                logger.exception('on_refresh of %s failed', self.loader.__name__)
+
+    def _is_stale(self):
+        return time.monotonic() - self._loaded_at >= self.ttl
+
+    def _record_read(self):
+        now = time.monotonic()
+        self._activity = self._activity * 0.5 ** ((now - self._activity_at) / ACTIVITY_HALF_LIFE) + 1
+        self._activity_at = now
+
+    def _start_refresh(self):
+        if self.scheduler is not None:
+            self.scheduler.submit(self)
+        else:
+            threading.Thread(target=self.refresh, name='data-cache-refresh', daemon=True).start()
@@ -0,0 +1,53 @@
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """
+    Downsample a series with the Largest-Triangle-Three-Buckets algorithm, which keeps the points that shape the chart
+    (peaks, dips) rather than every n-th point.
+    :param x: increasing numbers, e.g. timestamps as integers
+    :param y: numbers
+    :param threshold: number of points to keep, at least 3
+    :return: positions of the points kept, including the first and last point
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+
+    # The first and last points are kept, the others are split into threshold - 2 buckets.
+    edges = np.linspace(1, n - 1, threshold - 1).astype('int64')
+    kept = np.empty(threshold, dtype='int64')
+    kept[0] = 0
+    kept[-1] = n - 1
+
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # The next point is the average of the next bucket (or the last point).
+        if i < threshold - 3:
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        # Keep the point of the bucket making the largest triangle with the previous kept point and the next point.
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[i + 1] = previous
+
+    return kept
+
+
+def downsample_series(series, threshold):
+    """
+    :param series: series indexed by time
+    :param threshold: number of points to keep
+    :return: the series with at most threshold points, see lttb
+    """
+    if len(series.index) <= threshold:
+        return series
+    return series.iloc[lttb(series.index.asi8, series.to_numpy(), threshold)]
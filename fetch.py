@@ -0,0 +1,180 @@
+"""
+HTTP requests to the form data source. All requests of a process share one pooled keep-alive session, have connect and
+read timeouts, and are retried with exponential backoff on connection errors, timeouts and server errors.
+
+A circuit breaker stops calling an upstream that keeps failing: for FETCH_BREAKER_RESET seconds requests fail
+immediately instead of waiting for timeouts, so refreshes give up quickly and the cached data is served.
+"""
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+
+from metrics import UPSTREAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a connection and for each read of a response.
+FETCH_CONNECT_TIMEOUT = float(os.environ.get('FETCH_CONNECT_TIMEOUT', 5))
+FETCH_READ_TIMEOUT = float(os.environ.get('FETCH_READ_TIMEOUT', 30))
+
+# Number of attempts of a request, the waits between attempts double from half a second.
+FETCH_ATTEMPTS = int(os.environ.get('FETCH_ATTEMPTS', 3))
+
+# Number of failed requests in a row that open the circuit breaker, and seconds before it lets a request try again.
+FETCH_BREAKER_FAILURES = int(os.environ.get('FETCH_BREAKER_FAILURES', 3))
+FETCH_BREAKER_RESET = float(os.environ.get('FETCH_BREAKER_RESET', 60))
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    Raised instead of making a request while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Counts failed calls in a row. After failure_threshold of them the breaker opens and calls fail immediately, until
+    reset_timeout seconds have passed and one trial call is let through: if it succeeds the breaker closes, otherwise it
+    opens again.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        """
+        :param failure_threshold: number of failed calls in a row that open the breaker
+        :param reset_timeout: seconds the breaker stays open before a trial call
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        :return:
+        :raises CircuitOpenError: if the breaker is open
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self._trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(f'Upstream failed {self.failures} times in a row, not calling it for now')
+            self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning('Opening the circuit breaker after %d failed requests', self.failures)
+                self.opened_at = time.monotonic()
+
+    def get_state(self):
+        """
+        :return: closed, open or half-open (waiting for a trial call)
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+
+def create_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+session = create_session()
+breaker = CircuitBreaker(FETCH_BREAKER_FAILURES, FETCH_BREAKER_RESET)
+
+# Runs requests next to each other, e.g. the status probe next to the download of the data.
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='fetch')
+
+
+def is_retryable(exception):
+    """
+    :param exception: exception raised by a request
+    :return: whether the request may succeed if it is tried again
+    """
+    if isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exception, requests.exceptions.HTTPError) and exception.response is not None:
+        return exception.response.status_code == 429 or exception.response.status_code >= 500
+    return False
+
+
+@retry(retry=retry_if_exception(is_retryable), stop=stop_after_attempt(FETCH_ATTEMPTS),
+       wait=wait_exponential(multiplier=0.5, max=8), reraise=True)
+def send(method, url, **kwargs):
+    r = session.request(method, url, timeout=(FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT), **kwargs)
+    if r.status_code == 429 or r.status_code >= 500:
+        r.raise_for_status()
+    return r
+
+
+def request(method, url, circuit_breaker=None, source='', **kwargs):
+    """
+    Make a request through a circuit breaker, with timeouts and retries. Its duration is recorded in the metrics apart
+    from the parsing of the response, so slow loads can be told from a slow upstream.
+    :param method: http method
+    :param url:
+    :param circuit_breaker: CircuitBreaker of the upstream, by default the one shared by all requests of the process
+    :param source: name of the data source making the request, for the metrics
+    :param kwargs: passed to requests, e.g. headers
+    :return: response. Client errors (4xx) are returned, not raised.
+    :raises requests.exceptions.RequestException: if all attempts failed or the circuit breaker is open
+    """
+    circuit_breaker = circuit_breaker or breaker
+    circuit_breaker.before_call()
+    try:
+        with UPSTREAM_SECONDS.time(source=source, method=method):
+            r = send(method, url, **kwargs)
+    except Exception:
+        circuit_breaker.record_failure()
+        raise
+    circuit_breaker.record_success()
+    return r
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def head(url, **kwargs):
+    return request('HEAD', url, **kwargs)
+
+
+def create_breaker():
+    """
+    :return: CircuitBreaker with the configured thresholds, for an upstream that fails independently of the others
+    """
+    return CircuitBreaker(FETCH_BREAKER_FAILURES, FETCH_BREAKER_RESET)
+
+
+def submit(func, *args):
+    """
+    Run a function in the background, e.g. a request that is not needed right away.
+    :param func:
+    :param args:
+    :return: future
+    """
+    return executor.submit(func, *args)
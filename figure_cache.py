@@ -0,0 +1,280 @@
+import collections
+import itertools
+import json
+import os
+import re
+import threading
+
+import plotly.io as pio
+from plotly.basedatatypes import BaseFigure
+
+from metrics import SERIALIZE_SECONDS
+
+# Significant digits of the numbers sent to the browser, more than charts and hover labels show.
+SIGNIFICANT_DIGITS = 6
+
+# Subplot types styled by the template, only sent when the figure has them.
+TEMPLATE_SUBPLOTS = ['geo', 'polar', 'ternary', 'scene', 'mapbox']
+
+
+_plotly_lock = threading.Lock()
+_plotly_ready = False
+
+# Characters the JSON encoders of plotly and Dash escape, so responses can be embedded in HTML. Serialized figures are
+# escaped alike, they are put into responses as they are.
+JSON_ESCAPES = [('<', '\\u003c'), ('>', '\\u003e'), ('/', '\\u002f')]
+
+# Placeholders of RawFigure in encoded responses: random per process, so no answer of the form can look like one.
+SPLICE_TOKEN = os.urandom(8).hex()
+SPLICE_PATTERN = re.compile(f'"raw-figure:{SPLICE_TOKEN}:([0-9]+)"')
+_splice_ids = itertools.count()
+# JSON of the RawFigures encoded by each thread, by placeholder id, until splice_figures puts them in the response.
+_pending = threading.local()
+
+
+def prepare_plotly():
+    """
+    Build a throwaway chart once per process. Plotly express creates the objects of its default template the first time
+    it reads them, which is not thread safe: charts built at once by the first requests of a worker could fail with
+    ValueError: Invalid value.
+    :return:
+    """
+    global _plotly_ready
+    if _plotly_ready:
+        return
+
+    with _plotly_lock:
+        if not _plotly_ready:
+            import plotly.express as px
+
+            px.bar(x=['a'], y=[1])
+            _plotly_ready = True
+
+
+class FigureCache:
+    """
+    Least recently used cache of serialized plotly figures, bounded by the total size of their JSON.
+
+    Figures are serialized once when they are stored. Reads return the JSON as it is, in a RawFigure that the responses
+    include without parsing and encoding it again, so N clients showing the same chart cost one build and one
+    serialization.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: total size of the cached JSON, least recently used figures are evicted beyond it
+        """
+        self.max_bytes = max_bytes
+        self._figures = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        :param key: hashable key of the figure, including the data version and chart parameters
+        :return: RawFigure, or None if it is not cached
+        """
+        with self._lock:
+            payload = self._figures.get(key)
+            if payload is None:
+                return None
+            self._figures.move_to_end(key)
+            self.hits += 1
+
+        return RawFigure(payload)
+
+    def put(self, key, figure):
+        """
+        Serialize and store a figure that was not in the cache.
+        :param key: hashable key of the figure
+        :param figure: plotly figure, or SerializedFigure if it was serialized in another process
+        :return: RawFigure
+        """
+        if isinstance(figure, SerializedFigure):
+            payload = figure.payload
+        else:
+            payload = serialize_figure(figure)
+
+        with self._lock:
+            self.misses += 1
+            if key in self._figures:
+                self._bytes -= len(self._figures.pop(key))
+            self._figures[key] = payload
+            self._bytes += len(payload)
+            while self._bytes > self.max_bytes and len(self._figures) > 1:
+                _, evicted = self._figures.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+        return RawFigure(payload)
+
+    def get_stats(self):
+        """
+        :return: dict of hits, misses, evictions, number of figures and their total size in bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'figures': len(self._figures),
+                'bytes': self._bytes,
+            }
+
+
+def round_numbers(value):
+    """
+    :param value: number, or list or dict that may contain numbers
+    :return: value with floats rounded to SIGNIFICANT_DIGITS
+    """
+    if isinstance(value, float):
+        return float(f'{value:.{SIGNIFICANT_DIGITS}g}')
+    if isinstance(value, list):
+        return [round_numbers(item) for item in value]
+    if isinstance(value, dict):
+        return {key: round_numbers(item) for key, item in value.items()}
+    return value
+
+
+def minimize_figure(figure):
+    """
+    Convert a figure to a dict with less to send and render: the template only keeps the styles of the trace and
+    subplot types the figure uses (the default template styles every type of trace), and numbers of the traces are
+    rounded to SIGNIFICANT_DIGITS.
+    :param figure: plotly figure
+    :return: dict
+    """
+    figure = json.loads(pio.to_json(figure, validate=False))
+    layout = figure.get('layout', {})
+    template = layout.get('template')
+
+    if template:
+        trace_types = {trace.get('type', 'scatter') for trace in figure.get('data', [])}
+        template['data'] = {trace_type: styles for trace_type, styles in template.get('data', {}).items()
+                            if trace_type in trace_types}
+        template_layout = template.get('layout', {})
+        for subplot in TEMPLATE_SUBPLOTS:
+            if subplot not in layout:
+                template_layout.pop(subplot, None)
+
+    figure['data'] = round_numbers(figure.get('data', []))
+
+    return figure
+
+
+def serialize_figure(figure):
+    """
+    :param figure: plotly figure
+    :return: JSON of the minimized figure
+    """
+    with SERIALIZE_SECONDS.time():
+        payload = json.dumps(minimize_figure(figure), separators=(',', ':'))
+        for character, escaped in JSON_ESCAPES:
+            payload = payload.replace(character, escaped)
+        return payload
+
+
+class SerializedFigure:
+    """
+    A figure serialized by serialize_figure. Processes building figures return them serialized, a string is much
+    cheaper to send back than a Figure object.
+    """
+
+    def __init__(self, payload):
+        self.payload = payload
+
+
+def serialize_figures(result):
+    """
+    :param result: a figure or a tuple that may contain figures
+    :return: result with the figures as SerializedFigure
+    """
+    if isinstance(result, BaseFigure):
+        return SerializedFigure(serialize_figure(result))
+    if isinstance(result, tuple):
+        return tuple(serialize_figures(item) for item in result)
+    return result
+
+
+class RawFigure:
+    """
+    A figure of the figure cache, still serialized. Dash encodes it as a placeholder, which splice_figures replaces with
+    the JSON of the figure once the response is encoded.
+    """
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def to_plotly_json(self):
+        # Called by the JSON encoders of Dash and plotly for objects they do not know.
+        splice_id = str(next(_splice_ids))
+        if not hasattr(_pending, 'payloads'):
+            _pending.payloads = {}
+        _pending.payloads[splice_id] = self.payload
+        return f'raw-figure:{SPLICE_TOKEN}:{splice_id}'
+
+
+def splice_figures(text):
+    """
+    Put the JSON of the RawFigures encoded by this thread into an encoded response, in place of their placeholders.
+    :param text: JSON text of the response
+    :return: JSON text
+    """
+    payloads = getattr(_pending, 'payloads', None)
+    if not payloads:
+        return text
+    _pending.payloads = {}
+    return SPLICE_PATTERN.sub(lambda match: payloads[match.group(1)], text)
+
+
+def has_pending_figures():
+    """
+    :return: whether this thread encoded RawFigures that splice_figures has not put into a response yet
+    """
+    return bool(getattr(_pending, 'payloads', None))
+
+
+class CachedFigure:
+    """
+    Placeholder for a figure stored in a FigureCache.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+
+def store_figures(figure_cache, key, result):
+    """
+    Move the figures in a result into the cache, leaving CachedFigure placeholders.
+    :param figure_cache: FigureCache
+    :param key: key of the result, extended with the position of each figure
+    :param result: a figure or a tuple that may contain figures
+    :return: result with placeholders, and result with figures as RawFigure
+    """
+    if isinstance(result, (BaseFigure, SerializedFigure)):
+        return CachedFigure(key), figure_cache.put(key, result)
+    if isinstance(result, tuple):
+        items = [store_figures(figure_cache, key + (i,), item) for i, item in enumerate(result)]
+        return tuple(stored for stored, _ in items), tuple(loaded for _, loaded in items)
+    return result, result
+
+
+def load_figures(figure_cache, result):
+    """
+    Replace the placeholders left by store_figures with the cached figures.
+    :param figure_cache: FigureCache
+    :param result: result with placeholders
+    :return: result with figures as RawFigure, or None if any of them has been evicted
+    """
+    if isinstance(result, CachedFigure):
+        return figure_cache.get(result.key)
+    if isinstance(result, tuple):
+        items = [load_figures(figure_cache, item) for item in result]
+        if any(item is None and isinstance(placeholder, (CachedFigure, tuple))
+               for item, placeholder in zip(items, result)):
+            return None
+        return tuple(items)
+    return result
@@ -1,145 +1,102 @@
+import startup  # First, so the startup report includes all imports.
+
+import hashlib
+
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from dash_table import DataTable
-from dash_table.Format import Format, Scheme
-from dash.dependencies import Output, Input
-import plotly.express as px
-import pandas as pd
+from dash.dependencies import Output, Input, State
 
 
 from dash.exceptions import PreventUpdate
 
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-
-from app import app, version, server, get_form_data, get_live_update
+import charts
+from aggregates import TIME_GRAINS, get_period_counts
+from app import (app, version, server, get_dashboard, get_page_dashboard, cached_by_data_version, build_all,
+                 DATA_VERSION_POLL)
+from charts import TIMELINE_POINTS, GRAIN_LABELS, generate_fig
+from tables import get_summary_table, get_summary_page
+from figure_cache import minimize_figure
 from apps import user_summary
 from apps import about
 
-# Functions
-def generate_kpis(data):
-    """
-    Generate a list of kpis shown at the top of the page
-    :param data:
-    :return:
-    """
-    # Total Claims
-    total_claims = len(data.index)
-
-    # % Complete
-    completion = round(total_claims/12800 * 100, 1)
-
-    # Total Issues
-    total_issues = data['error'].sum()
+startup.mark('import overview page')
 
-    return total_claims, completion, total_issues
+generate_index_outputs = cached_by_data_version(charts.generate_index_outputs)
+generate_timeline_chart = cached_by_data_version(charts.generate_timeline_chart)
 
 
-def generate_fig(data):
+def get_zoom_range(relayout_data):
     """
-    Create a line chart of the number of inscriptions over time
-    :param data:
-    :return: line chart figure
+    :param relayout_data: relayoutData of the line chart
+    :return: first and last date of the zoomed x axis, Nones if it is not zoomed
     """
-    dfn = pd.DataFrame(data['Timestamp'].copy(deep=True))
-
-    dfn['count'] = 1
-
-    dfn['Timestamp'] = pd.to_datetime(dfn['Timestamp'])
-
-    dfn.set_index('Timestamp', inplace=True)
-
-    daily_responses = dfn.resample('D').sum()
-
-    daily_responses_cumsum = dfn.resample('D').sum().cumsum()
-
-    ### Create plot
-    # Create figure with secondary y-axis
-    fig = make_subplots(specs=[[{"secondary_y": False}]])
-
-    # Add traces
-    fig.add_trace(
-        go.Bar(x=daily_responses.index.to_list(), y=daily_responses['count'].tolist(), name="Form Response"),
-        secondary_y=False,
-    )
-
-    fig.add_trace(
-        go.Scatter(x=daily_responses_cumsum.index.to_list(), y=daily_responses_cumsum['count'].tolist(),
-                   name="Cumulative Form Response"),
-        secondary_y=False,
-    )
-
-    # Add figure title
-    fig.update_layout(
-        title_text="Daily Inscription Form Responses"
-    )
-
-    # Set x-axis title
-    fig.update_xaxes(title_text="Date")
-
-    # Set y-axes titles
-    fig.update_yaxes(title_text="Completed Form Responses", secondary_y=False)
-    fig.update_yaxes(title_text="<b>secondary</b> yaxis title", secondary_y=True)
-
-    fig.update_layout(hovermode="x unified")
+    if relayout_data and 'xaxis.range[0]' in relayout_data:
+        return relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    if relayout_data and 'xaxis.range' in relayout_data:
+        return tuple(relayout_data['xaxis.range'])
+    return None, None
 
-    # Add annotations
-    # fig.add_annotation(x='2021-08-07', y=daily_responses.loc['2021-08-07', 'count'],
-    #                    text="Open to public",
-    #                    showarrow=False,
-    #                    yshift=10)
 
+def get_timeline_state(dashboard, grain, zoom_range=None):
+    """
+    Describe the line chart sent to the browser, so the next refresh can send only what changed, see get_timeline_tail.
+    :param dashboard: Dashboard
+    :param grain: name of a grain in TIME_GRAINS
+    :param zoom_range: first and last date of the zoomed x axis, None if it is not zoomed
+    :return: dict of the data version, grain and zoom range, and for charts that are not downsampled the number of
+        periods and a hash of the counts of all periods but the last, which may still be growing
+    """
+    state = {'version': dashboard.get_data_version(), 'grain': grain, 'range': zoom_range}
 
-    return fig
+    counts = get_period_counts(dashboard.get_form_aggregates(), grain)
+    if zoom_range is None and 0 < len(counts.index) <= TIMELINE_POINTS:
+        state['points'] = len(counts.index)
+        state['prefix'] = hashlib.sha1(counts.to_numpy()[:-1].tobytes() + str(counts.index[0]).encode()).hexdigest()
 
-    #return {'data': fig.data, 'layout': fig.layout}, fig
+    return state
 
 
-# Most table/chart generating functions will generate a table and corresponding chart.
-def generate_issues_table(data):
+def get_timeline_tail(dashboard, grain, state):
     """
-    Generate an issues table and corresponding bar chart.
-    :param data:
-    :return: issue table and bar chart
+    Returns the periods of the line chart that changed since it was sent, when all earlier periods are unchanged (new
+    responses only add to the last period or add new periods).
+    :param dashboard: Dashboard
+    :param grain: name of a grain in TIME_GRAINS
+    :param state: get_timeline_state of the chart in the browser
+    :return: dict of the position of the first changed period and the dates, counts and cumulative counts from there
+        on, or None if the whole chart has to be sent
     """
+    counts = get_period_counts(dashboard.get_form_aggregates(), grain)
+    points = state.get('points')
+    if points is None or state['range'] is not None or len(counts.index) > TIMELINE_POINTS or \
+            len(counts.index) < points:
+        return None
 
-    df_issues_freq = data['error_reason'].value_counts()
-    df_issues_percent = data['error_reason'].value_counts(normalize=True) * 100
-    df_issues_table = pd.concat([df_issues_freq, df_issues_percent], axis=1)
-    df_issues_table.loc["Total"] = df_issues_table.sum()
-    df_issues_table.reset_index(inplace=True)
-    df_issues_table.columns = ['Error', 'Frequency', 'Percentage']
-
-    df_issues_table_columns = [{"name": i, "id": i} for i in df_issues_table.columns]
-    df_issues_table_columns[2]['format'] = Format(precision=1, scheme=Scheme.fixed)
-    df_issues_table_columns[2]['type'] = 'numeric'
+    prefix = hashlib.sha1(counts.to_numpy()[:points - 1].tobytes() + str(counts.index[0]).encode()).hexdigest()
+    if prefix != state['prefix']:
+        return None
 
-    df_issues_fig = df_issues_table.drop(df_issues_table.index[-1], axis=0) # Drop total row for bar chart
-    fig_issues = px.bar(df_issues_fig, y='Frequency', x='Error')
-
-    return df_issues_table.to_dict('records'), df_issues_table_columns, fig_issues
+    start = points - 1
+    return {
+        'start': start,
+        'x': counts.index[start:].strftime('%Y-%m-%dT%H:%M:%S').tolist(),
+        'y': counts.to_numpy()[start:].tolist(),
+        'cumulative': counts.cumsum().to_numpy()[start:].tolist(),
+    }
 
 
 # Initial Values
 app.title = 'Example Dashboard'
 
-data = get_form_data()
-
-current_time = get_live_update()
-
-kpi_total_claims, kpi_claim_completion, kpi_total_issues = generate_kpis(data)
-
-fig = generate_fig(data)
-
-issues_table_data, issues_table_columns, fig_issues = generate_issues_table(data)
-
 
 # Bootstrap elements
+# The links are pointed to the pages of the dashboard shown, see update_navbar.
 navbar = dbc.NavbarSimple(
+    id='navbar',
     children=[
-        dbc.NavItem(dbc.NavLink("User Summary", href="/user_summary")),
-        dbc.NavItem(dbc.NavLink("About", href="/about")),
+        dbc.NavItem(dbc.NavLink("User Summary", id='nav-user-summary', href="/user_summary")),
+        dbc.NavItem(dbc.NavLink("About", id='nav-about', href="/about")),
     ],
     brand="Example Dashboard",
     brand_href="/",
@@ -158,103 +115,244 @@ app.layout = html.Div([
     html.Footer(id='page-footer', children=f'© 2021 WTByte - v{version}', style={'text-align':'center'})
 ])
 
-index_layout = html.Div([
-    dcc.Interval(
-            id='interval-component-index',
-            interval=3600 * 1000,  # in milliseconds
-            n_intervals=0
-        ),
-    dbc.Row([
-        dbc.Col(
-            [html.H1(children='Overview'),
-             html.Div(id='live-update-text-index', children=current_time),
-             ])]),
-    dbc.Row([
-        dbc.Col([
-            html.H2(children='Total Claims', style={'textAlign': 'center'}),
-            html.H3(id='kpi-total-claims', children=kpi_total_claims, style={'textAlign': 'center'})
-        ]),
-        dbc.Col([
-            html.H2(children='Total % Claimed', style={'textAlign': 'center'}),
-            html.H3(id='kpi-claim-completion', children=kpi_claim_completion, style={'textAlign': 'center'})
-        ]),
-        dbc.Col([
-            html.H2(children='Total Issues', style={'textAlign': 'center'}),
-            html.H3(id='kpi-total-issues', children=kpi_total_issues, style={'textAlign': 'center'})
-        ])
-    ]),
-    dbc.Row([
-        dbc.Col([
-            dcc.Graph(
-                id='example-graph',
-                figure=fig
-            )]
-        )
-    ]),
-    dbc.Row([
+
+def index_layout(dashboard):
+    """
+    Build the overview page with the current data, update_index refreshes it when the data changes.
+    :param dashboard: Dashboard
+    :return: layout
+    """
+    data_version = dashboard.get_data_version()
+
+    # The kpis, issues and timeline are built at once, see build_all.
+    index_outputs, fig_timeline = build_all(dashboard, [(generate_index_outputs, ()),
+                                                        (generate_timeline_chart, ('day',))])
+    kpi_total_claims, kpi_claim_completion, kpi_total_issues, \
+        issues_table_data, issues_table_columns, fig_issues = index_outputs
+
+    return html.Div([
+        dcc.Interval(
+                id='interval-component-index',
+                interval=int(DATA_VERSION_POLL * 1000),  # in milliseconds
+                n_intervals=0
+            ),
+        # Version of the data shown, so refreshes skip what the browser already has.
+        dcc.Store(id='index-data-version', data=data_version),
+        dcc.Store(id='timeline-state', data=get_timeline_state(dashboard, 'day')),
+        dcc.Store(id='timeline-update'),
+        dbc.Row([
+            dbc.Col(
+                [html.H1(children='Overview'),
+                 html.Div(id='live-update-text-index', children=dashboard.get_live_update()),
+                 ])]),
+        dbc.Row([
             dbc.Col([
-                html.Label(
-                    "Error Summary"
-                ),
-                DataTable(
-                    id='issues-table',
-                    columns=issues_table_columns,
-                    data=issues_table_data,
-                )
+                html.H2(children='Total Claims', style={'textAlign': 'center'}),
+                html.H3(id='kpi-total-claims', children=kpi_total_claims, style={'textAlign': 'center'})
             ]),
             dbc.Col([
+                html.H2(children='Total % Claimed', style={'textAlign': 'center'}),
+                html.H3(id='kpi-claim-completion', children=kpi_claim_completion, style={'textAlign': 'center'})
+            ]),
+            dbc.Col([
+                html.H2(children='Total Issues', style={'textAlign': 'center'}),
+                html.H3(id='kpi-total-issues', children=kpi_total_issues, style={'textAlign': 'center'})
+            ])
+        ]),
+        dbc.Row([
+            dbc.Col([
+                dbc.RadioItems(
+                    id='timeline-grain',
+                    options=[{'label': GRAIN_LABELS[grain], 'value': grain} for grain in TIME_GRAINS],
+                    value='day',
+                    inline=True,
+                ),
                 dcc.Graph(
-                    id='fig-issues',
-                    figure=fig_issues
-            )]),
-            #dbc.Col([html.Div('Placeholder for chart 2')]),
+                    id='example-graph',
+                    figure=fig_timeline
+                )]
+            )
         ]),
-])
+        dbc.Row([
+                dbc.Col([
+                    html.Label(
+                        "Error Summary"
+                    ),
+                    get_summary_table(dashboard, 'issues-table', 'issues', issues_table_columns)
+                ]),
+                dbc.Col([
+                    dcc.Graph(
+                        id='fig-issues',
+                        figure=fig_issues
+                )]),
+                #dbc.Col([html.Div('Placeholder for chart 2')]),
+            ]),
+    ])
+
+
+built_pages = set()
+
+
+def build_page(pathname, layout):
+    """
+    Build the layout of a page. The first build of each page is recorded in the startup report.
+    :param pathname:
+    :param layout: function building the layout
+    :return: layout
+    """
+    if pathname in built_pages:
+        return layout()
+
+    with startup.timed(f'first build of {pathname}'):
+        page = layout()
+    built_pages.add(pathname)
+    startup.print_report()
+
+    return page
+
 
 # Note the URL does not include apps/some.py but is required when returning the layout
 @app.callback(Output('page-content', 'children'),
               Input('url', 'pathname'))
 def display_page(pathname):
-    if pathname == '/':
-        return index_layout
-    if pathname == '/user_summary':
-        return user_summary.layout
-    elif pathname == '/about':
+    dashboard, page = get_dashboard(pathname)
+    if dashboard is None:
+        return '404 - this page does not exist!'
+
+    if page == '/':
+        return build_page(pathname, lambda: index_layout(dashboard))
+    if page == '/user_summary':
+        return build_page(pathname, lambda: user_summary.layout(dashboard))
+    elif page == '/about':
         return about.layout
     else:
         return '404 - this page does not exist!'
 
 
+@app.callback([
+    Output('navbar', 'brand'),
+    Output('navbar', 'brand_href'),
+    Output('nav-user-summary', 'href'),
+    Output('nav-about', 'href'),
+],
+    Input('url', 'pathname'))
+def update_navbar(pathname):
+    dashboard = get_page_dashboard(pathname)
+    return dashboard.title, dashboard.prefix, dashboard.prefix + 'user_summary', dashboard.prefix + 'about'
+
+
 @app.callback([
     Output('live-update-text-index', 'children'),
     Output('kpi-total-claims', 'children'),
     Output('kpi-claim-completion', 'children'),
     Output('kpi-total-issues', 'children'),
-    Output('example-graph', 'figure'),
-    Output('issues-table', 'data'),
     Output('issues-table', 'columns'),
     Output('fig-issues', 'figure'),
+    Output('index-data-version', 'data'),
 ],
     Input('interval-component-index', 'n_intervals'),
-    Input('url', 'pathname'))
-def update_index(n, url):
+    State('index-data-version', 'data'),
+    State('url', 'pathname'),
+    prevent_initial_call=True)
+def update_index(n, shown_version, pathname):
+    dashboard = get_page_dashboard(pathname)
+    # Most ticks only compare versions, the page is built with the current data when navigating to it.
+    data_version = dashboard.get_new_data_version(shown_version)
 
-    if url == '/':
-        data = get_form_data()
+    kpi_total_claims, kpi_claim_completion, kpi_total_issues, \
+        issues_table_data, issues_table_columns, fig_issues = generate_index_outputs(dashboard)
 
-        live_update_text = get_live_update()
+    return dashboard.get_live_update(), kpi_total_claims, kpi_claim_completion, kpi_total_issues, \
+        issues_table_columns, fig_issues, data_version
 
-        fig = generate_fig(data)
 
-        kpi_total_claims, kpi_claim_completion, kpi_total_issues = generate_kpis(data)
+# The line chart is served from the counts at the selected grain, for the zoomed range only. When new data only
+# changes the end of the chart, only the changed periods are sent and merged into the chart in the browser.
+@app.callback([
+    Output('timeline-update', 'data'),
+    Output('timeline-state', 'data'),
+],
+    Input('timeline-grain', 'value'),
+    Input('example-graph', 'relayoutData'),
+    Input('index-data-version', 'data'),
+    State('timeline-state', 'data'),
+    State('url', 'pathname'),
+    prevent_initial_call=True)
+def update_timeline(grain, relayout_data, data_version, state, pathname):
+    dashboard = get_page_dashboard(pathname)
+    relayout_data = relayout_data or {}
+    start, end = get_zoom_range(relayout_data)
+    if start is not None:
+        zoom_range = [start, end]
+    elif 'xaxis.autorange' in relayout_data or not state:
+        zoom_range = None
+    else:
+        # Not a change of the x axis, e.g. resizing the window.
+        zoom_range = state['range']
 
-        issues_table_data, issues_table_columns, fig_issues = generate_issues_table(data)
+    if state and state['grain'] == grain and state['range'] == zoom_range:
+        if state['version'] == data_version:
+            # The browser already shows this chart.
+            raise PreventUpdate
 
-        return live_update_text, kpi_total_claims, kpi_claim_completion, kpi_total_issues, \
-               fig, \
-               issues_table_data, issues_table_columns, fig_issues
-    else:
-        raise PreventUpdate
+        tail = get_timeline_tail(dashboard, grain, state)
+        if tail is not None:
+            return {'tail': tail}, get_timeline_state(dashboard, grain)
+
+    if zoom_range is None:
+        return {'figure': generate_timeline_chart(dashboard, grain)}, get_timeline_state(dashboard, grain)
+
+    # Zoomed charts are not cached, they are cheap to build from the counts.
+    return {'figure': minimize_figure(generate_fig(dashboard.get_form_aggregates(), grain, start, end))}, \
+        get_timeline_state(dashboard, grain, zoom_range)
+
+
+app.clientside_callback(
+    """
+    function(update, figure) {
+        if (!update) {
+            return window.dash_clientside.no_update;
+        }
+        if (update.figure) {
+            return update.figure;
+        }
+        var tail = update.tail;
+        var fig = Object.assign({}, figure);
+        fig.data = [tail.y, tail.cumulative].map(function(y, i) {
+            var trace = Object.assign({}, figure.data[i]);
+            trace.x = trace.x.slice(0, tail.start).concat(tail.x);
+            trace.y = trace.y.slice(0, tail.start).concat(y);
+            return trace;
+        });
+        return fig;
+    }
+    """,
+    Output('example-graph', 'figure'),
+    Input('timeline-update', 'data'),
+    State('example-graph', 'figure'))
+
+
+# The issues table is paged, sorted and filtered on the server, and refreshed when the data changes.
+@app.callback([
+    Output('issues-table', 'data'),
+    Output('issues-table', 'page_count'),
+],
+    Input('issues-table', 'page_current'),
+    Input('issues-table', 'page_size'),
+    Input('issues-table', 'sort_by'),
+    Input('issues-table', 'filter_query'),
+    Input('index-data-version', 'data'),
+    State('url', 'pathname'),
+    prevent_initial_call=True)
+def update_issues_table(page_current, page_size, sort_by, filter_query, data_version, pathname):
+    return get_summary_page(get_page_dashboard(pathname), 'issues', page_current, page_size, sort_by, filter_query)
+
+
+# Imported once the callbacks are defined, they are run to pre-render the pages.
+import prerender
+
+startup.mark('build app layout and callbacks')
+startup.print_report()
 
 if __name__ == '__main__':
     app.run_server(debug=False)
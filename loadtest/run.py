@@ -0,0 +1,450 @@
+"""
+Load test of the dashboard: starts the app with gunicorn against a local stand-in of the google sheet (see
+sheet_server.py) and simulates browser sessions sending Dash callbacks, for each configuration of gunicorn workers and
+threads. Reports the throughput, the latency percentiles, the number of downloads of the sheet and the memory of the
+workers. Run from the root of the repository, e.g.
+
+    python -m loadtest.run --sessions 200 --duration 60 --configs 1x4 2x4 4x8
+    python -m loadtest.run --env FORM_DATA_TTL=5 --env BUILD_PROCESSES=2 --save loadtest/results.json
+
+A session opens a page as the browser does (the url callbacks), then sends the interval ticks of the page every --think
+seconds with the data version it shows, switches the rating chart and clicks countries on the user summary and opens
+another page. The rating chart is switched in the browser, so the dropdown only sends requests if it gets a server
+callback again. A click selects a country, or unselects it when it was selected, and filters the other charts and
+tables of the page.
+Variables given with --env are set for the app, to compare configurations of the caches. Worker memory is read from
+/proc and is only reported on Linux.
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import warnings
+
+warnings.filterwarnings('ignore', category=UserWarning)
+
+import requests
+
+from benchmarks.synthetic import COUNTRIES
+from loadtest.sheet_server import SheetServer
+
+PAGES = ['/', '/user_summary']
+
+# Stores with the data version shown by a page, sent back with its interval ticks.
+VERSION_STORES = {'/': 'index-data-version', '/user_summary': 'user-data-version'}
+INTERVALS = {'/': 'interval-component-index', '/user_summary': 'interval-component-user'}
+
+
+def parse_output(output):
+    """
+    :param output: output of a callback in _dash-dependencies, e.g. '..a.children...b.figure..' or 'a.children'
+    :return: dict of the id and property of the output, or a list of them for callbacks with several outputs
+    """
+    multiple = output.startswith('..')
+    outputs = []
+    for part in output.strip('.').split('...') if multiple else [output]:
+        component_id, prop = part.rsplit('.', 1)
+        outputs.append({'id': component_id, 'property': prop})
+    return outputs if multiple else outputs[0]
+
+
+class DashClient:
+    """
+    Sends Dash callbacks to the app like the browser does, built from the callbacks listed by _dash-dependencies.
+    """
+
+    def __init__(self, url, dependencies):
+        """
+        :param url: url of the app
+        :param dependencies: json of _dash-dependencies
+        """
+        self.url = url
+        self.callbacks = [c for c in dependencies if not c.get('clientside_function')]
+        self.session = requests.Session()
+
+    def find_callbacks(self, component_id, prop):
+        """
+        :return: server callbacks with the property as an input. Callbacks running in the browser are left out, they
+            cost the server nothing.
+        """
+        return [c for c in self.callbacks if {'id': component_id, 'property': prop} in c['inputs']]
+
+    def call(self, callback, values, changed):
+        """
+        Send a callback.
+        :param callback: callback of _dash-dependencies
+        :param values: dict of the values of the inputs and states by 'id.property', missing ones are None
+        :param changed: 'id.property' of the input that changed
+        :return: response
+        """
+        def with_values(items):
+            return [dict(item, value=values.get(f"{item['id']}.{item['property']}")) for item in items]
+
+        body = {
+            'output': callback['output'],
+            'outputs': parse_output(callback['output']),
+            'inputs': with_values(callback['inputs']),
+            'state': with_values(callback['state']),
+            'changedPropIds': [changed],
+        }
+        try:
+            return self.session.post(f'{self.url}/_dash-update-component', json=body, timeout=60)
+        except requests.ConnectionError:
+            # gunicorn closed the idle keep-alive connection, browsers then send again on a new one.
+            return self.session.post(f'{self.url}/_dash-update-component', json=body, timeout=60)
+
+
+def find_prop(layout, component_id, prop):
+    """
+    :param layout: json of a layout or part of it
+    :return: the property of the component with the id, or None if it is not in the layout
+    """
+    if isinstance(layout, dict):
+        props = layout.get('props')
+        if isinstance(props, dict) and props.get('id') == component_id:
+            return props.get(prop)
+        for value in layout.values():
+            found = find_prop(value, component_id, prop)
+            if found is not None:
+                return found
+    elif isinstance(layout, list):
+        for value in layout:
+            found = find_prop(value, component_id, prop)
+            if found is not None:
+                return found
+    return None
+
+
+def get_props(layout, props=None):
+    """
+    :param layout: json of a layout or part of it
+    :param props: dict the properties are added to
+    :return: dict of the properties of the components with an id by 'id.property', as the browser sends them
+    """
+    if props is None:
+        props = {}
+    if isinstance(layout, dict):
+        component = layout.get('props')
+        if isinstance(component, dict) and isinstance(component.get('id'), str):
+            for prop, value in component.items():
+                props.setdefault(f"{component['id']}.{prop}", value)
+        for value in layout.values():
+            get_props(value, props)
+    elif isinstance(layout, list):
+        for value in layout:
+            get_props(value, props)
+    return props
+
+
+class Recorder:
+    """
+    Collects the duration and status of every request of the sessions.
+    """
+
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, kind, seconds, response):
+        with self._lock:
+            self.samples[kind].append(seconds)
+            if response is None or response.status_code >= 400:
+                self.errors[kind] += 1
+
+    def timed(self, kind, send):
+        """
+        :param kind: kind of request, e.g. 'interval'
+        :param send: function sending the request
+        :return: response, or None if it failed
+        """
+        started = time.perf_counter()
+        try:
+            response = send()
+        except requests.RequestException:
+            response = None
+        self.record(kind, time.perf_counter() - started, response)
+        return response
+
+
+def run_session(client, recorder, deadline, think, rng):
+    """
+    Browse the dashboard until the deadline.
+    :param client: DashClient
+    :param recorder: Recorder
+    :param deadline: time.monotonic() at which the session stops
+    :param think: mean number of seconds between the interval ticks
+    :param rng: random.Random of the session
+    :return:
+    """
+    def pause():
+        time.sleep(min(rng.expovariate(1 / think), max(0, deadline - time.monotonic())))
+
+    while time.monotonic() < deadline:
+        pathname = rng.choice(PAGES)
+        values = {'url.pathname': pathname}
+        version = None
+        for callback in client.find_callbacks('url', 'pathname'):
+            response = recorder.timed('url', lambda: client.call(callback, values, 'url.pathname'))
+            if response is not None and response.status_code == 200 and 'page-content' in callback['output']:
+                version = find_prop(response.json(), VERSION_STORES[pathname], 'data')
+                # The tables and stores of the page, sent with the callbacks of the page.
+                get_props(response.json(), values)
+
+        for tick in range(1, rng.randint(3, 10)):
+            pause()
+            if time.monotonic() >= deadline:
+                return
+
+            interval = INTERVALS[pathname]
+            values.update({f'{interval}.n_intervals': tick, f'{VERSION_STORES[pathname]}.data': version})
+            for callback in client.find_callbacks(interval, 'n_intervals'):
+                response = recorder.timed('interval', lambda: client.call(callback, values,
+                                                                          f'{interval}.n_intervals'))
+                # 204: the data did not change, the page keeps what it shows.
+                if response is not None and response.status_code == 200:
+                    shown = response.json().get('response', {}).get(VERSION_STORES[pathname], {}).get('data')
+                    version = shown or version
+
+            if pathname == '/user_summary' and rng.random() < 0.5:
+                values['fig-rating-dropdown.value'] = rng.choice(['stamina', 'tenacity', 'precision', 'reaction'])
+                for callback in client.find_callbacks('fig-rating-dropdown', 'value'):
+                    recorder.timed('dropdown', lambda: client.call(callback, values, 'fig-rating-dropdown.value'))
+
+            if pathname == '/user_summary' and rng.random() < 0.3:
+                values['fig-country.clickData'] = {'points': [{'customdata': [rng.choice(COUNTRIES)]}]}
+                click_chart(client, recorder, values)
+
+
+def click_chart(client, recorder, values):
+    """
+    Send the callbacks of a click on a chart, then of the change of the cross filter it caused.
+    :param client: DashClient
+    :param recorder: Recorder
+    :param values: values of the inputs and states of the page with the clickData of the chart, updated with the new
+        cross filter and the charts it was applied to
+    :return:
+    """
+    for callback in client.find_callbacks('fig-country', 'clickData'):
+        response = recorder.timed('click', lambda: client.call(callback, values, 'fig-country.clickData'))
+        if response is not None and response.status_code == 200:
+            values['cross-filter.data'] = response.json()['response']['cross-filter']['data']
+
+    for callback in client.find_callbacks('cross-filter', 'data'):
+        response = recorder.timed('click', lambda: client.call(callback, values, 'cross-filter.data'))
+        if response is not None and response.status_code == 200:
+            shown = response.json().get('response', {}).get('user-cross-filter', {}).get('data')
+            if shown is not None:
+                values['user-cross-filter.data'] = shown
+
+
+def get_descendants(pid):
+    """
+    :param pid: process id
+    :return: ids of the processes started by it and by them, from /proc
+    """
+    children = collections.defaultdict(list)
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    # The command may contain spaces, the parent id follows it.
+                    parent = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children[parent].append(int(name))
+
+    descendants = []
+    pending = list(children[pid])
+    while pending:
+        child = pending.pop()
+        descendants.append(child)
+        pending.extend(children[child])
+    return descendants
+
+
+def get_rss(pid):
+    """
+    :return: resident memory of a process in bytes, or None if it cannot be read
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def start_app(port, workers, threads, env):
+    """
+    Start the app with gunicorn and wait until it answers.
+    :param port:
+    :param workers: number of gunicorn worker processes
+    :param threads: number of threads per worker
+    :param env: environment of the app
+    :return: gunicorn process
+    """
+    command = [sys.executable, '-m', 'gunicorn', 'index:server', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--threads', str(threads), '--worker-class', 'gthread',
+               '--timeout', '120', '--log-level', 'warning']
+    process = subprocess.Popen(command, env=env)
+
+    started = time.monotonic()
+    while time.monotonic() - started < 300:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {process.returncode}')
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/data-version', timeout=60).ok:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+
+    process.terminate()
+    raise RuntimeError('The app did not start in time')
+
+
+def run_config(args, sheet_server, workers, threads):
+    """
+    Load test one configuration of gunicorn. The downloads of the sheet are counted from when the app answers, the
+    first download of the other workers included.
+    :param args: arguments of the command line
+    :param sheet_server: SheetServer
+    :param workers: number of gunicorn worker processes
+    :param threads: number of threads per worker
+    :return: dict of the results
+    """
+    env = dict(os.environ, SHEET_BASE_URL=sheet_server.url, FORM_DATA_SNAPSHOT='', COUNTRY_INDEX_PATH='')
+    env.update(item.split('=', 1) for item in args.env)
+    process = start_app(args.port, workers, threads, env)
+
+    try:
+        url = f'http://127.0.0.1:{args.port}'
+        dependencies = requests.get(f'{url}/_dash-dependencies', timeout=60).json()
+        recorder = Recorder()
+        sheet_server.reset_stats()
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        sessions = []
+        for i in range(args.sessions):
+            session = threading.Thread(target=run_session, daemon=True, args=(
+                DashClient(url, dependencies), recorder, deadline, args.think, random.Random(args.seed + i)))
+            session.start()
+            sessions.append(session)
+            # Sessions arrive over the first seconds instead of all at once.
+            time.sleep(min(args.ramp_up, args.duration) / args.sessions)
+
+        stop_appending = threading.Event()
+        if args.append_every:
+            def append():
+                while not stop_appending.wait(args.append_every):
+                    sheet_server.append(args.append_rows)
+            threading.Thread(target=append, daemon=True).start()
+
+        for session in sessions:
+            session.join()
+        elapsed = time.monotonic() - started
+        stop_appending.set()
+
+        processes = get_descendants(process.pid)
+        rss = [r for r in (get_rss(pid) for pid in processes) if r is not None]
+    finally:
+        process.terminate()
+        process.wait(60)
+
+    samples = [s for kind_samples in recorder.samples.values() for s in kind_samples]
+    upstream = sheet_server.get_stats()
+    return {
+        'config': f'{workers}x{threads}',
+        'requests': len(samples),
+        'errors': sum(recorder.errors.values()),
+        'throughput': len(samples) / elapsed,
+        'latency': get_percentiles(samples),
+        'latency_by_kind': {kind: get_percentiles(s) for kind, s in sorted(recorder.samples.items())},
+        'requests_by_kind': {kind: len(s) for kind, s in sorted(recorder.samples.items())},
+        'sheet_downloads': sum(count for key, count in upstream.items() if key.startswith('GET ')),
+        'sheet_requests': {key: count for key, count in upstream.items() if key != 'rows'},
+        'rss_mb': sum(rss) / 2 ** 20 if rss else None,
+        'processes': len(rss),
+    }
+
+
+def get_percentiles(samples):
+    """
+    :param samples: durations in seconds
+    :return: dict of the p50, p95 and p99 in milliseconds
+    """
+    if len(samples) < 2:
+        return {'p50': None, 'p95': None, 'p99': None}
+    quantiles = statistics.quantiles(samples, n=100)
+    return {'p50': quantiles[49] * 1000, 'p95': quantiles[94] * 1000, 'p99': quantiles[98] * 1000}
+
+
+def format_ms(value):
+    return f'{value:8.0f}ms' if value is not None else f"{'-':>10}"
+
+
+def print_report(results):
+    print(f"{'Config':8} {'Requests':>9} {'Errors':>7} {'Req/s':>8} {'p50':>10} {'p95':>10} {'p99':>10} "
+          f"{'Sheet GET':>10} {'RSS':>10}")
+    for r in results:
+        rss = f"{r['rss_mb']:8.0f}MB" if r['rss_mb'] is not None else f"{'-':>10}"
+        print(f"{r['config']:8} {r['requests']:9} {r['errors']:7} {r['throughput']:8.1f} "
+              f"{format_ms(r['latency']['p50'])} {format_ms(r['latency']['p95'])} {format_ms(r['latency']['p99'])} "
+              f"{r['sheet_downloads']:10} {rss}")
+        for kind, latency in r['latency_by_kind'].items():
+            print(f"  {kind:6} {r['requests_by_kind'][kind]:9} {'':7} {'':8} "
+                  f"{format_ms(latency['p50'])} {format_ms(latency['p95'])} {format_ms(latency['p99'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', nargs='+', default=['1x4', '2x4'],
+                        help='gunicorn configurations to test, as workers x threads')
+    parser.add_argument('--sessions', type=int, default=100, help='number of simulated browser sessions')
+    parser.add_argument('--duration', type=float, default=60, help='number of seconds each configuration is tested')
+    parser.add_argument('--ramp-up', type=float, default=10, help='number of seconds over which the sessions start')
+    parser.add_argument('--think', type=float, default=2,
+                        help='mean number of seconds between the interval ticks of a session. Browsers tick every '
+                             'DATA_VERSION_POLL seconds, less packs more load into a shorter test.')
+    parser.add_argument('--rows', type=int, default=10000, help='number of rows of the synthetic sheet')
+    parser.add_argument('--append-every', type=float, default=0,
+                        help='add responses to the sheet every this many seconds during the test, 0 to never change '
+                             'the data')
+    parser.add_argument('--append-rows', type=int, default=10, help='number of responses added at once')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='environment variable of the app, can be repeated')
+    parser.add_argument('--port', type=int, default=8050, help='port of the app')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the sessions')
+    parser.add_argument('--save', help='save the results to this json file')
+    args = parser.parse_args()
+
+    results = []
+    for config in args.configs:
+        workers, threads = (int(n) for n in config.lower().split('x'))
+        print(f'Testing {workers} workers x {threads} threads with {args.sessions} sessions for {args.duration:.0f}s',
+              file=sys.stderr)
+        # Each configuration starts from the same data.
+        sheet_server = SheetServer(args.rows).start()
+        try:
+            results.append(run_config(args, sheet_server, workers, threads))
+        finally:
+            sheet_server.stop()
+
+    print_report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
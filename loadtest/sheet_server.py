@@ -0,0 +1,174 @@
+"""
+Local stand-in for the csv export of the google sheet, serving synthetic form responses at the same urls, so load tests
+never call google. Point the app to it with SHEET_BASE_URL. Run from the root of the repository, e.g.
+
+    python -m loadtest.sheet_server --rows 100000 --port 8765
+    SHEET_BASE_URL=http://127.0.0.1:8765 python index.py
+"""
+import argparse
+import collections
+import csv
+import hashlib
+import io
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from benchmarks.synthetic import generate_form_data
+
+
+def to_gviz_csv(data):
+    """
+    :param data: form data as generated by generate_form_data(raw=True)
+    :return: csv rows as exported by google sheets, every value quoted and no header
+    """
+    buffer = io.StringIO()
+    data.to_csv(buffer, header=False, index=False, quoting=csv.QUOTE_ALL)
+    return buffer.getvalue().encode()
+
+
+class SheetServer:
+    """
+    Serves the rows of one sheet of form responses for every sheet id and sheet name, and counts the requests by method
+    and sheet name. Requests with tq=select * offset N only get the rows from N on, like the incremental downloads of
+    SheetSource (the header is always sent), and the ETag of the data answers If-None-Match with 304.
+    """
+
+    def __init__(self, rows, host='127.0.0.1', port=0, seed=0):
+        """
+        :param rows: number of form responses
+        :param host:
+        :param port: port to listen on, 0 for any free port
+        :param seed: seed of the synthetic data
+        """
+        data = generate_form_data(rows, seed=seed, raw=True)
+        self.header = ','.join(f'"{c}"' for c in data.columns).encode() + b'\n'
+        self.lines = to_gviz_csv(data).splitlines(keepends=True)
+        self.seed = seed
+        self.appended = 0
+        self.requests = collections.Counter()
+        self._lock = threading.Lock()
+        self._last_timestamp = pd.to_datetime(data['Timestamp'].iloc[-1], format='%m/%d/%Y %H:%M:%S')
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.handle(self, send_body=True)
+
+            def do_HEAD(self):
+                server.handle(self, send_body=False)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f'http://{host}:{self.httpd.server_address[1]}'
+
+    def start(self):
+        """
+        Serve in a background thread.
+        :return: self
+        """
+        threading.Thread(target=self.httpd.serve_forever, name='sheet-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def append(self, rows):
+        """
+        Add form responses, as the form does when people answer it. The data version of the app changes with them.
+        :param rows: number of responses to add
+        :return:
+        """
+        with self._lock:
+            self.appended += 1
+            data = generate_form_data(rows, start=self._last_timestamp, seed=self.seed + self.appended, raw=True)
+            data['Username'] = [f'user{len(self.lines) + i}' for i in range(rows)]
+            self._last_timestamp = pd.to_datetime(data['Timestamp'].iloc[-1], format='%m/%d/%Y %H:%M:%S')
+            self.lines = self.lines + to_gviz_csv(data).splitlines(keepends=True)
+
+    def get_stats(self):
+        """
+        :return: dict of the number of requests by method and sheet name, e.g. 'GET Sheet1', and the number of rows
+        """
+        with self._lock:
+            stats = {f'{method} {sheet}': count for (method, sheet), count in self.requests.items()}
+            stats['rows'] = len(self.lines)
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+
+    def handle(self, request, send_body):
+        """
+        Answer a request for the csv export of a sheet.
+        :param request: BaseHTTPRequestHandler
+        :param send_body: False for HEAD requests
+        :return:
+        """
+        url = urllib.parse.urlparse(request.path)
+        query = urllib.parse.parse_qs(url.query)
+        if not url.path.endswith('/gviz/tq'):
+            request.send_error(404)
+            return
+
+        offset = 0
+        tq = query.get('tq', [''])[0].lower().split()
+        if 'offset' in tq[:-1]:
+            offset = int(tq[tq.index('offset') + 1])
+
+        with self._lock:
+            self.requests[(request.command, query.get('sheet', [''])[0])] += 1
+            lines = self.lines
+
+        body = self.header + b''.join(lines[offset:])
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+
+        if request.headers.get('If-None-Match') == etag:
+            request.send_response(304)
+            request.send_header('ETag', etag)
+            request.end_headers()
+            return
+
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/csv; charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        request.send_header('ETag', etag)
+        request.end_headers()
+        if send_body:
+            request.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='number of form responses')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--append-every', type=float, default=0,
+                        help='add responses every this many seconds, 0 to never change the data')
+    parser.add_argument('--append-rows', type=int, default=10, help='number of responses added at once')
+    args = parser.parse_args()
+
+    server = SheetServer(args.rows, port=args.port)
+    print(f'Serving {args.rows} rows at {server.url}')
+    if not args.append_every:
+        server.httpd.serve_forever()
+        return
+
+    server.start()
+    stop = threading.Event()
+    try:
+        while not stop.wait(args.append_every):
+            server.append(args.append_rows)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Counters and histograms of this process, served in the Prometheus text format on /metrics (see app.py).
+
+Metrics are kept per process: with several gunicorn workers every scrape is answered by one of them.
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+# Upper bounds of the histogram buckets.
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+metrics = []
+
+# Functions returning samples read when the metrics are rendered: list of (name, type, help, function), the function
+# returns a number or a dict of label tuples to numbers.
+collectors = []
+
+
+def format_labels(labelnames, labelvalues):
+    if not labelnames:
+        return ''
+    labels = []
+    for name, value in zip(labelnames, labelvalues):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        labels.append(f'{name}="{value}"')
+    return '{' + ','.join(labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Count of events, e.g. bytes downloaded.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        :param name: metric name
+        :param documentation: help text
+        :param labelnames: names of the labels passed to inc
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observations, e.g. callback durations, in cumulative buckets.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        """
+        :param name: metric name
+        :param documentation: help text
+        :param labelnames: names of the labels passed to observe
+        :param buckets: upper bounds of the buckets, increasing
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of a with block, also when it raises.
+        :param labels:
+        :return:
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        labelnames = self.labelnames + ('le',)
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{format_labels(labelnames, key + (format_value(bound),))} '
+                                 f'{cumulative}')
+                lines.append(f'{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}')
+                lines.append(f'{self.name}_count{format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+def collect(name, metric_type, documentation, labelnames=()):
+    """
+    Decorator registering a function read when the metrics are rendered, for values kept elsewhere like cache stats.
+    :param name: metric name
+    :param metric_type: gauge or counter
+    :param documentation: help text
+    :param labelnames: names of the labels
+    :return: decorator
+    """
+    def decorator(func):
+        collectors.append((name, metric_type, documentation, tuple(labelnames), func))
+        return func
+
+    return decorator
+
+
+def render():
+    """
+    :return: all metrics in the Prometheus text format
+    """
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+
+    for name, metric_type, documentation, labelnames, func in collectors:
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        values = func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f'{name}{format_labels(labelnames, key)} {format_value(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+CALLBACK_SECONDS = Histogram('dashboard_callback_duration_seconds',
+                             'Time to answer a Dash callback request, including serialization.', ['callback'])
+CALLBACK_BYTES = Histogram('dashboard_callback_response_bytes', 'Size of Dash callback responses.', ['callback'],
+                           buckets=BYTES_BUCKETS)
+LOAD_SECONDS = Histogram('dashboard_load_duration_seconds',
+                         'Time to load the form data of a dashboard: the requests to its source, parsing and '
+                         'aggregation.', ['dashboard'])
+LOAD_ERRORS = Counter('dashboard_load_errors_total', 'Failed loads of the form data.', ['dashboard'])
+UPSTREAM_SECONDS = Histogram('dashboard_upstream_request_seconds',
+                             'Time of the HTTP requests to the form data source, retries included. Streamed '
+                             'downloads are timed until their headers, the body is read while it is parsed.',
+                             ['source', 'method'])
+FETCH_BYTES = Counter('dashboard_fetch_bytes_total', 'Bytes downloaded from the form data source.', ['source'])
+ROWS_PARSED = Counter('dashboard_rows_parsed_total', 'Rows of form data parsed.', ['source'])
+BUILD_SECONDS = Histogram('dashboard_build_duration_seconds',
+                          'Time to compute the tables and build the figures of a function cached by data version.',
+                          ['function'])
+SERIALIZE_SECONDS = Histogram('dashboard_figure_serialization_seconds', 'Time to serialize a figure to JSON.')
+RESULT_CACHE = Counter('dashboard_result_cache_requests_total',
+                       'Calls of functions cached by data version, by whether the result was cached.',
+                       ['function', 'result'])
+BUILD_TIMEOUTS = Counter('dashboard_build_timeouts_total',
+                         'Builds that did not finish in time on the build processes and were built in the request, by '
+                         'whether they were still queued or running.', ['function', 'state'])
+PRERENDERED = Counter('dashboard_prerendered_responses_total',
+                      'Dash callback requests answered with a pre-rendered response, see prerender.py.', ['dashboard'])
+PRERENDER_SECONDS = Histogram('dashboard_prerender_duration_seconds',
+                              'Time to pre-render the pages of a dashboard after its data changed.', ['dashboard'])
@@ -0,0 +1,374 @@
+"""
+Pre-rendered pages for traffic spikes, e.g. when a link to the dashboard is shared widely. Most visitors open a page
+and watch it: every one of them sends the same callback requests (the layout of the page, then the interval ticks and
+table refreshes when the data changes) and gets the same responses. With PRERENDER_PAGES=1 these responses are rendered
+once per data version, in the background after each refresh that changed the data, and saved to files. Requests are
+then answered with the file before Dash runs the callback, so the pages are not rebuilt or serialized for every visitor.
+
+Only requests sent with the values the page was rendered with are answered from the files. A visitor who sorts or filters
+a table, clicks a chart or zooms the timeline sends other values, and these requests run the callbacks as usual.
+
+One worker at a time renders the pages of a dashboard, to a temporary directory renamed once complete, so workers sharing
+PRERENDER_PATH render each version once and never read a half written one.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import flask
+from dash.exceptions import PreventUpdate
+
+from app import app, server, dashboards, data_listeners, get_dashboard, DATA_VERSION_POLL
+from figure_cache import splice_figures
+from metrics import PRERENDERED, PRERENDER_SECONDS
+from snapshot import snapshot_lock
+
+logger = logging.getLogger(__name__)
+
+# Serve the callbacks of visitors who have not changed anything on the page from pre-rendered files.
+PRERENDER_PAGES = os.environ.get('PRERENDER_PAGES', '0') == '1'
+
+# Directory of the pre-rendered files, one directory per dashboard and data version.
+PRERENDER_PATH = os.environ.get('PRERENDER_PATH', os.path.join('snapshots', 'pages'))
+
+# Pages of each dashboard, relative to its prefix, see display_page.
+PAGES = ['', 'user_summary', 'about']
+
+# Stores with the data version shown by a page, see Dashboard.get_new_data_version. Requests only differ by whether the
+# version they send is the current one.
+VERSION_STORES = ['index-data-version.data', 'user-data-version.data']
+
+# Versions of the pages of a dashboard kept on disk, for workers that did not load the latest data yet.
+KEEP_VERSIONS = 2
+
+_lock = threading.Lock()
+_rendering = set()
+_rendered = {}
+_started = False
+
+
+def get_request_key(body, version):
+    """
+    :param body: body of a Dash callback request
+    :param version: current data version of the dashboard
+    :return: key of the response to the request: the output and the values of the inputs and states, without the
+        number of interval ticks
+    """
+    values = {}
+    for item in body.get('inputs', []) + body.get('state', []):
+        name = f"{item['id']}.{item['property']}"
+        if item['property'] == 'n_intervals':
+            continue
+        value = item.get('value')
+        if name in VERSION_STORES:
+            value = 'current' if value == version else 'stale'
+        values[name] = value
+
+    key = json.dumps([body.get('output'), values], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_directory(dashboard, version):
+    """
+    :param dashboard: name of a dashboard
+    :param version: data version
+    :return: directory of the pre-rendered responses of the version
+    """
+    return os.path.join(PRERENDER_PATH, dashboard, version)
+
+
+def get_props(layout, props):
+    """
+    Add the properties of the components of a layout, by 'id.property', as the browser sends them.
+    :param layout: json of a layout or part of it
+    :param props: dict the properties are added to
+    :return:
+    """
+    if isinstance(layout, dict):
+        component = layout.get('props')
+        if isinstance(component, dict) and isinstance(component.get('id'), str):
+            for prop, value in component.items():
+                props.setdefault(f"{component['id']}.{prop}", value)
+        for value in layout.values():
+            get_props(value, props)
+    elif isinstance(layout, list):
+        for value in layout:
+            get_props(value, props)
+
+
+def get_callbacks(values, trigger):
+    """
+    :param values: values of the components of a page by 'id.property'
+    :param trigger: function telling whether an input fires the callbacks to render
+    :return: list of the output, callback and firing input of the server callbacks with all their inputs and states on
+        the page
+    """
+    ids = {name.rsplit('.', 1)[0] for name in values}
+    callbacks = []
+    for output, callback in app.callback_map.items():
+        # Clientside callbacks have no function.
+        if 'callback' not in callback:
+            continue
+        inputs = [f"{item['id']}.{item['property']}" for item in callback['inputs']]
+        fired_by = [name for name in inputs if trigger(name)]
+        if fired_by and all(item['id'] in ids for item in callback['inputs'] + callback['state']):
+            callbacks.append((output, callback, fired_by[0]))
+    return callbacks
+
+
+def dispatch(output, callback, values, changed):
+    """
+    Run a callback as Dash does for a request of the browser.
+    :param output: output of the callback
+    :param callback: callback of app.callback_map
+    :param values: values of the inputs and states by 'id.property', missing ones are None
+    :param changed: 'id.property' of the input that changed
+    :return: body of the request and of the response, None if the callback did not update the page
+    """
+    def with_values(items):
+        return [dict(item, value=values.get(f"{item['id']}.{item['property']}")) for item in items]
+
+    body = {
+        'output': output,
+        'inputs': with_values(callback['inputs']),
+        'state': with_values(callback['state']),
+        'changedPropIds': [changed],
+    }
+    with server.test_request_context('/_dash-update-component', method='POST', json=body):
+        try:
+            response = app.dispatch()
+        except PreventUpdate:
+            return body, None
+    # The after request functions of the server, which put the cached figures into responses, do not run here.
+    return body, splice_figures(response.get_data(as_text=True)).encode()
+
+
+def render_page(pathname, version, directory):
+    """
+    Render the responses to the callbacks of a page: opening the page, then the interval ticks and refreshes of a
+    page showing an older version, and of a page showing the current version.
+    :param pathname: path of the page
+    :param version: data version of the dashboard
+    :param directory: directory the responses are saved to, named by their request key
+    :return: number of responses
+    """
+    def save(body, payload):
+        with open(os.path.join(directory, get_request_key(body, version) + '.json'), 'wb') as f:
+            f.write(payload)
+
+    values = {'url.pathname': pathname}
+    responses = 0
+    for output, callback, changed in get_callbacks(values, lambda name: name == 'url.pathname'):
+        body, payload = dispatch(output, callback, values, changed)
+        if payload is not None:
+            save(body, payload)
+            responses += 1
+            if output == 'page-content.children':
+                get_props(json.loads(payload), values)
+
+    def is_refresh(name):
+        return name.endswith('.n_intervals') or name in VERSION_STORES
+
+    for output, callback, changed in get_callbacks(values, is_refresh):
+        stores = [name for name in VERSION_STORES
+                  if any(f"{item['id']}.{item['property']}" == name for item in callback['inputs'] + callback['state'])]
+        for shown_version in [None, version] if stores else [version]:
+            body, payload = dispatch(output, callback, {**values, **{name: shown_version for name in stores}}, changed)
+            if payload is not None:
+                save(body, payload)
+                responses += 1
+
+    return responses
+
+
+def render_version(dashboard, version, directory):
+    """
+    Render the pages of a dashboard for a data version.
+    :param dashboard: Dashboard
+    :param version: current data version of the dashboard
+    :param directory: directory of the pre-rendered responses of the version
+    :return:
+    """
+    started = time.perf_counter()
+    temp_directory = f'{directory}.{os.getpid()}.tmp'
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+    try:
+        responses = sum(render_page(dashboard.prefix + page, version, temp_directory) for page in PAGES)
+        if dashboard.cache.peek().version != version:
+            # The data changed while rendering, some responses may be of the new data.
+            return
+        os.rename(temp_directory, directory)
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+    remove_old_versions(dashboard.name)
+    PRERENDER_SECONDS.observe(time.perf_counter() - started, dashboard=dashboard.name)
+    logger.info('Pre-rendered %s responses of %s for version %s in %.1fs', responses, dashboard.name, version,
+                time.perf_counter() - started)
+
+
+def render_pages(dashboard):
+    """
+    Render the pages of a dashboard for its current data version, unless they are already on disk. One worker at a
+    time renders the pages of a dashboard, the others then find them on disk.
+    :param dashboard: Dashboard
+    :return:
+    """
+    version = dashboard.cache.peek().version
+    directory = get_directory(dashboard.name, version)
+    try:
+        with snapshot_lock(os.path.join(PRERENDER_PATH, dashboard.name), blocking=True):
+            if not os.path.isdir(directory):
+                render_version(dashboard, version, directory)
+    except Exception:
+        logger.exception('Could not pre-render the pages of %s', dashboard.name)
+    finally:
+        with _lock:
+            _rendering.discard(dashboard.name)
+            if os.path.isdir(directory):
+                _rendered[dashboard.name] = version
+        if dashboard.cache.peek().version != version:
+            schedule_render(dashboard)
+
+
+def remove_old_versions(dashboard):
+    """
+    Remove the pre-rendered responses of all but the last KEEP_VERSIONS versions of a dashboard.
+    :param dashboard: name of a dashboard
+    :return:
+    """
+    root = os.path.join(PRERENDER_PATH, dashboard)
+    versions = []
+    for name in os.listdir(root):
+        try:
+            if os.path.isdir(os.path.join(root, name)) and not name.endswith('.tmp'):
+                versions.append((os.path.getmtime(os.path.join(root, name)), name))
+        except OSError:
+            # Removed by another worker.
+            continue
+    for _, name in sorted(versions, reverse=True)[KEEP_VERSIONS:]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def schedule_render(dashboard):
+    """
+    Render the pages of a dashboard in the background, if they are not rendered or being rendered for its current data
+    version. Called after each refresh that changed the data.
+    :param dashboard: Dashboard
+    :return:
+    """
+    form_data = dashboard.cache.peek()
+    if form_data is None:
+        return
+    with _lock:
+        if dashboard.name in _rendering or _rendered.get(dashboard.name) == form_data.version:
+            return
+        _rendering.add(dashboard.name)
+
+    threading.Thread(target=render_pages, args=(dashboard,), name='prerender', daemon=True).start()
+
+
+def read_response(dashboard, version, body):
+    """
+    :param dashboard: Dashboard
+    :param version: current data version of the dashboard
+    :param body: body of a Dash callback request
+    :return: pre-rendered response to the request and its ETag, or Nones if there is none
+    """
+    key = get_request_key(body, version)
+    try:
+        with open(os.path.join(get_directory(dashboard.name, version), key + '.json'), 'rb') as f:
+            payload = f.read()
+    except FileNotFoundError:
+        # Not rendered yet after a restart from a snapshot, or a request with other values.
+        schedule_render(dashboard)
+        return None, None
+    return payload, f'{version}-{key[:16]}'
+
+
+def serve_prerendered():
+    """
+    Answer a Dash callback request with its pre-rendered response, if there is one. Other requests go on to Dash.
+    :return: response, or None
+    """
+    if flask.request.method != 'POST' or not flask.request.path.endswith('/_dash-update-component'):
+        return None
+
+    body = flask.request.get_json(silent=True) or {}
+    items = body.get('inputs', []) + body.get('state', [])
+    # Pattern-matching callbacks send lists of inputs, they are not pre-rendered.
+    if not all(isinstance(item, dict) for item in items):
+        return None
+    pathname = next((item.get('value') for item in items if item['id'] == 'url' and item['property'] == 'pathname'),
+                    None)
+    if pathname is None:
+        return None
+    dashboard, _ = get_dashboard(pathname)
+    if dashboard is None:
+        return None
+
+    version = dashboard.cache.get().version
+    payload, etag = read_response(dashboard, version, body)
+    if payload is None:
+        return None
+
+    PRERENDERED.inc(dashboard=dashboard.name)
+    response = flask.Response(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def serve_page(page=''):
+    """
+    Pre-rendered layout of a page, e.g. /prerendered/user_summary or /prerendered/d/sales/, as the response of the Dash
+    callback building it. For caches in front of the app: the response has a strong ETag, answers If-None-Match with
+    304 Not Modified until the data changes, and may be reused for DATA_VERSION_POLL seconds.
+    :param page: path of the page without the leading /
+    :return: json response
+    """
+    pathname = '/' + page
+    dashboard, _ = get_dashboard(pathname)
+    if dashboard is None:
+        flask.abort(404)
+
+    version = dashboard.cache.get().version
+    body = {'output': 'page-content.children', 'inputs': [{'id': 'url', 'property': 'pathname', 'value': pathname}],
+            'state': []}
+    payload, etag = read_response(dashboard, version, body)
+    if payload is None:
+        flask.abort(404)
+
+    response = flask.Response(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={int(DATA_VERSION_POLL)}'
+    return response.make_conditional(flask.request)
+
+
+def start_rendering():
+    """
+    Render the pages after each refresh that changed the data, from the first request on. Processes importing the app
+    without serving it, e.g. the children of the build pool, never render pages.
+    :return:
+    """
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    data_listeners.append(schedule_render)
+    # Dashboards loaded before the first request, e.g. from their snapshot.
+    for dashboard in dashboards.values():
+        schedule_render(dashboard)
+
+
+if PRERENDER_PAGES:
+    server.before_request(start_rendering)
+    server.before_request(serve_prerendered)
+    server.add_url_rule('/prerendered/', 'prerendered_page', serve_page)
+    server.add_url_rule('/prerendered/<path:page>', 'prerendered_page', serve_page)
@@ -0,0 +1,66 @@
+"""
+Refreshes the data caches of all dashboards of the process on a bounded pool of threads, so however many dashboards are
+served the number of concurrent requests to the sources stays the same.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshScheduler:
+    """
+    Runs the refreshes of DataCaches on at most max_workers threads. When more caches are due than there are threads,
+    the cache with the highest priority goes first: the most stale and most viewed, see DataCache.get_priority.
+    """
+
+    def __init__(self, max_workers):
+        """
+        :param max_workers: maximum number of refreshes running at once
+        """
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._pending = set()
+        self._workers = []
+        self._running = 0
+
+    def submit(self, cache):
+        """
+        Queue a refresh of a cache. The cache must not be queued twice, DataCache only submits when no refresh of it is
+        queued or running.
+        :param cache: DataCache
+        :return:
+        """
+        with self._lock:
+            self._pending.add(cache)
+            # A thread is started when no idle one is left.
+            if len(self._workers) < self.max_workers and len(self._workers) < self._running + len(self._pending):
+                worker = threading.Thread(target=self._work, name=f'refresh-{len(self._workers)}', daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._available.notify()
+
+    def get_stats(self):
+        """
+        :return: dict of the number of queued and running refreshes
+        """
+        with self._lock:
+            return {'pending': len(self._pending), 'running': self._running}
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._available.wait()
+                cache = max(self._pending, key=lambda c: c.get_priority())
+                self._pending.remove(cache)
+                self._running += 1
+
+            try:
+                cache.refresh()
+            except Exception:
+                logger.exception('Refresh of %s failed', cache)
+            finally:
+                with self._lock:
+                    self._running -= 1
@@ -0,0 +1,159 @@
+"""
+Column types of the form data, applied when it is read instead of letting pandas infer them: the answers to multiple
+choice questions are categoricals, the ratings ordered categoricals S > A > B > C > D and Timestamp a date time parsed
+once with the format of the sheet. Categoricals keep one small integer code per row instead of a Python string, which
+cuts the memory of the data and makes counting its values a bincount of the codes.
+"""
+import io
+import logging
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as csv
+
+from aggregates import RATING_COLUMNS, SUMMARIES, get_summary_column
+
+logger = logging.getLogger(__name__)
+
+# Format of the timestamps google forms writes to the sheet, e.g. 8/1/2021 9:05:03.
+TIMESTAMP_FORMAT = '%m/%d/%Y %H:%M:%S'
+
+RATINGS = ['S', 'A', 'B', 'C', 'D']
+RATING_DTYPE = pd.CategoricalDtype(RATINGS, ordered=True)
+
+
+def get_categorical_columns(columns):
+    """
+    :param columns: columns of the form data
+    :return: columns of the multiple choice questions, which are read as categoricals
+    """
+    return [get_summary_column(columns, name) for name in SUMMARIES]
+
+
+def get_column_types(columns):
+    """
+    :param columns: columns of the form data
+    :return: dict of pyarrow types of the declared columns, the types of other columns are inferred
+    """
+    column_types = {'Timestamp': pa.timestamp('s'), 'error': pa.int8()}
+    for c in get_categorical_columns(columns) + RATING_COLUMNS:
+        column_types[c] = pa.dictionary(pa.int32(), pa.string())
+    return column_types
+
+
+def get_empty_form_data(columns):
+    """
+    Form data without rows, for the export of an empty sheet. Google sends an empty body for a sheet without even a
+    header, the columns are then those the form data had before.
+    :param columns: columns of the form data, None if they are not known
+    :return: form data with the schema applied
+    :raises ValueError: if the columns are not known
+    """
+    if columns is None:
+        raise ValueError('The form data sheet is empty, it does not even have a header')
+    return apply_schema(pd.DataFrame(columns=columns))
+
+
+def read_form_csv(content, columns=None):
+    """
+    Parse the csv export of the sheet with the pyarrow csv reader, which reads the declared types directly.
+    :param content: csv bytes
+    :param columns: columns of the form data read before, for an empty export, see get_empty_form_data
+    :return: form data with the schema applied
+    """
+    if not content.strip():
+        return get_empty_form_data(columns)
+    columns = pd.read_csv(io.BytesIO(content), nrows=0).columns
+    if not content.partition(b'\n')[2].strip():
+        # Only the header, which the pyarrow reader cannot read on its own.
+        return get_empty_form_data(columns)
+    read_options = csv.ReadOptions(use_threads=True)
+    convert_options = csv.ConvertOptions(column_types=get_column_types(columns), timestamp_parsers=[TIMESTAMP_FORMAT],
+                                         strings_can_be_null=True)
+    try:
+        table = csv.read_csv(io.BytesIO(content), read_options=read_options, convert_options=convert_options)
+    except pa.ArrowInvalid:
+        # E.g. timestamps in another format after a change of the locale of the sheet.
+        logger.exception('The form data does not match its schema, inferring the column types')
+        return apply_schema(pd.read_csv(io.BytesIO(content)))
+
+    return apply_schema(table.to_pandas())
+
+
+def iter_form_csv(stream, block_size, columns=None):
+    """
+    Parse the csv export of the sheet a block at a time, so only one block of rows is in memory at once.
+    :param stream: buffered file like object with the csv, read from its first line
+    :param block_size: number of bytes of csv parsed at once
+    :param columns: columns of the form data read before, for an empty export, see get_empty_form_data
+    :return: column names and an iterator of form data chunks with the schema applied
+    """
+    header = stream.readline()
+    if not header.strip():
+        return get_empty_form_data(columns).columns, iter([])
+    columns = pd.read_csv(io.BytesIO(header), nrows=0).columns
+    if not stream.peek(1).strip():
+        # Only the header: the pyarrow reader would fail on the empty rest of the csv.
+        return columns, iter([])
+    # The types of later blocks must match the first one, so undeclared columns are read as text instead of being
+    # inferred from the first block.
+    column_types = {c: pa.string() for c in columns}
+    column_types.update(get_column_types(columns))
+    # A block with timestamps in another format cannot be read again once the stream moved past it, so they are read
+    # as text and parsed a chunk at a time.
+    column_types['Timestamp'] = pa.string()
+    read_options = csv.ReadOptions(column_names=list(columns), block_size=block_size)
+    convert_options = csv.ConvertOptions(column_types=column_types, strings_can_be_null=True)
+    reader = csv.open_csv(stream, read_options=read_options, convert_options=convert_options)
+
+    return columns, (apply_schema(parse_timestamps(batch).to_pandas()) for batch in reader)
+
+
+def parse_timestamps(batch):
+    """
+    Parse the timestamps of a block of the csv read as text with the format of the sheet. A block with timestamps in
+    another format is left as it is, for apply_schema to infer their format.
+    :param batch: pyarrow record batch
+    :return: pyarrow record batch or table
+    """
+    if 'Timestamp' not in batch.schema.names:
+        return batch
+    i = batch.schema.get_field_index('Timestamp')
+    try:
+        timestamps = pc.strptime(batch.column(i), format=TIMESTAMP_FORMAT, unit='s')
+    except pa.ArrowInvalid:
+        logger.warning('Timestamps of the form data do not match %s, inferring their format', TIMESTAMP_FORMAT)
+        return batch
+    return pa.Table.from_batches([batch]).set_column(i, 'Timestamp', timestamps)
+
+
+def apply_schema(data):
+    """
+    Convert the columns of form data read without the schema, e.g. a snapshot of an older version. Columns that already
+    have their type are left as they are.
+    :param data: form data
+    :return: form data with the schema applied
+    """
+    data = data.copy(deep=False)
+    if 'Timestamp' in data and not pd.api.types.is_datetime64_any_dtype(data['Timestamp']):
+        try:
+            data['Timestamp'] = pd.to_datetime(data['Timestamp'], format=TIMESTAMP_FORMAT)
+        except ValueError:
+            data['Timestamp'] = pd.to_datetime(data['Timestamp'])
+    for c in get_categorical_columns(data.columns):
+        if c in data and not pd.api.types.is_categorical_dtype(data[c]):
+            data[c] = data[c].astype('category')
+    for c in RATING_COLUMNS:
+        if c in data and data[c].dtype != RATING_DTYPE:
+            # Answers other than the ratings become missing values.
+            data[c] = data[c].astype(RATING_DTYPE)
+    return data
+
+
+def get_memory_usage(data):
+    """
+    :param data: form data
+    :return: series of the bytes used by each column, including the Python strings of object columns
+    """
+    return data.memory_usage(index=False, deep=True)
@@ -0,0 +1,121 @@
+import contextlib
+import logging
+import os
+import pickle
+import time
+
+from sources import FormData
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks (Windows): every worker refreshes the snapshot itself.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def save_snapshot(form_data, path):
+    """
+    Write the aggregates of the form data with its version and validators, so other workers and later starts load what
+    the pages are built from with load_snapshot, instead of parsing and aggregating the rows again. The rows are not
+    saved. The file is replaced atomically, readers never see a half written snapshot.
+    :param form_data: FormData
+    :param path: snapshot file
+    :return:
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        # The fields of FormData come first, so read_snapshot_version reads the version without the aggregates.
+        pickle.dump({
+            'version': form_data.version,
+            'etag': form_data.etag,
+            'last_modified': form_data.last_modified,
+            'downloaded_at': form_data.downloaded_at,
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(form_data.aggregates, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path):
+    """
+    Read form data written by save_snapshot. Its size depends on the number of distinct answers and days, not on the
+    number of rows.
+    :param path: snapshot file
+    :return: FormData without rows, or None if there is no usable snapshot
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            metadata = pickle.load(f)
+            aggregates = pickle.load(f)
+    except Exception:
+        logger.exception('Ignoring unreadable snapshot %s', path)
+        return None
+
+    return FormData(metadata['version'], None, aggregates, metadata['etag'], metadata['last_modified'],
+                    metadata['downloaded_at'])
+
+
+def read_snapshot_version(path):
+    """
+    Read the version of a snapshot without reading its aggregates.
+    :param path: snapshot file
+    :return: version or None if there is no usable snapshot
+    """
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)['version']
+    except Exception:
+        return None
+
+
+def get_snapshot_age(path):
+    """
+    :param path: snapshot file
+    :return: seconds since the snapshot was last saved or confirmed up to date with touch_snapshot, None if it is missing
+    """
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def touch_snapshot(path):
+    """
+    Mark a snapshot as up to date, without writing it again.
+    :param path: snapshot file
+    :return:
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+@contextlib.contextmanager
+def snapshot_lock(path, blocking=True):
+    """
+    Lock held by the one worker that refreshes a snapshot, while the other workers read it.
+    :param path: snapshot file
+    :param blocking: wait for the lock. Otherwise give up if another worker holds it.
+    :return: context manager yielding whether the lock was acquired
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.lock', 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,59 @@
+"""
+Records where the time goes while a worker boots and builds its first pages.
+Set STARTUP_REPORT=1 to print a report once the app is ready, and again after each page is built for the first time.
+"""
+import contextlib
+import os
+import sys
+import time
+
+STARTUP_REPORT = os.environ.get('STARTUP_REPORT', '0') == '1'
+
+started = time.perf_counter()
+stages = []
+last_mark = [started]
+
+
+def mark(stage):
+    """
+    Record the time spent since the previous mark (or since this module was imported) as a stage of the boot.
+    :param stage: what happened since the previous mark, e.g. 'import dash'
+    :return:
+    """
+    now = time.perf_counter()
+    stages.append((stage, now - last_mark[0]))
+    last_mark[0] = now
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """
+    Record the time spent in a with block as a stage.
+    :param stage:
+    :return:
+    """
+    block_started = time.perf_counter()
+    yield
+    stages.append((stage, time.perf_counter() - block_started))
+
+
+def get_report():
+    """
+    :return: text table of the recorded stages
+    """
+    width = max([len(stage) for stage, _ in stages] + [5])
+    lines = [f"{'Stage':<{width}}  Seconds"]
+    for stage, seconds in stages:
+        lines.append(f'{stage:<{width}}  {seconds:7.3f}')
+    lines.append(f"{'Total':<{width}}  {sum(seconds for _, seconds in stages):7.3f}")
+
+    return '\n'.join(lines)
+
+
+def print_report():
+    """
+    Print the report to stderr if STARTUP_REPORT is set.
+    :return:
+    """
+    if STARTUP_REPORT:
+        print(f'Startup report of process {os.getpid()}:\n{get_report()}', file=sys.stderr)
@@ -0,0 +1,215 @@
+"""
+Serves the frequency tables a page at a time. The tables use page_action, sort_action and filter_action 'custom': the
+browser only receives the rows of the current page, and sorting and filtering happen on the server.
+
+The rows of each table are ranked by every column once per data version (see TableIndex), so answering a page, sort or
+filter request costs a slice of a precomputed order rather than a sort of the table.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+from dash_table import DataTable
+
+from aggregates import PERCENTAGE_DECIMALS, get_summary
+from app import cached_by_data_version
+
+# Rows per page of the frequency tables.
+PAGE_SIZE = 10
+
+# Operators of the filter queries written by the DataTable filter row, symbols and names. Each may be prefixed with s
+# or i to compare text case sensitively or not, e.g. 'scontains' or 'i='. Text is compared case insensitively by
+# default.
+FILTER_OPERATORS = {
+    '>=': 'ge', '<=': 'le', '<': 'lt', '>': 'gt', '!=': 'ne', '=': 'eq',
+    'ge': 'ge', 'le': 'le', 'lt': 'lt', 'gt': 'gt', 'ne': 'ne', 'eq': 'eq',
+    'contains': 'contains', 'datestartswith': 'datestartswith',
+}
+
+FILTER_PART = re.compile(r'^\s*\{(?P<name>[^}]*)\}\s*(?P<case>[si]?)(?P<operator>>=|<=|!=|<|>|=|[a-z]+(?=\s))\s*(?P<value>.*?)\s*$')
+
+
+def split_filter_part(filter_part):
+    """
+    Parse one condition of a DataTable filter query, e.g. '{Frequency} >= 10' or '{Country} scontains Ger'.
+    :param filter_part: condition
+    :return: column, operator (one of ge, le, lt, gt, ne, eq, contains, datestartswith), value and whether text is
+        compared case sensitively, or Nones if the condition cannot be parsed
+    """
+    match = FILTER_PART.match(filter_part)
+    if match is None or match.group('operator') not in FILTER_OPERATORS or not match.group('value'):
+        return None, None, None, None
+
+    value = match.group('value')
+    quote = value[0]
+    if len(value) > 1 and quote == value[-1] and quote in ("'", '"', '`'):
+        value = value[1:-1].replace('\\' + quote, quote)
+    else:
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+
+    return match.group('name'), FILTER_OPERATORS[match.group('operator')], value, match.group('case') == 's'
+
+
+def get_filter_text(value):
+    """
+    :param value: value of a filter condition, see split_filter_part
+    :return: the value as text, whole numbers without decimals so that e.g. {Country} = 0 matches the answer '0'
+    """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class TableIndex:
+    """
+    Rows of a frequency table and their order by each column, ascending and descending.
+    """
+
+    def __init__(self, df_table):
+        """
+        :param df_table: frequency table without Total row, see get_frequency_table
+        """
+        self.df = df_table.reset_index(drop=True)
+        self.label = self.df.columns[0]
+        self.ranks = {}
+        self.orders = {}
+        for c in self.df.columns:
+            values = self.df[c]
+            if not pd.api.types.is_numeric_dtype(values):
+                values = values.astype(str)
+            # Dense ranks, so equal values tie when sorting by several columns.
+            rank = values.rank(method='dense').fillna(0).to_numpy(dtype='int64')
+            self.ranks[c] = rank
+            self.orders[(c, 'asc')] = np.argsort(rank, kind='stable')
+            self.orders[(c, 'desc')] = np.argsort(-rank, kind='stable')
+
+    def get_order(self, sort_by):
+        """
+        :param sort_by: sort_by property of the DataTable, list of {'column_id', 'direction'}
+        :return: positions of the rows in sorted order
+        """
+        sort_by = [s for s in sort_by or [] if s['column_id'] in self.ranks]
+        if not sort_by:
+            return np.arange(len(self.df.index))
+        if len(sort_by) == 1:
+            return self.orders[(sort_by[0]['column_id'], sort_by[0]['direction'])]
+
+        # lexsort sorts by the last key first.
+        keys = [self.ranks[s['column_id']] if s['direction'] == 'asc' else -self.ranks[s['column_id']]
+                for s in reversed(sort_by)]
+        return np.lexsort(keys)
+
+    def get_mask(self, filter_query):
+        """
+        :param filter_query: filter_query property of the DataTable, conditions joined by ' && '
+        :return: boolean array of the rows matching all conditions
+        """
+        mask = np.ones(len(self.df.index), dtype=bool)
+        for filter_part in filter_query.split(' && '):
+            name, operator, value, case_sensitive = split_filter_part(filter_part)
+            if name not in self.df.columns:
+                continue
+
+            column = self.df[name]
+            if operator == 'contains':
+                mask &= column.astype(str).str.contains(get_filter_text(value), case=case_sensitive,
+                                                        regex=False).to_numpy()
+            elif operator == 'datestartswith':
+                mask &= column.astype(str).str.startswith(get_filter_text(value)).to_numpy()
+            elif pd.api.types.is_numeric_dtype(column) and not isinstance(value, str):
+                mask &= getattr(column, operator)(value).to_numpy()
+            elif operator in ('eq', 'ne'):
+                text, value = column.astype(str), get_filter_text(value)
+                if not case_sensitive:
+                    text, value = text.str.lower(), value.lower()
+                mask &= getattr(text, operator)(value).to_numpy()
+            else:
+                # Ordering text, or numbers against text, matches nothing.
+                mask[:] = False
+
+        return mask
+
+    def get_page(self, page_current, page_size, sort_by, filter_query):
+        """
+        :param page_current: page number, from 0
+        :param page_size: rows per page
+        :param sort_by: sort_by property of the DataTable
+        :param filter_query: filter_query property of the DataTable
+        :return: records of the page followed by the Total row of all matching rows, and the number of pages
+        """
+        order = self.get_order(sort_by)
+        if filter_query:
+            order = order[self.get_mask(filter_query)[order]]
+
+        page_count = max(1, -(-len(order) // page_size))
+        start = (page_current or 0) * page_size
+        table_data = self.df.iloc[order[start:start + page_size]].to_dict('records')
+
+        frequency = self.df['Frequency'].to_numpy()
+        matching = int(frequency[order].sum())
+        percentage = matching / frequency.sum() * 100 if matching else 0.0
+        table_data.append({self.label: 'Total', 'Frequency': matching,
+                           'Percentage': round(float(percentage), PERCENTAGE_DECIMALS)})
+
+        return table_data, page_count
+
+
+@cached_by_data_version
+def get_summary_index(data, name, country=None, speciality=None):
+    """
+    Build the TableIndex of a summary. The result is reused until the data changes.
+    :param data: FormAggregates of the form data
+    :param name: name of a summary in SUMMARIES
+    :param country: country the responses are filtered by, None for all
+    :param speciality: speciality the responses are filtered by, None for all
+    :return: TableIndex
+    """
+    table_data, table_columns, df_table = get_summary(data.select(country, speciality), name)
+    return TableIndex(df_table)
+
+
+def get_summary_page(dashboard, name, page_current=0, page_size=PAGE_SIZE, sort_by=None, filter_query='',
+                     country=None, speciality=None):
+    """
+    :param dashboard: Dashboard
+    :param name: name of a summary in SUMMARIES
+    :param page_current: page number, from 0
+    :param page_size: rows per page
+    :param sort_by: sort_by property of the DataTable
+    :param filter_query: filter_query property of the DataTable
+    :param country: country the responses are filtered by, None for all
+    :param speciality: speciality the responses are filtered by, None for all
+    :return: records of the page and the number of pages, see TableIndex.get_page
+    """
+    index = get_summary_index(dashboard, name, country, speciality)
+    return index.get_page(page_current, page_size, sort_by, filter_query)
+
+
+def get_summary_table(dashboard, table_id, name, columns):
+    """
+    Build a DataTable showing a summary a page at a time. Its data and page count are filled in by a callback on its
+    page_current, page_size, sort_by and filter_query, which returns get_summary_page.
+    :param dashboard: Dashboard
+    :param table_id: id of the DataTable
+    :param name: name of a summary in SUMMARIES
+    :param columns: table columns, see get_frequency_table
+    :return: DataTable
+    """
+    table_data, page_count = get_summary_page(dashboard, name)
+
+    return DataTable(
+        id=table_id,
+        columns=columns,
+        data=table_data,
+        page_current=0,
+        page_size=PAGE_SIZE,
+        page_count=page_count,
+        page_action='custom',
+        sort_action='custom',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
+    )
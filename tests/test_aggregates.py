@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import CrossFilterCube, FormAggregates
+from benchmarks.synthetic import generate_form_data
+from tests.util import assert_same_aggregates, sort_counts
+
+SPECIALITY = 'What is your speciality?'
+
+
+@pytest.fixture(scope='module')
+def data():
+    data = generate_form_data(3000, seed=4)
+    # Unanswered questions, which count towards all countries or specialities but can't be selected.
+    rng = np.random.default_rng(4)
+    data.loc[rng.random(len(data.index)) < 0.05, 'country'] = np.nan
+    data.loc[rng.random(len(data.index)) < 0.05, SPECIALITY] = np.nan
+    data.loc[rng.random(len(data.index)) < 0.05, 'r_stamina'] = np.nan
+    return data
+
+
+def select_rows(data, country=None, speciality=None):
+    mask = pd.Series(True, index=data.index)
+    if country is not None:
+        mask &= data['country'] == country
+    if speciality is not None:
+        mask &= data[SPECIALITY] == speciality
+    return data[mask]
+
+
+@pytest.mark.parametrize('country, speciality', [
+    ('Japan', None), ('0', None), (None, 'Tank'), ('Narnia', 'Healer'), ('Japan', 'Support'),
+])
+def test_select_counts_the_selected_rows(data, country, speciality):
+    cube = CrossFilterCube(data.columns)
+    cube.add(data)
+    selected = select_rows(data, country, speciality)
+
+    rows, counts = cube.select(country, speciality)
+
+    assert rows == len(selected.index)
+    for c in cube.dimensions + cube.measures:
+        if c == 'day':
+            expected = selected['Timestamp'].dt.floor('D').value_counts()
+        else:
+            expected = selected[c].value_counts()
+        assert sort_counts(counts[c]) == sort_counts(expected[expected > 0]), c
+
+
+def test_unanswered_dimensions_count_towards_all(data):
+    cube = CrossFilterCube(data.columns)
+    cube.add(data)
+
+    rows, counts = cube.select()
+    assert rows == len(data.index)
+    # Missing answers are not a value of the column.
+    assert counts['country'].sum() == data['country'].count()
+    assert counts['r_stamina'].sum() == data['r_stamina'].count()
+
+    rows, _ = cube.select(speciality='Tank')
+    assert rows == (data[SPECIALITY] == 'Tank').sum()
+
+
+def test_unknown_values_select_nothing(data):
+    cube = CrossFilterCube(data.columns)
+    cube.add(data)
+
+    for country, speciality in [('Atlantis', None), (None, 'Bard'), ('Japan', 'Bard')]:
+        rows, counts = cube.select(country, speciality)
+        assert rows == 0
+        assert all(counts[c].empty for c in counts)
+
+
+def test_adding_chunks_gives_the_totals_of_all_rows(data):
+    aggregates = FormAggregates.from_frame(data.iloc[:0])
+    # Each chunk has the categories of its own answers, as when read from a download, so labels of the cube keep
+    # arriving with later chunks.
+    for start, stop in [(0, 1), (1, 400), (400, 401), (401, 1700), (1700, 3000)]:
+        chunk = data.iloc[start:stop].copy()
+        for c in chunk.columns:
+            if isinstance(chunk[c].dtype, pd.CategoricalDtype):
+                chunk[c] = chunk[c].cat.remove_unused_categories()
+        aggregates.add(chunk)
+
+    assert_same_aggregates(aggregates, FormAggregates.from_frame(data), countries=['Japan', '0', 'Narnia', 'Atlantis'],
+                           specialities=['Tank', 'Healer', 'DPS'])
+
+
+def test_copy_is_updated_separately(data):
+    aggregates = FormAggregates.from_frame(data.iloc[:1000])
+    copy = aggregates.copy()
+
+    copy.add(data.iloc[1000:])
+
+    assert_same_aggregates(copy, FormAggregates.from_frame(data), countries=['Japan'], specialities=['Tank'])
+    assert_same_aggregates(aggregates, FormAggregates.from_frame(data.iloc[:1000]), countries=['Japan'],
+                           specialities=['Tank'])
+
+
+def test_days_are_counted_sparsely(data):
+    cube = CrossFilterCube(data.columns)
+    cube.add(data.iloc[:1500])
+    cube.add(data.iloc[1500:])
+
+    countries, specialities, days, counts = cube.counts['day']
+    # One count per country, speciality and day with responses, sorted.
+    keys = list(zip(countries, specialities, days))
+    assert keys == sorted(set(keys))
+    assert counts.min() > 0
+    assert counts.sum() == len(data.index)
+    expected = data.groupby([data['country'].cat.codes + 1, data[SPECIALITY].cat.codes + 1,
+                             data['Timestamp'].dt.floor('D')]).size()
+    assert len(keys) == (expected > 0).sum()
@@ -0,0 +1,166 @@
+import threading
+import time
+
+import pytest
+
+import data_cache
+from data_cache import DataCache
+
+
+class Clock:
+    """
+    Stands in for the time module of data_cache, so tests move time forward instead of sleeping.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(data_cache, 'time', clock)
+    return clock
+
+
+class Loader:
+    """
+    Loader returning 1, 2, 3... that can be held until a test releases it, or made to fail.
+    """
+
+    def __init__(self, hold=False):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+        self.error = None
+        self.__name__ = 'loader'
+
+    def __call__(self, previous):
+        self.calls.append(previous)
+        self.started.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return len(self.calls)
+
+
+def wait_for_refresh():
+    for thread in threading.enumerate():
+        if thread.name == 'data-cache-refresh':
+            thread.join(5)
+
+
+def test_first_load_is_shared_by_concurrent_reads(clock):
+    loader = Loader(hold=True)
+    cache = DataCache(loader, ttl=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get())) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    # All readers are waiting before the load finishes.
+    deadline = time.monotonic() + 5
+    while cache.get_stats()['waits'] < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    loader.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == [1] * 5
+    assert loader.calls == [None]
+
+
+def test_failed_first_load_raises_for_every_reader(clock):
+    loader = Loader()
+    loader.error = ValueError('down')
+    cache = DataCache(loader, ttl=60)
+
+    with pytest.raises(ValueError):
+        cache.get()
+    assert cache.peek() is None
+
+
+def test_fresh_value_is_not_reloaded(clock):
+    loader = Loader()
+    cache = DataCache(loader, ttl=60)
+
+    assert cache.get() == 1
+    clock.now += 59
+    assert cache.get() == 1
+    assert len(loader.calls) == 1
+    assert cache.get_stats()['fresh_reads'] == 1
+
+
+def test_stale_value_is_served_while_refreshing(clock):
+    loader = Loader()
+    cache = DataCache(loader, ttl=60)
+    assert cache.get() == 1
+
+    loader.release.clear()
+    loader.started.clear()
+    clock.now += 60
+    # Returned at once, the refresh runs in the background.
+    assert cache.get() == 1
+    assert loader.started.wait(5)
+    # A refresh is already running, no second one starts.
+    assert cache.get() == 1
+    loader.release.set()
+    wait_for_refresh()
+
+    assert cache.get() == 2
+    assert loader.calls == [None, 1]
+
+
+def test_failed_refresh_keeps_value_and_backs_off(clock):
+    loader = Loader()
+    cache = DataCache(loader, ttl=60, backoff=5, max_backoff=12)
+    assert cache.get() == 1
+
+    loader.error = ValueError('down')
+    clock.now += 60
+    for backoff in [5, 10, 12, 12]:
+        calls = len(loader.calls)
+        assert cache.get() == 1
+        wait_for_refresh()
+        assert len(loader.calls) == calls + 1
+        # No new attempt before the backoff has passed.
+        clock.now += backoff - 1
+        assert cache.get() == 1
+        wait_for_refresh()
+        assert len(loader.calls) == calls + 1
+        clock.now += 1
+
+    assert cache.get_stats()['failures'] == 4
+
+    loader.error = None
+    assert cache.get() == 1
+    wait_for_refresh()
+    assert cache.get() == len(loader.calls)
+    assert cache.get_stats()['refreshes'] == 2
+
+
+def test_primed_value_is_served_and_refreshed(clock):
+    loader = Loader()
+    cache = DataCache(loader, ttl=60)
+    cache.prime('snapshot')
+
+    assert cache.get() == 'snapshot'
+    wait_for_refresh()
+    assert loader.calls == ['snapshot']
+    assert cache.get() == 1
+
+
+def test_on_refresh_gets_new_and_previous_value(clock):
+    refreshes = []
+    cache = DataCache(Loader(), ttl=60, on_refresh=lambda value, previous: refreshes.append((value, previous)))
+
+    cache.get()
+    clock.now += 60
+    cache.get()
+    wait_for_refresh()
+
+    assert refreshes == [(1, None), (2, 1)]
@@ -0,0 +1,127 @@
+import pytest
+
+import sources
+from aggregates import FormAggregates
+from loadtest.sheet_server import SheetServer
+from sources import RowHash, SheetSource, get_rows_version
+from tests.util import assert_same_aggregates
+
+CSV = b'"Timestamp","country"\n"8/1/2021 9:05:03","Japan"\n"8/1/2021 9:06:00","France"\n"8/1/2021 9:07:00",""\n'
+
+
+def test_rows_version_counts_rows_without_header():
+    assert get_rows_version(CSV).startswith('3-')
+    assert get_rows_version(CSV.split(b'\n')[0] + b'\n').startswith('0-')
+
+
+def test_rows_version_does_not_depend_on_how_the_csv_is_split():
+    row_hash = RowHash()
+    for start in range(0, len(CSV), 7):
+        row_hash.update(CSV[start:start + 7])
+
+    assert row_hash.get_version() == get_rows_version(CSV)
+    # Without the last line break.
+    assert get_rows_version(CSV.rstrip(b'\n')) == get_rows_version(CSV)
+
+
+def test_rows_version_continues_with_appended_rows():
+    lines = CSV.splitlines(keepends=True)
+    header, rows = lines[0], lines[1:]
+    # Downloads of later rows repeat the header.
+    version = get_rows_version(header + rows[1] + rows[2], get_rows_version(header + rows[0]))
+
+    assert version == get_rows_version(CSV)
+    assert get_rows_version(header, get_rows_version(CSV)) == get_rows_version(CSV)
+
+
+def test_rows_version_changes_with_rows():
+    assert get_rows_version(CSV.replace(b'Japan', b'Spain')) != get_rows_version(CSV)
+
+
+def test_rows_version_rejects_other_versions():
+    with pytest.raises(ValueError):
+        RowHash('4f2a9c1b77d0')
+
+
+@pytest.fixture
+def sheet():
+    server = SheetServer(2000, seed=1).start()
+    yield server
+    server.stop()
+
+
+def create_source(sheet, **kwargs):
+    return SheetSource('sheet-id', 'Sheet1', 'Form Responses 1', base_url=sheet.url, **kwargs)
+
+
+def test_whole_streamed_and_incremental_loads_agree(sheet, monkeypatch):
+    whole = create_source(sheet)
+    streamed = create_source(sheet, stream_bytes=2 ** 14)
+    incremental = create_source(sheet, incremental=True)
+
+    urls = []
+    get = sources.fetch.get
+    monkeypatch.setattr(sources.fetch, 'get', lambda url, **kwargs: urls.append(url) or get(url, **kwargs))
+
+    form_data = incremental.load()
+    assert form_data.aggregates.rows == 2000
+    for rows in [30, 1, 250]:
+        sheet.append(rows)
+        expected_offset = form_data.aggregates.rows
+        form_data = incremental.load(form_data)
+        # Only the rows after those already loaded are downloaded.
+        assert urls[-1].endswith('offset%20' + str(expected_offset))
+    assert form_data.data is None
+    assert form_data.aggregates.rows == 2281
+
+    for other in [whole.load(), streamed.load()]:
+        assert other.version == form_data.version
+        assert_same_aggregates(form_data.aggregates, other.aggregates, countries=['Japan', '0', 'Nowhere'],
+                               specialities=['Tank', 'Healer'])
+
+    # The aggregates of the whole load are those of its rows.
+    whole_load = whole.load()
+    assert_same_aggregates(whole_load.aggregates, FormAggregates.from_frame(whole_load.data), countries=['Japan'],
+                           specialities=['DPS'])
+
+
+def test_incremental_load_without_new_rows_keeps_version(sheet):
+    source = create_source(sheet, incremental=True)
+    form_data = source.load()
+
+    assert source.load(form_data) is form_data
+
+
+def test_unchanged_sheet_keeps_previous_load(sheet):
+    for source in [create_source(sheet), create_source(sheet, stream_bytes=2 ** 14)]:
+        form_data = source.load()
+        assert source.load(form_data).aggregates is form_data.aggregates
+
+
+@pytest.mark.parametrize('stream_bytes', [None, 2 ** 14])
+def test_header_only_sheet_has_no_rows(sheet, stream_bytes):
+    sheet.lines = []
+    source = create_source(sheet, stream_bytes=stream_bytes)
+
+    form_data = source.load()
+
+    assert form_data.aggregates.rows == 0
+    assert form_data.version == get_rows_version(sheet.header)
+    assert len(form_data.aggregates.columns) == 13
+    assert sheet.get_stats()['GET Sheet1'] == 1
+
+
+@pytest.mark.parametrize('stream_bytes', [None, 2 ** 14])
+def test_empty_sheet(sheet, stream_bytes):
+    source = create_source(sheet, stream_bytes=stream_bytes)
+    previous = source.load()
+    sheet.header, sheet.lines = b'', []
+
+    # Without a header, the columns are those of the previous load.
+    form_data = source.load(previous)
+    assert form_data.aggregates.rows == 0
+    assert list(form_data.aggregates.columns) == list(previous.aggregates.columns)
+
+    with pytest.raises(ValueError):
+        source.load()
+    assert sheet.get_stats()['GET Sheet1'] == 3
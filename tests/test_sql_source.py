@@ -0,0 +1,83 @@
+import pandas as pd
+import pytest
+import sqlalchemy as sa
+
+from aggregates import FormAggregates
+from benchmarks.synthetic import generate_form_data
+from sources import SQLSource
+from tests.util import assert_same_aggregates
+
+
+def insert_rows(url, data):
+    # Stored as text, like answers in a database table. Missing answers become NULL.
+    table = data.astype({c: object for c in data.columns if isinstance(data[c].dtype, pd.CategoricalDtype)})
+    table.to_sql('form_responses', sa.create_engine(url), index=False, if_exists='append')
+
+
+@pytest.fixture
+def database(tmp_path):
+    """
+    :return: url of a SQLite database with a table of form responses, and the responses
+    """
+    url = f'sqlite:///{tmp_path / "responses.db"}'
+    data = generate_form_data(3000, seed=2)
+    insert_rows(url, data)
+    return url, data
+
+
+def test_aggregates_match_those_of_the_rows(database):
+    url, data = database
+
+    form_data = SQLSource(url, 'form_responses').load()
+
+    assert form_data.data is None
+    assert_same_aggregates(form_data.aggregates, FormAggregates.from_frame(data),
+                           countries=['Japan', 'Narnia', '0', 'Nowhere'], specialities=['Tank', 'Support'])
+
+
+def test_unchanged_table_is_not_aggregated_again(database):
+    url, _ = database
+    source = SQLSource(url, 'form_responses')
+    form_data = source.load()
+
+    assert source.load(form_data) is form_data
+
+
+def test_version_changes_with_appended_rows(database):
+    url, data = database
+    source = SQLSource(url, 'form_responses')
+    form_data = source.load()
+
+    insert_rows(url, generate_form_data(10, start=data['Timestamp'].max(), seed=3))
+    new_form_data = source.load(form_data)
+
+    assert new_form_data.version != form_data.version
+    assert new_form_data.aggregates.rows == 3010
+
+
+def test_edits_of_older_rows_are_picked_up_by_the_reconcile(database):
+    url, _ = database
+    source = SQLSource(url, 'form_responses', reconcile=60)
+    form_data = source.load()
+    # Keeps the number of rows, the latest timestamp and the number of errors.
+    with sa.create_engine(url).begin() as conn:
+        conn.execute(sa.text("UPDATE form_responses SET country = 'Atlantis' WHERE rowid = 1"))
+
+    assert source.load(form_data) is form_data
+
+    # Aggregated reconcile seconds ago.
+    reconciled = source.load(form_data._replace(downloaded_at=form_data.downloaded_at - 60))
+    assert reconciled.version != form_data.version
+    assert reconciled.aggregates.counts['country']['Atlantis'] == 1
+
+
+def test_reconcile_without_changes_keeps_version(database):
+    url, _ = database
+    source = SQLSource(url, 'form_responses', reconcile=60)
+    form_data = source.load()
+
+    reconciled = source.load(form_data._replace(downloaded_at=form_data.downloaded_at - 60))
+
+    assert reconciled.version == form_data.version
+    assert reconciled.aggregates is form_data.aggregates
+    assert reconciled.downloaded_at > form_data.downloaded_at - 60
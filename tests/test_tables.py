@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+
+from aggregates import get_frequency_table
+from tables import TableIndex, split_filter_part
+
+
+@pytest.mark.parametrize('filter_part, expected', [
+    ('{Frequency} >= 10', ('Frequency', 'ge', 10.0, False)),
+    ('{Frequency} < 2.5', ('Frequency', 'lt', 2.5, False)),
+    ('{Frequency} ne 3', ('Frequency', 'ne', 3.0, False)),
+    ('{Country} contains Ger', ('Country', 'contains', 'Ger', False)),
+    ('{Country} scontains Ger', ('Country', 'contains', 'Ger', True)),
+    ('{Country} icontains ger', ('Country', 'contains', 'ger', False)),
+    ('{Country} s= "United States"', ('Country', 'eq', 'United States', True)),
+    ('{Country} i= france', ('Country', 'eq', 'france', False)),
+    ('{Country} = "Cote d\\"Ivoire"', ('Country', 'eq', 'Cote d"Ivoire', False)),
+    # Quoted numbers are text.
+    ('{Country} = \'0\'', ('Country', 'eq', '0', False)),
+    ('{Timestamp} datestartswith 2021-08', ('Timestamp', 'datestartswith', '2021-08', False)),
+    ('{Fire Rate} <= 4', ('Fire Rate', 'le', 4.0, False)),
+])
+def test_split_filter_part(filter_part, expected):
+    assert split_filter_part(filter_part) == expected
+
+
+@pytest.mark.parametrize('filter_part', [
+    '', 'Frequency >= 10', '{Frequency} >=', '{Frequency} between 1', '{Frequency} xcontains 1', '{Country} contains',
+])
+def test_split_filter_part_rejects_invalid_conditions(filter_part):
+    assert split_filter_part(filter_part) == (None, None, None, None)
+
+
+@pytest.fixture
+def table_index():
+    counts = pd.Series({'Germany': 40, 'France': 30, 'germany (east)': 20, 'Japan': 10, '0': 5})
+    return TableIndex(get_frequency_table(counts, 'Country')[2])
+
+
+def get_countries(table_index, filter_query, sort_by=None):
+    table_data, _ = table_index.get_page(0, 10, sort_by, filter_query)
+    return [record['Country'] for record in table_data[:-1]]
+
+
+def test_filters_compare_text_case_insensitively_by_default(table_index):
+    assert get_countries(table_index, '{Country} contains ger') == ['Germany', 'germany (east)']
+    assert get_countries(table_index, '{Country} scontains Ger') == ['Germany']
+    assert get_countries(table_index, '{Country} = germany') == ['Germany']
+    assert get_countries(table_index, '{Country} s= germany') == []
+    assert get_countries(table_index, '{Country} != germany') == ['France', 'germany (east)', 'Japan', '0']
+
+
+def test_filters_compare_numbers(table_index):
+    assert get_countries(table_index, '{Frequency} >= 20 && {Frequency} < 40') == ['France', 'germany (east)']
+    # Numbers typed in a text column are compared as written.
+    assert get_countries(table_index, '{Country} = 0') == ['0']
+    assert get_countries(table_index, '{Country} contains 0') == ['0']
+    # Ordering text matches nothing.
+    assert get_countries(table_index, '{Country} > A') == []
+
+
+def test_unknown_columns_and_invalid_conditions_are_ignored(table_index):
+    assert len(get_countries(table_index, '{Capital} = Paris && {Frequency}')) == 5
+
+
+def test_total_row_counts_matching_rows(table_index):
+    table_data, page_count = table_index.get_page(0, 2, [{'column_id': 'Country', 'direction': 'asc'}],
+                                                  '{Frequency} > 5')
+
+    assert [record['Country'] for record in table_data[:-1]] == ['France', 'Germany']
+    assert table_data[-1] == {'Country': 'Total', 'Frequency': 100, 'Percentage': 95.2}
+    assert page_count == 2
+
+
+def test_pages_are_sorted_by_several_columns():
+    counts = pd.Series({'b': 2, 'a': 2, 'c': 1})
+    table_index = TableIndex(get_frequency_table(counts, 'Value')[2])
+    sort_by = [{'column_id': 'Frequency', 'direction': 'asc'}, {'column_id': 'Value', 'direction': 'desc'}]
+
+    table_data, _ = table_index.get_page(0, 10, sort_by, '')
+
+    assert [record['Value'] for record in table_data[:-1]] == ['c', 'b', 'a']
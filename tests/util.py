@@ -0,0 +1,46 @@
+import pandas as pd
+
+from aggregates import TIME_GRAINS
+
+
+def sort_counts(counts):
+    """
+    :param counts: value counts
+    :return: the counts as a dict, which compares equal whatever the order of the values and the dtype of the index
+    """
+    return {value: int(count) for value, count in counts.items()}
+
+
+def assert_same_aggregates(actual, expected, countries=(), specialities=()):
+    """
+    Compare two FormAggregates of the same rows: totals, frequencies, timelines and the cross filtered totals of the
+    given countries and specialities.
+    :param actual: FormAggregates
+    :param expected: FormAggregates
+    :param countries: countries to compare the selections of
+    :param specialities: specialities to compare the selections of
+    :return:
+    """
+    assert list(actual.columns) == list(expected.columns)
+    assert actual.rows == expected.rows
+    assert actual.errors == expected.errors
+    assert actual.counts.keys() == expected.counts.keys()
+    for c in expected.counts:
+        assert sort_counts(actual.counts[c]) == sort_counts(expected.counts[c]), c
+    for grain in TIME_GRAINS:
+        pd.testing.assert_series_equal(actual.period_counts(grain), expected.period_counts(grain), check_names=False,
+                                       check_freq=False)
+
+    selections = [(country, None) for country in countries] + [(None, speciality) for speciality in specialities]
+    selections += [(country, speciality) for country in countries for speciality in specialities]
+    for country, speciality in selections:
+        actual_selection = actual.select(country, speciality)
+        expected_selection = expected.select(country, speciality)
+        assert actual_selection.rows == expected_selection.rows, (country, speciality)
+        assert actual_selection.errors == expected_selection.errors, (country, speciality)
+        for c in expected.counts:
+            assert sort_counts(actual_selection.counts[c]) == sort_counts(expected_selection.counts[c]), \
+                (country, speciality, c)
+        for grain in ['day', 'week']:
+            assert sort_counts(actual_selection.timeline[grain]) == sort_counts(expected_selection.timeline[grain]), \
+                (country, speciality, grain)